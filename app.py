@@ -1,28 +1,24 @@
 import os
 import json
 import openai
-import threading
-import datetime
 import traceback
 import hmac
 import hashlib
 import base64
-import time
 import logging
 import sys
 
-from flask import Flask, request, abort
+from flask import Flask, request, abort, Response
 from dotenv import load_dotenv
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage, FollowEvent
 
 from tone_utils import get_welcome_message
+from diary_classifier import classify_command
 from google_sheets import (
     is_test_user, append_user_to_sheet, append_user_diary_entry,
-    get_usage_count, log_usage, get_approved_users, log_feedback,
-    get_newly_approved_users, mark_premium_notified, append_diary_sample_to_sheet,
-    connect_sheet, get_user_info
+    get_approved_users, get_user_info
 )
 from premium_setting import (
     start_premium_setting, is_in_premium_setting, handle_premium_step,
@@ -30,22 +26,40 @@ from premium_setting import (
     premium_state
 )
 from user_register import handle_registration_step, is_registering
-from diary_generator import generate_simple_diary
+from diary_generator import generate_diary, commit_usage, prefetch, get_generation_metrics, STREAM_GENERATION
+from prompt_builder import get_prompt_metrics
+import webhook_worker
+import pregeneration
+import approval_notifier
+import diary_similarity
+import sample_index
+import diary_ingest
+import usage_quota
+import feedback_index
+import feedback_store
+from feedback_index import log_feedback
+import log_archive
+from usage_quota import FREE_DAILY_LIMIT
+import instrumentation
+from instrumentation import timed
+import session_store
 
 # ログ設定
 for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
 
 # ログフォーマット
-log_format = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+log_format = logging.Formatter("%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s")
 
 # ファイルログ設定（app.log）
 file_handler = logging.FileHandler("app.log", encoding="utf-8")
 file_handler.setFormatter(log_format)
+file_handler.addFilter(instrumentation.TraceIdFilter())
 
 # 標準出力ログ設定（Renderのログタブにも出る）
 stream_handler = logging.StreamHandler(sys.stdout)
 stream_handler.setFormatter(log_format)
+stream_handler.addFilter(instrumentation.TraceIdFilter())
 
 # ルートロガー設定
 logging.basicConfig(level=logging.INFO, handlers=[file_handler, stream_handler])
@@ -64,16 +78,27 @@ handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET").strip())
 
 app = Flask(__name__)
 
-# 各種ステート
-latest_diaries = {}
-pending_keyword_request = {}
-temporary_keywords = {}
-adding_diary_users = set()
-user_status = {}
+# ✅ Webhookの非同期処理モード（キューに積んで即 200 を返す）
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "false").lower() == "true"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+
+# ✅ バックグラウンドの定期処理。import しただけでは動かさず、サーバーの起動時に1回呼ぶ
+# （python app.py では __main__、gunicorn では gunicorn.conf.py の post_worker_init から）
+def start_background_jobs():
+    # プレミアム承認の通知（複数プロセスでもロックを取れた1つだけが動く）
+    approval_notifier.start(line_bot_api)
+    # ログタブの定期整理（古い行を月別アーカイブへ。1日1回）
+    log_archive.start()
+
+# 各種ステート（SESSION_BACKEND で保存先を切り替え）
+latest_diaries = session_store.namespace("latest_diaries")
+pending_keyword_request = session_store.namespace("pending_keyword_request")
+temporary_keywords = session_store.namespace("temporary_keywords")
+adding_diary_users = session_store.namespace("adding_diary_users")
+user_status = session_store.namespace("user_status")
 
 os.makedirs("diary_data/sample", exist_ok=True)
-os.makedirs("feedback/good", exist_ok=True)
-os.makedirs("feedback/bad", exist_ok=True)
 
 DIARY_TYPE_MAP = {
     "1": "shukkin",
@@ -82,60 +107,157 @@ DIARY_TYPE_MAP = {
 }
 
 def get_diary_type(text):
-    if "出勤" in text:
-        return "shukkin"
-    elif "退勤" in text:
-        return "taikin"
-    elif "お礼" in text:
-        return "orei"
-    else:
-        return None
+    return classify_command(text)
 
 @app.route("/callback", methods=["POST"])
 def callback():
     signature = request.headers.get("X-Line-Signature", "")
     body = request.get_data(as_text=True)
 
-    channel_secret = os.getenv("LINE_CHANNEL_SECRET").strip().encode('utf-8')
-    body_bytes = body.encode('utf-8')
-    hash = hmac.new(channel_secret, body_bytes, hashlib.sha256).digest()
-    expected_signature = base64.b64encode(hash).decode('utf-8')
+    with timed("signature"):
+        channel_secret = os.getenv("LINE_CHANNEL_SECRET").strip().encode('utf-8')
+        body_bytes = body.encode('utf-8')
+        hash = hmac.new(channel_secret, body_bytes, hashlib.sha256).digest()
+        expected_signature = base64.b64encode(hash).decode('utf-8')
+        verified = hmac.compare_digest(signature, expected_signature)
 
-    if not hmac.compare_digest(signature, expected_signature):
+    if not verified:
         print("❌ 検証NG！署名が一致しません")
         abort(400)
 
+    if WEBHOOK_ASYNC:
+        webhook_worker.start_workers(process_webhook, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+        if webhook_worker.enqueue(get_event_user_id(body), body, signature):
+            return "OK"
+        logging.warning("[Webhook] キューが満杯のため同期処理します")
+
     try:
-        handler.handle(body, signature)
+        with timed("webhook", mode="sync"):
+            handler.handle(body, signature)
     except InvalidSignatureError:
         print("❌ LINE SDKレベルの署名検証に失敗")
         abort(400)
     return "OK"
 
+# ✅ 振り分け用に先頭イベントの user_id を取り出す
+def get_event_user_id(body):
+    try:
+        events = json.loads(body).get("events", [])
+        return events[0]["source"].get("userId", "") if events else ""
+    except (ValueError, KeyError, AttributeError):
+        return ""
+
+# ✅ ワーカースレッドで実行されるイベント処理
+def process_webhook(body, signature):
+    try:
+        with timed("webhook", mode="async"):
+            handler.handle(body, signature)
+    except InvalidSignatureError:
+        print("❌ LINE SDKレベルの署名検証に失敗")
+
 @app.route("/", methods=["GET", "HEAD"])
 def health_check():
     return "OK", 200
 
+# ✅ Prometheus 形式のメトリクス（段階別レイテンシ・トークン数など）
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(instrumentation.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+instrumentation.register_gauge("webhook_queue_depth", lambda: webhook_worker.get_metrics()["queue_depth"])
+instrumentation.register_gauge("approval_pending", lambda: approval_notifier.get_metrics()["pending"])
+
+@app.route("/webhook_stats", methods=["GET"])
+def webhook_stats():
+    return webhook_worker.get_metrics(), 200
+
+@app.route("/pregeneration_stats", methods=["GET"])
+def pregeneration_stats():
+    return pregeneration.get_metrics(), 200
+
+@app.route("/approval_stats", methods=["GET"])
+def approval_stats():
+    return approval_notifier.get_metrics(), 200
+
+@app.route("/generation_stats", methods=["GET"])
+def generation_stats():
+    return {"latency": get_generation_metrics(), "prompt": get_prompt_metrics()}, 200
+
+@app.route("/archive_stats", methods=["GET"])
+def archive_stats():
+    return log_archive.get_metrics(), 200
+
+@app.route("/quota_stats", methods=["GET"])
+def quota_stats():
+    return usage_quota.get_metrics(), 200
+
+@app.route("/feedback_stats", methods=["GET"])
+def feedback_stats():
+    return feedback_index.get_metrics(), 200
+
+@app.route("/similarity_stats", methods=["GET"])
+def similarity_stats():
+    return diary_similarity.get_metrics(), 200
+
+# ✅ reply_token で返信。期限切れなどで失敗したら push に切り替え
+def send_reply(event, message):
+    try:
+        with timed("line", op="reply"):
+            line_bot_api.reply_message(event.reply_token, message)
+    except LineBotApiError as e:
+        logging.warning(f"[返信] reply失敗のためpushで送信: {e.status_code} {e.error.message}")
+        with timed("line", op="push"):
+            line_bot_api.push_message(event.source.user_id, message)
+
+# ✅ 日記を生成して返信。ストリーミング時は先に「生成中」を返し、完成後に push で送る
+# 作り置きがある時など、すぐ返せる場合は ack=False で通常の返信にする
+# 直近の日記とほぼ同じなら regenerate（省略時は generate）で1回だけ作り直す
+def send_generated_diary(event, user_id, diary_type, generate, ack=True, regenerate=None):
+    ack = ack and STREAM_GENERATION
+    if ack:
+        send_reply(event, TextSendMessage(text="✍️ 日記を作成中だよ…少しだけ待っててね♪"))
+
+    # generate / regenerate は (本文, 使用回数) を返す。使用回数は実際に送る日記の分だけ数える
+    generated_diary, usage = generate()
+    retry = {}
+    def regenerate_diary():
+        retry["text"], retry["usage"] = (regenerate or generate)()
+        return retry["text"]
+    generated_diary = diary_similarity.avoid_repeat(user_id, generated_diary, regenerate_diary)
+    if retry.get("text"):
+        usage = retry["usage"]
+    latest_diaries[user_id] = {"type": diary_type, "text": generated_diary}
+    reply_text = f"📝 生成された日記：\n{generated_diary}\n\n気に入ったら「👍」微妙なら「👎」で教えてね♪"
+
+    if ack:
+        with timed("line", op="push"):
+            line_bot_api.push_message(user_id, TextSendMessage(text=reply_text))
+    else:
+        send_reply(event, TextSendMessage(text=reply_text))
+    commit_usage(usage)
+
 @handler.add(FollowEvent)
 def handle_follow(event):
+    instrumentation.start_trace(getattr(event, "webhook_event_id", None))
     user_id = event.source.user_id
     logging.info(f"[フォロー] user_id={user_id}")
     welcome_text = get_welcome_message()
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=welcome_text))
+    send_reply(event, TextSendMessage(text=welcome_text))
 
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
+    instrumentation.start_trace(getattr(event, "webhook_event_id", None))
     try:
         user_id = event.source.user_id
         message_text = event.message.text.strip()
 
         # 登録の競合を防ぐためのチェック
         if is_registering(user_id) and message_text == "プレミアム登録":
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠️ 情報登録が進行中です。完了後にプレミアム登録を行ってください。"))
+            send_reply(event, TextSendMessage(text="⚠️ 情報登録が進行中です。完了後にプレミアム登録を行ってください。"))
             return
 
         if is_in_premium_setting(user_id) and message_text == "情報を登録する":
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠️ プレミアム登録が進行中です。完了後に情報登録を行ってください。"))
+            send_reply(event, TextSendMessage(text="⚠️ プレミアム登録が進行中です。完了後に情報登録を行ってください。"))
             return
 
         logging.info(f"[受信] user_id={user_id}, message='{message_text}'")
@@ -148,81 +270,80 @@ def handle_message(event):
         if message_text == "プレミアム登録":
             user_info = get_user_info(user_id)
             if user_info and user_info.get("is_premium") == True:
-                line_bot_api.reply_message(
-                    event.reply_token,
+                send_reply(
+                    event,
                     TextSendMessage(text="✅ 現在プレミアム登録済みです。\n変更をご希望の場合は「変更希望」と送ってね😊")
                 )
                 return
             reply = start_premium_setting(user_id)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+            send_reply(event, TextSendMessage(text=reply))
             return
 
         if message_text == "情報を登録する":
             logging.info(f"[登録開始] user_id={user_id}")
+            pregeneration.discard(user_id)
             reply = handle_registration_step(user_id, None)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+            send_reply(event, TextSendMessage(text=reply))
             return
 
         if is_registering(user_id):
             reply = handle_registration_step(user_id, message_text)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+            send_reply(event, TextSendMessage(text=reply))
             return
 
         if is_in_premium_setting(user_id):
             reply = handle_premium_step(user_id, message_text)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+            send_reply(event, TextSendMessage(text=reply))
             return
 
         if message_text == "日記追加":
             if user_id in get_approved_users():
                 user_status[user_id] = {"mode": "select_diary_type"}
-                line_bot_api.reply_message(
-                    event.reply_token,
+                send_reply(
+                    event,
                     TextSendMessage("追加する日記の種類を番号で教えてね\n1.出勤\n2.退勤\n3.お礼")
                 )
             else:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage("⚠️ この機能はプレミアムユーザー限定です。"))
+                send_reply(event, TextSendMessage("⚠️ この機能はプレミアムユーザー限定です。"))
             return
         if user_status.get(user_id, {}).get("mode") == "select_diary_type":
             diary_type = DIARY_TYPE_MAP.get(message_text)
             if diary_type:
                 user_status[user_id] = {"mode": "diary_add", "diary_type": diary_type}
-                line_bot_api.reply_message(
-                    event.reply_token,
+                send_reply(
+                    event,
                     TextSendMessage(text=f"✏️ {diary_type}追加モードになりました。\n空行で区切って複数の日記を送ってね♪")
                 )
             else:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage("番号は 1〜3 の中から選んでね♪"))
+                send_reply(event, TextSendMessage("番号は 1〜3 の中から選んでね♪"))
             return
 
         if user_status.get(user_id, {}).get("mode") == "diary_add":
             diary_type = user_status[user_id]["diary_type"]
-            entries = [e.strip() for e in message_text.split("\n\n") if e.strip()]
-            now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            sheet = connect_sheet("DiaryUserData", "PremiumDiarySamples")
-            for entry in entries:
-                sheet.append_row([user_id, diary_type, now, entry])
+            added, duplicates = diary_ingest.summarize(diary_ingest.ingest_diaries(user_id, message_text, diary_type))
             user_status[user_id] = {}
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(f"✅ {len(entries)}件の日記を追加しました！ありがとう♪"))
+            reply_text = f"✅ {added}件の日記を追加しました！ありがとう♪"
+            if duplicates:
+                reply_text += f"\n（{duplicates}件は登録済みのためスキップしたよ）"
+            send_reply(event, TextSendMessage(reply_text))
             return
 
         if message_text in ["👍", "👎"] and user_id in latest_diaries:
             feedback_type = "good" if message_text == "👍" else "bad"
-            folder = os.path.join("feedback", feedback_type, user_id)
-            os.makedirs(folder, exist_ok=True)
             diary_data = latest_diaries[user_id]
-            filename = f"{diary_data['type']}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-            with open(os.path.join(folder, filename), "w", encoding="utf-8") as f:
-                f.write(diary_data['text'])
+            feedback_store.save(user_id, feedback_type, diary_data['type'], diary_data['text'])
             log_feedback(user_id=user_id, diary_type=diary_data['type'], result=feedback_type, diary_text=diary_data['text'])
-            line_bot_api.reply_message(event.reply_token, TextSendMessage("フィードバックありがとうございます！保存しました✨"))
+            if feedback_type == "good":
+                sample_index.add(user_id, "feedback", diary_data['type'], diary_data['text'])
+            send_reply(event, TextSendMessage("フィードバックありがとうございます！保存しました✨"))
             return
 
-        approved_users = get_approved_users()
-        user_info = get_user_info(user_id)
+        fetched = prefetch(approved_users=get_approved_users, user_info=lambda: get_user_info(user_id))
+        approved_users = fetched["approved_users"]
+        user_info = fetched["user_info"]
         if not user_info or not user_info.get("name") or not user_info.get("tone"):
-             line_bot_api.reply_message(
-                 event.reply_token,
+             send_reply(
+                 event,
                  TextSendMessage(
                      text="📝 まだ情報登録が完了していないみたいです。\n「情報を登録する」と送って、先にユーザー登録をしてくださいね♪"
                  )
@@ -230,7 +351,7 @@ def handle_message(event):
              return
 
         if not user_info:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage("ユーザー情報が見つかりません。『情報を登録する』と送ってね♪"))
+            send_reply(event, TextSendMessage("ユーザー情報が見つかりません。『情報を登録する』と送ってね♪"))
             return
 
         if user_id in pending_keyword_request:
@@ -238,63 +359,52 @@ def handle_message(event):
             keyword_text = message_text if user_id in approved_users else None
             if keyword_text:
                 temporary_keywords[user_id] = keyword_text
-            log_usage(user_id)
-            generated_diary = generate_simple_diary(user_info, diary_type, keyword_text)
-            latest_diaries[user_id] = {"type": diary_type, "text": generated_diary}
-            reply_text = f"📝 生成された日記：\n{generated_diary}\n\n気に入ったら「👍」微妙なら「👎」で教えてね♪"
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            usage_quota.try_consume(user_id, limit=None)
+            send_generated_diary(
+                event, user_id, diary_type,
+                lambda: generate_diary(user_info, diary_type, keyword_text)
+            )
             return
 
         diary_type = get_diary_type(message_text)
 
         if diary_type and user_id in approved_users:
             pending_keyword_request[user_id] = diary_type
-            line_bot_api.reply_message(
-               event.reply_token,
+            send_reply(
+               event,
                 TextSendMessage("📝 入れて欲しいキーワードや内容があれば、読点（、）で区切って教えてください♪")
             )
             return
 
 
-        usage_count = get_usage_count(user_id)
-        if usage_count >= 3 and not is_test_user(user_id):
+        # 上限の判定と加算を同時に行う（続けて送られても上限を超えない）
+        unlimited = is_test_user(user_id)
+        allowed, usage_count = usage_quota.try_consume(user_id, limit=None if unlimited else FREE_DAILY_LIMIT)
+        if not allowed:
             reply_text = (
                 "⚠️ 本日の無料分はこれでラストだよっ💦\n"
                 "明日また会えるの楽しみにしてるねっ💕\n"
                 "▶️ プレミアム登録すれば制限なしで使えるよ！"
             )
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+            send_reply(event, TextSendMessage(text=reply_text))
             return
 
-        log_usage(user_id)
-        generated_diary = generate_simple_diary(user_info, diary_type)
-        latest_diaries[user_id] = {"type": diary_type, "text": generated_diary}
-        reply_text = f"📝 生成された日記：\n{generated_diary}\n\n気に入ったら「👍」微妙なら「👎」で教えてね♪"
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
+        pregenerated = pregeneration.take(user_id, diary_type)
+        send_generated_diary(
+            event, user_id, diary_type,
+            lambda: pregenerated or generate_diary(user_info, diary_type),
+            ack=not pregenerated,
+            regenerate=lambda: generate_diary(user_info, diary_type)
+        )
+        # 明日に持ち越さないよう、今日の無料枠がまだ残っている時だけ次の1通を作り置き
+        if usage_count < FREE_DAILY_LIMIT or unlimited:
+            pregeneration.schedule(user_info, diary_type)
 
     except Exception:
         traceback.print_exc()
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="⚠️ 内部エラーが発生しました。"))
-
-def notify_newly_approved_users():
-    while True:
-        try:
-            newly_approved = get_newly_approved_users()
-            for row in newly_approved:
-                user_id = row.get("user_id")
-                if user_id:
-                    message = (
-                        "✅ プレミアム登録が承認されました！\n"
-                        "いつでもプレミアム設定が反映された写メ日記を作れるよ✨\n"
-                        "「出勤」「退勤」「お礼」って送ってね😊"
-                    )
-                    line_bot_api.push_message(user_id, TextSendMessage(text=message))
-                    mark_premium_notified(user_id)
-        except Exception as e:
-            print("❌ プレミアム承認チェック中にエラー:", e)
-        time.sleep(60)
+        send_reply(event, TextSendMessage(text="⚠️ 内部エラーが発生しました。"))
 
 if __name__ == "__main__":
-    threading.Thread(target=notify_newly_approved_users, daemon=True).start()
+    start_background_jobs()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+import threading
+
+from linebot.models import TextSendMessage
+
+from google_sheets import get_user_status_snapshot, mark_premium_notified_many
+
+try:
+    import fcntl
+except ImportError:  # Windows ではロックなし（単一プロセス前提）
+    fcntl = None
+
+# ✅ プレミアム承認の通知スケジューラ
+# 同じサーバー上のプロセスのうちロックを取れた1つだけが動く（リーダー）
+# 前回のスナップショットと比べて変化した行だけを見て、承認済み・未通知のユーザーにまとめて送る
+
+APPROVAL_NOTIFIER_ENABLED = os.getenv("APPROVAL_NOTIFIER", "true").lower() == "true"
+APPROVAL_NOTIFIER_LOCK_FILE = os.getenv("APPROVAL_NOTIFIER_LOCK_FILE", "approval_notifier.lock")
+
+# ✅ 確認間隔（秒）。変化がなければ最大値まで倍々に延ばし、変化があれば最小値に戻す
+APPROVAL_POLL_MIN_INTERVAL = int(os.getenv("APPROVAL_POLL_MIN_INTERVAL", "15"))
+APPROVAL_POLL_MAX_INTERVAL = int(os.getenv("APPROVAL_POLL_MAX_INTERVAL", "300"))
+
+# ✅ LINE multicast の1回あたりの最大宛先数
+MULTICAST_LIMIT = 500
+
+APPROVAL_MESSAGE = (
+    "✅ プレミアム登録が承認されました！\n"
+    "いつでもプレミアム設定が反映された写メ日記を作れるよ✨\n"
+    "「出勤」「退勤」「お礼」って送ってね😊"
+)
+
+_lock = threading.Lock()
+_thread = None
+_lock_file = None
+_snapshot = None
+_pending = {}      # user_id → 承認を検知した時刻
+_unmarked = set()  # 送信済みだが通知済みの書き込みに失敗したユーザー
+
+metrics = {
+    "leader": False,
+    "polls": 0,
+    "changed_rows": 0,
+    "notified": 0,
+    "multicast_calls": 0,
+    "push_calls": 0,
+    "failed": 0,
+    "interval_seconds": APPROVAL_POLL_MIN_INTERVAL,
+    "poll_seconds_last": 0.0,
+    "poll_seconds_max": 0.0,
+    "notify_latency_seconds_total": 0.0,
+    "notify_latency_seconds_max": 0.0,
+}
+
+def start(line_bot_api):
+    global _thread
+    if not APPROVAL_NOTIFIER_ENABLED:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, args=(line_bot_api,), name="approval-notifier", daemon=True)
+        _thread.start()
+
+def get_metrics():
+    with _lock:
+        snapshot = dict(metrics)
+        snapshot["pending"] = len(_pending)
+    return snapshot
+
+# 🔧 リーダーロック（プロセスが落ちればOSが解放するので、他のプロセスが引き継げる）
+def _acquire_leader_lock():
+    global _lock_file
+    if fcntl is None:
+        return True
+    lock_file = open(APPROVAL_NOTIFIER_LOCK_FILE, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+def _run(line_bot_api):
+    while not _acquire_leader_lock():
+        time.sleep(APPROVAL_POLL_MAX_INTERVAL)
+    with _lock:
+        metrics["leader"] = True
+    logging.info("[承認通知] このプロセスで承認通知を担当します")
+
+    interval = APPROVAL_POLL_MIN_INTERVAL
+    while True:
+        try:
+            changed = _poll(line_bot_api)
+        except Exception as e:
+            logging.warning(f"[承認通知] 承認チェック中にエラー: {e}")
+            with _lock:
+                metrics["failed"] += 1
+            changed = False
+        interval = APPROVAL_POLL_MIN_INTERVAL if changed else min(interval * 2, APPROVAL_POLL_MAX_INTERVAL)
+        with _lock:
+            metrics["interval_seconds"] = interval
+        time.sleep(interval)
+
+# 🔧 1回分の確認。変化した行があれば True
+def _poll(line_bot_api):
+    global _snapshot
+    started_at = time.monotonic()
+    if _unmarked:
+        _mark_notified(list(_unmarked))
+    current = get_user_status_snapshot()
+    previous = _snapshot or {}
+    changed = {user_id: state for user_id, state in current.items() if previous.get(user_id) != state}
+    _snapshot = current
+
+    for user_id, (status, notified) in changed.items():
+        if status == "承認済" and not notified and user_id not in _unmarked:
+            _pending.setdefault(user_id, started_at)
+    # 承認取り消し・他経路で通知済みになったものは送らない
+    for user_id in list(_pending):
+        status, notified = current.get(user_id, ("", False))
+        if status != "承認済" or notified:
+            del _pending[user_id]
+
+    elapsed = time.monotonic() - started_at
+    with _lock:
+        metrics["polls"] += 1
+        metrics["changed_rows"] += len(changed)
+        metrics["poll_seconds_last"] = elapsed
+        metrics["poll_seconds_max"] = max(metrics["poll_seconds_max"], elapsed)
+
+    if _pending:
+        _notify(line_bot_api, list(_pending))
+    return bool(changed)
+
+def _notify(line_bot_api, user_ids):
+    message = TextSendMessage(text=APPROVAL_MESSAGE)
+    for i in range(0, len(user_ids), MULTICAST_LIMIT):
+        chunk = user_ids[i:i + MULTICAST_LIMIT]
+        try:
+            if len(chunk) == 1:
+                line_bot_api.push_message(chunk[0], message)
+            else:
+                line_bot_api.multicast(chunk, message)
+        except Exception as e:
+            # 送れなかった分は次回また送る
+            logging.warning(f"[承認通知] 送信に失敗 ({len(chunk)}件): {e}")
+            with _lock:
+                metrics["failed"] += 1
+            continue
+
+        _mark_notified(chunk)
+        now = time.monotonic()
+        with _lock:
+            metrics["multicast_calls" if len(chunk) > 1 else "push_calls"] += 1
+            metrics["notified"] += len(chunk)
+            for user_id in chunk:
+                latency = now - _pending.pop(user_id)
+                metrics["notify_latency_seconds_total"] += latency
+                metrics["notify_latency_seconds_max"] = max(metrics["notify_latency_seconds_max"], latency)
+                status, _ = _snapshot.get(user_id, ("承認済", False))
+                _snapshot[user_id] = (status, True)
+
+# 🔧 送信済みなので、書き込みに失敗しても再送はせず書き込みだけ次回やり直す
+def _mark_notified(user_ids):
+    try:
+        mark_premium_notified_many(user_ids)
+        _unmarked.difference_update(user_ids)
+    except Exception as e:
+        logging.warning(f"[承認通知] 通知済みの書き込みに失敗 ({len(user_ids)}件): {e}")
+        _unmarked.update(user_ids)
@@ -0,0 +1,199 @@
+import os
+import re
+import time
+import random
+import argparse
+import tempfile
+
+# ✅ 小さな計測スクリプト（外部サービスなしで動く）
+#
+# 使い方:
+#   python benchmarks.py tone                 # adjust_tone_style の変更前後（全15口調）
+#   python benchmarks.py ingest               # 日記の一括取り込みの件数/秒と Sheets の呼び出し回数
+#   python benchmarks.py premium_settings     # ローカルDBのプレミアム設定の読み書き件数/秒
+#
+# 往復回数（Sheets・OpenAI・LINE）の計測は load_test.py を使う
+
+# ---------------------------
+# 口調変換（tone_utils.adjust_tone_style）
+# ---------------------------
+TONE_SAMPLE_TEXT = (
+    "こんにちは、みくです♪今日も出勤しています。\n"
+    "お兄ちゃん、今日はぽかぽか陽気だよ。空き枠あります。\n"
+    "ありがとうございます。また会いに来てね〜。素敵な夜でしたわ。"
+)
+
+# 🔧 表引きに書き換える前の実装（比較用にそのまま残す）
+def legacy_adjust_tone_style(text, tone, name, fav_words=None, other_requests=None):
+    import random
+    text = re.sub(r"(こんにちは|おはようございます|こんばんは)[^。！？」]*?(です|だよ)[♪！。]?", "", text, 1)
+    if fav_words:
+        candidates = [w.strip() for w in fav_words.split("、") if w.strip()]
+        if candidates:
+            chosen_word = random.choice(candidates)
+            text = re.sub(r"おにいちゃん|お兄ちゃん|お兄さま|お兄様", chosen_word, text)
+    if tone == "甘えんぼ系":
+        text = text.replace("です。", "だよぉ〜💗").replace("ます。", "ましゅ〜🐰")
+    elif tone == "ロリ系・妹系":
+        text = text.replace("です。", "なのっ！").replace("ます。", "ましゅ〜！")
+        text = text.replace("だよ。", "だよぉ〜！")
+    elif tone == "ギャル系":
+        text = text.replace("です。", "だよ〜！").replace("ます。", "まーすっ✨").replace("ありがとう", "あざまるっ！")
+    elif tone == "ふんわり癒し系":
+        text = text.replace("です。", "ですよ〜☺️").replace("ます。", "ますね🌸")
+    elif tone == "大人っぽ系":
+        text = text.replace("ですわ。", "です。").replace("ますわね。", "ます。")\
+                   .replace("わね。", "ね。").replace("わ。", "。")
+    elif tone == "しっかり真面目系":
+        text = text.replace("だよ", "です").replace("ね〜", "ですね")
+    elif tone == "学園系・初心者風":
+        text = text.replace("です。", "ですっ！").replace("ます。", "まーすっ！")
+    elif tone == "サバサバ系":
+        text = text.replace("です。", "だね〜。").replace("ます。", "するよー。")
+    elif tone == "かっこいい系":
+        text = text.replace("です。", "だぜ。").replace("ます。", "するぜ！")
+    elif tone == "お姉さん系":
+        text = text.replace("です。", "よ〜ん。").replace("ます。", "しちゃうわね〜💋")
+    elif tone == "エステ・スパ風":
+        text = text.replace("です。", "でございます🌿").replace("ます。", "いたしますね🕊")
+    elif tone == "丁寧系":
+        text = text.replace("だよ", "でございます").replace("ます。", "いたします。")
+    elif tone == "ドM系":
+        text = text.replace("です。", "ごめんなさい…💦").replace("ます。", "されちゃいます…？")
+    elif tone == "清楚系":
+        text = text.replace("です。", "です").replace("ます。", "ます")
+    elif tone == "方言系（関西）":
+        text = text.replace("だよ", "やで").replace("です。", "やん♪").replace("ます。", "しまっせ〜")
+    if other_requests:
+        req = other_requests.lower()
+        if "妹" in req or "ロリ" in req:
+            text = re.sub(r"([だよのね])。", r"\1なの〜💕", text)
+            text += "\nぉ兄様のこと、今日もたくさん甘えさせてねっ🥺💗"
+        if "m" in req.lower() or "えっち" in req:
+            text += "\n…かな、ちょっとムラムラしてきちゃったかも…💦💓"
+    if name and name not in text:
+        text = f"{name}だよ〜🎀\n" + text
+    return text
+
+# 🔧 1口調のルールを1つの正規表現にまとめた1回走査（採用しなかった方式。比較用）
+# 前のルールの置換結果に後のルールが当たる口調（丁寧系・方言系）では結果が変わるため、速度だけを見る
+def _single_pass(rules):
+    table = dict(rules)
+    pattern = re.compile("|".join(re.escape(old) for old, _ in rules))
+    return lambda text: pattern.sub(lambda m: table[m.group(0)], text)
+
+def _per_call(fn, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter() - started) / number
+
+def bench_tone(number):
+    from tone_utils import adjust_tone_style, apply_tone_rules, TONE_RULES
+    from user_register import TONE_OPTIONS
+
+    print(f"{'口調':<14} {'変更前':>9} {'現在':>9} {'ルールのみ':>9} {'1回走査':>9}")
+    totals = [0.0, 0.0]
+    for tone in TONE_OPTIONS.values():
+        single_pass = _single_pass(TONE_RULES[tone])
+        legacy = _per_call(lambda: legacy_adjust_tone_style(TONE_SAMPLE_TEXT, tone, "みく", "ぉ兄様", "妹"), number)
+        current = _per_call(lambda: adjust_tone_style(TONE_SAMPLE_TEXT, tone, "みく", "ぉ兄様", "妹"), number)
+        rules = _per_call(lambda: apply_tone_rules(TONE_SAMPLE_TEXT, tone), number)
+        merged = _per_call(lambda: single_pass(TONE_SAMPLE_TEXT), number)
+        totals[0] += legacy
+        totals[1] += current
+        print(f"{tone:<14} {legacy * 1e6:>7.2f}µs {current * 1e6:>7.2f}µs {rules * 1e6:>7.2f}µs {merged * 1e6:>7.2f}µs")
+    print(f"合計（全口調1回ずつ）: 変更前 {totals[0] * 1e6:.1f}µs / 現在 {totals[1] * 1e6:.1f}µs")
+
+# ---------------------------
+# ローカルDB・代役の Sheets を使う計測の準備
+# ---------------------------
+# 🔧 アプリのモジュールは読み込み時に環境変数を読むため、import より先に一時フォルダを指す
+def _prepare_env():
+    workdir = tempfile.mkdtemp(prefix="diary_bot_bench_")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ["SHEETS_MODE"] = os.getenv("SHEETS_MODE", "primary")
+    os.environ["LOCAL_DB_PATH"] = os.path.join(workdir, "diary_bot.db")
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "sessions.db")
+    os.chdir(workdir)
+
+# ---------------------------
+# 日記の一括取り込み（diary_ingest.ingest_diaries）
+# ---------------------------
+def bench_ingest(pastes, entries_per_paste):
+    _prepare_env()
+    import load_test
+    import google_sheets
+    from diary_ingest import ingest_diaries, summarize
+
+    backend = load_test.Backend("sheets", 0, 0)
+    load_test.install_fake_sheets(backend, load_test.build_books([]))
+    rng = random.Random(0)
+
+    added = duplicates = 0
+    started = time.perf_counter()
+    for i in range(pastes):
+        user_id = f"Ubench{i:04d}"
+        diaries = [
+            "\n".join(rng.sample(load_test.DIARY_PHRASES, 3)) for _ in range(entries_per_paste)
+        ]
+        result = summarize(ingest_diaries(user_id, "\n\n".join(diaries)))
+        added += result[0]
+        duplicates += result[1]
+    elapsed = time.perf_counter() - started
+    google_sheets.flush_pending_writes()
+
+    calls, _ = backend.snapshot()
+    entries = pastes * entries_per_paste
+    print(f"{pastes}回の貼り付け × {entries_per_paste}件 = {entries}件（追加 {added} / 重複 {duplicates}）")
+    print(f"  {entries / elapsed:,.0f}件/秒（通信の待ち時間を除く）")
+    for op in sorted(calls):
+        if op.startswith("PremiumDiarySamples") or op.startswith("FeedbackLog"):
+            print(f"  {op}: {calls[op]}回（貼り付け1回あたり {calls[op] / pastes:.1f}回）")
+
+# ---------------------------
+# プレミアム設定（premium_setting.load_premium_settings / save_premium_settings）
+# ---------------------------
+def bench_premium_settings(users, number):
+    _prepare_env()
+    import premium_setting
+    import load_test
+
+    answers = dict(zip([q["key"] for q in premium_setting.premium_questions], load_test.premium_settings_answers()))
+    user_ids = [f"Ubench{i:05d}" for i in range(users)]
+
+    started = time.perf_counter()
+    for user_id in user_ids:
+        premium_setting.save_premium_settings(user_id, answers)
+    save_rate = users / (time.perf_counter() - started)
+    print(f"保存: {save_rate:,.0f}件/秒（{users}ユーザー。1件ごとに1トランザクション）")
+
+    def loads(label, interval, cold=False):
+        premium_setting.PREMIUM_SETTINGS_VERSION_CHECK_INTERVAL = interval
+        premium_setting._premium_version_checked_at = 0.0
+        started = time.perf_counter()
+        for i in range(number):
+            if cold:
+                premium_setting.premium_settings_cache.clear()
+            premium_setting.load_premium_settings(user_ids[i % users])
+        print(f"読込（{label}）: {number / (time.perf_counter() - started):,.0f}件/秒")
+
+    loads("キャッシュなし", 0, cold=True)
+    loads("バージョン確認を毎回", 0)
+    loads("バージョン確認は2秒ごと", 2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="外部サービスなしの小さな計測")
+    parser.add_argument("target", choices=["tone", "ingest", "premium_settings"])
+    parser.add_argument("--number", type=int, default=20000, help="1項目あたりの繰り返し回数")
+    parser.add_argument("--pastes", type=int, default=50, help="ingest: 貼り付けの回数（1回ごとに別ユーザー）")
+    parser.add_argument("--entries", type=int, default=30, help="ingest: 1回の貼り付けに含む日記の数")
+    parser.add_argument("--users", type=int, default=1000, help="premium_settings: 設定を保存するユーザー数")
+    args = parser.parse_args()
+
+    if args.target == "tone":
+        bench_tone(args.number)
+    elif args.target == "ingest":
+        bench_ingest(args.pastes, args.entries)
+    else:
+        bench_premium_settings(args.users, args.number)
@@ -0,0 +1,185 @@
+import os
+import re
+import glob
+import math
+import time
+import logging
+import threading
+
+# ✅ 日記タイプ判定（コマンド・日記の取り込みで共通）
+# DIARY_CLASSIFIER=keyword : キーワードのみ（既定。従来の判定と同じ）
+# DIARY_CLASSIFIER=hybrid  : キーワードに当たらなければ学習モデルで判定
+# DIARY_CLASSIFIER=bayes   : 学習モデルのみ
+# 学習モデルは diary_data/sample・premium_diaries のラベル付き日記で学習する文字1〜2-gramのナイーブベイズ
+
+DIARY_CLASSIFIER = os.getenv("DIARY_CLASSIFIER", "keyword")
+# ✅ 学習モデルの確信度がこれ未満なら判定しない
+DIARY_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("DIARY_CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+
+DIARY_TYPES = ("shukkin", "taikin", "orei")
+DEFAULT_DIARY_TYPE = "diary"
+
+# ✅ 日記本文のキーワード（上から順に判定）
+DIARY_TYPE_KEYWORDS = {
+    "shukkin": ["出勤", "おはよう", "こんにちは", "今日も出勤"],
+    "taikin": ["退勤", "お疲れ様", "おやすみ", "また明日"],
+    "orei": ["ありがとう", "感謝", "お礼", "嬉しい", "また会いたい"]
+}
+
+# ✅ 生成コマンド（「出勤」「退勤」「お礼」）のキーワード
+COMMAND_KEYWORDS = {
+    "shukkin": ["出勤"],
+    "taikin": ["退勤"],
+    "orei": ["お礼"]
+}
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.join(BASE_DIR, "diary_data", "sample")
+PREMIUM_DIARY_DIR = os.path.join(BASE_DIR, "premium_diaries")
+
+# 🔧 タイプごとにキーワードを1つの正規表現にまとめて、優先順に1回ずつ検索
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.patterns = [
+            (diary_type, re.compile("|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))))
+            for diary_type, words in keywords.items()
+        ]
+
+    def match(self, text):
+        for diary_type, pattern in self.patterns:
+            if pattern.search(text):
+                return diary_type
+        return None
+
+class NaiveBayesClassifier:
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.priors = {}
+        self.likelihoods = {}   # diary_type → {gram: log P(gram|type)}
+        self.unseen = {}        # diary_type → log P(未知の gram|type)
+
+    @staticmethod
+    def grams(text):
+        normalized = re.sub(r"\s+", "", text)
+        return list(normalized) + [normalized[i:i + 2] for i in range(len(normalized) - 1)]
+
+    def fit(self, examples):
+        counts = {}
+        docs = {}
+        vocab = set()
+        for text, diary_type in examples:
+            docs[diary_type] = docs.get(diary_type, 0) + 1
+            type_counts = counts.setdefault(diary_type, {})
+            for gram in self.grams(text):
+                type_counts[gram] = type_counts.get(gram, 0) + 1
+                vocab.add(gram)
+        total_docs = sum(docs.values())
+        for diary_type, type_counts in counts.items():
+            denominator = sum(type_counts.values()) + self.alpha * (len(vocab) + 1)
+            self.priors[diary_type] = math.log(docs[diary_type] / total_docs)
+            self.likelihoods[diary_type] = {
+                gram: math.log((count + self.alpha) / denominator) for gram, count in type_counts.items()
+            }
+            self.unseen[diary_type] = math.log(self.alpha / denominator)
+        return self
+
+    # 🔧 (タイプ, 確信度)
+    def predict(self, text):
+        grams = self.grams(text)
+        scores = {}
+        for diary_type, likelihood in self.likelihoods.items():
+            unseen = self.unseen[diary_type]
+            scores[diary_type] = self.priors[diary_type] + sum(likelihood.get(gram, unseen) for gram in grams)
+        if not scores:
+            return None, 0.0
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / total
+
+diary_matcher = KeywordMatcher(DIARY_TYPE_KEYWORDS)
+command_matcher = KeywordMatcher(COMMAND_KEYWORDS)
+
+_model = None
+_model_lock = threading.Lock()
+
+# ✅ ラベル付きの日記 [(本文, タイプ)]
+# diary_data/sample/<タイプ>.txt は1行1日記、premium_diaries/<user_id>/<タイプ>/*.txt は1ファイル1日記
+def load_labelled_diaries():
+    examples = []
+    for diary_type in DIARY_TYPES:
+        path = os.path.join(SAMPLE_DIR, f"{diary_type}.txt")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                examples.extend((line.strip(), diary_type) for line in f if line.strip())
+        for path in sorted(glob.glob(os.path.join(PREMIUM_DIARY_DIR, "*", diary_type, "*.txt"))):
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read().strip()
+            if text:
+                examples.append((text, diary_type))
+    return examples
+
+def get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            examples = load_labelled_diaries()
+            _model = NaiveBayesClassifier().fit(examples)
+            logging.info(f"[日記タイプ判定] 学習モデルを作成しました（{len(examples)}件）")
+        return _model
+
+def _predict_with_model(text, default):
+    diary_type, confidence = get_model().predict(text)
+    return diary_type if diary_type and confidence >= DIARY_CLASSIFIER_MIN_CONFIDENCE else default
+
+# ✅ 日記本文のタイプ（判定できなければ default）
+def classify(text, default=DEFAULT_DIARY_TYPE, mode=None):
+    mode = mode or DIARY_CLASSIFIER
+    if mode == "bayes":
+        return _predict_with_model(text, default)
+    diary_type = diary_matcher.match(text)
+    if diary_type is None and mode == "hybrid":
+        return _predict_with_model(text, default)
+    return diary_type or default
+
+def classify_many(texts, default=DEFAULT_DIARY_TYPE, mode=None):
+    return [classify(text, default, mode) for text in texts]
+
+# ✅ 「出勤」「退勤」「お礼」などの生成コマンド（該当しなければ None）
+def classify_command(text):
+    return command_matcher.match(text)
+
+# 🔧 同じ本文（空白の違いを除く）は最初の1件だけにする
+def _unique_examples(examples):
+    unique = {}
+    for text, diary_type in examples:
+        unique.setdefault(re.sub(r"\s+", "", text), (text, diary_type))
+    return list(unique.values())
+
+# 🔧 ラベル付き日記での正解率・処理速度（学習モデルは5件に1件を評価用に分けて学習し直す）
+# premium_diaries には sample と同じ本文のコピーがあるため、重複を除いてから分ける（評価用の本文が学習に混ざらない）
+def evaluate(modes=("keyword", "hybrid", "bayes")):
+    global _model
+    examples = _unique_examples(load_labelled_diaries())
+    train = [example for i, example in enumerate(examples) if i % 5]
+    held_out = [example for i, example in enumerate(examples) if not i % 5]
+    saved_model = _model
+    _model = NaiveBayesClassifier().fit(train)
+    try:
+        results = {}
+        for mode in modes:
+            started = time.perf_counter()
+            predictions = classify_many([text for text, _ in held_out], mode=mode)
+            elapsed = time.perf_counter() - started
+            correct = sum(1 for predicted, (_, label) in zip(predictions, held_out) if predicted == label)
+            results[mode] = {
+                "accuracy": correct / len(held_out) if held_out else 0.0,
+                "per_second": len(held_out) / elapsed if elapsed else 0.0,
+                "evaluated": len(held_out),
+            }
+        return results
+    finally:
+        _model = saved_model
+
+if __name__ == "__main__":
+    for mode, result in evaluate().items():
+        print(f"{mode}: 正解率 {result['accuracy']:.1%} / {result['per_second']:.0f}件/秒 （{result['evaluated']}件）")
@@ -1,17 +1,49 @@
 import random
 from openai import OpenAI
 import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 from premium_setting import load_premium_settings
-from premium_utils import get_user_diary_samples, increment_diary_usage
+from premium_utils import increment_diary_usage_bulk
 from tone_utils import adjust_tone_style, get_topic_by_tone
-from google_sheets import get_positive_feedback, connect_sheet, increment_template_usage
+from google_sheets import (
+    increment_template_usage,
+    use_local_store, get_templates_by_section, get_cached_templates
+)
+import sample_index
+import feedback_index
+from instrumentation import observe, increment, timed
+from prompt_builder import (
+    assemble, cached_section, count_tokens, truncate_tokens, PROMPT_FIELD_MAX_TOKENS
+)
 
 # ✅ OpenAI クライアントの初期化（v1以降必須）
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY").strip())
 
-# ✅ テンプレートキャッシュ
-template_cache = {}
+# ✅ 生成モデル設定
+DIARY_MODEL = "gpt-3.5-turbo-0125"
+DIARY_TEMPERATURE = 0.85
+
+# ✅ 👍がこの件数以上たまった日記タイプは、テンプレートの代わりに👍の日記を参考にする
+FEEDBACK_REFERENCE_THRESHOLD = int(os.getenv("FEEDBACK_REFERENCE_THRESHOLD", "10"))
+
+# ✅ ストリーミング生成（返信前に「生成中」を送り、完成したら push で送る）
+STREAM_GENERATION = os.getenv("STREAM_GENERATION", "false").lower() == "true"
+
+# ✅ 生成レイテンシ（日記タイプ別：最初のトークンまで／全体）
+generation_metrics = {}
+_metrics_lock = threading.Lock()
+
+# ✅ 直近の生成で使ったトークン数（スレッドごと）
+_completion_usage = threading.local()
+
+# ✅ 生成前のデータ取得を並列で行うスレッドプール
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "8"))
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
 
 # ✅ 日記タイプとタブ名の対応
 TAB_MAPPING = {
@@ -45,153 +77,264 @@ FREE_PROMPTS = {
     )
 }
 
+# ✅ テンプレート取得（TTL・更新時刻付きキャッシュ。google_sheets 側で管理）
 def get_templates_with_cache(tab_name):
-    if tab_name not in template_cache:
-        sheet = connect_sheet("DiaryTemplates", tab_name)
-        records = sheet.get_all_records()
-        templates = {}
-        for row in records:
-            section = row.get("section", "").strip()
-            text = row.get("text", "").strip()
-            if section and text:
-                if section not in templates:
-                    templates[section] = []
-                templates[section].append(text)
-        template_cache[tab_name] = templates
-    return template_cache[tab_name]
+    if use_local_store():
+        return get_templates_by_section("DiaryTemplates", tab_name)
+    return get_cached_templates("DiaryTemplates", tab_name)
+
+def record_generation_latency(plan, diary_type, first_token_seconds, total_seconds):
+    key = f"{plan}:{diary_type}"
+    with _metrics_lock:
+        stats = generation_metrics.setdefault(key, {"count": 0, "ttfb_total": 0.0, "latency_total": 0.0, "latency_max": 0.0})
+        stats["count"] += 1
+        stats["ttfb_total"] += first_token_seconds
+        stats["latency_total"] += total_seconds
+        stats["latency_max"] = max(stats["latency_max"], total_seconds)
+    observe("openai", total_seconds, plan=plan, diary_type=diary_type, part="total")
+    observe("openai", first_token_seconds, plan=plan, diary_type=diary_type, part="first_token")
+    logging.info(f"[生成] {key} ttfb={first_token_seconds:.2f}s total={total_seconds:.2f}s")
+
+def last_completion_tokens():
+    return getattr(_completion_usage, "total_tokens", 0)
+
+def get_generation_metrics():
+    with _metrics_lock:
+        return {key: dict(stats) for key, stats in generation_metrics.items()}
+
+# 🔧 OpenAI で日記本文を生成（STREAM_GENERATION 時はストリームを逐次受信）
+def create_diary_completion(system_prompt, prompt, plan, diary_type):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+    started = time.monotonic()
+    _completion_usage.total_tokens = 0
+
+    if not STREAM_GENERATION:
+        response = client.chat.completions.create(
+            model=DIARY_MODEL,
+            messages=messages,
+            temperature=DIARY_TEMPERATURE
+        )
+        elapsed = time.monotonic() - started
+        record_generation_latency(plan, diary_type, elapsed, elapsed)
+        if response.usage:
+            _completion_usage.total_tokens = response.usage.total_tokens
+        increment("openai_tokens", last_completion_tokens(), plan=plan, diary_type=diary_type)
+        return response.choices[0].message.content.strip()
+
+    stream = client.chat.completions.create(
+        model=DIARY_MODEL,
+        messages=messages,
+        temperature=DIARY_TEMPERATURE,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parts = []
+    first_token_at = None
+    for chunk in stream:
+        if chunk.usage:
+            _completion_usage.total_tokens = chunk.usage.total_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            parts.append(delta)
+
+    finished = time.monotonic()
+    record_generation_latency(plan, diary_type, (first_token_at or finished) - started, finished - started)
+    increment("openai_tokens", last_completion_tokens(), plan=plan, diary_type=diary_type)
+    return "".join(parts).strip()
+
+# 🔧 互いに依存しない取得処理を並列実行し、名前 → 結果 の dict で返す
+# トレースIDがワーカー側のログ・計測にも付くよう、呼び出し元のコンテキストで実行する
+def prefetch(**tasks):
+    futures = {name: _prefetch_pool.submit(contextvars.copy_context().run, fn) for name, fn in tasks.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+# 🔧 日記生成に必要なデータをまとめて取得（有料/無料で必要なものだけ）
+# 有料ユーザーの参考日記は日記タイプ・キーワードに近い順の上位5件 [(source, text)]
+def gather_diary_context(user_info, diary_type, keyword_text=None):
+    user_id = user_info["user_id"]
+    if user_info.get("is_premium", False):
+        return prefetch(
+            premium=lambda: load_premium_settings(user_id),
+            user_diaries=lambda: sample_index.search(user_id, diary_type, keyword_text, k=5)
+        )
+    tab_name = TAB_MAPPING.get(diary_type, "")
+    return prefetch(
+        feedback_count=lambda: feedback_index.count(user_id, diary_type),
+        feedbacks=lambda: feedback_index.recent(user_id, diary_type),
+        templates=lambda: get_templates_with_cache(tab_name)
+    )
 
 def sanitize_diary_text(text, username):
     return text.replace(f"{username}さん", "お客様").replace(f"{username}様", "お客様")
 
-def generate_free_diary(user_info, diary_type, reference_examples=""):
-    prompt = f"""
-{FREE_PROMPTS.get(diary_type, "あなたは風俗キャストです。自然な写メ日記を書いてください。")}
+# ✅ プロンプトの雛形（{references} には予算内に収まる分だけ参考日記が入る）
+FREE_PROMPT_TEMPLATE = """
+{purpose}
 
 🎀 キャラ情報
-・源氏名：{user_info['name']}
-・年代：{user_info['age_range']}
-・口調：{user_info['tone']}
+{character}
 
 ✏️ 参考例：
-{reference_examples}
+{references}
 
 📝 1通だけ自然な日記を書いてください。
 日記の出だしは毎回違う自然な入り方にしてください。「今日も〇〇です」のような出だしは避けてください。
 """
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo-0125",
-        messages=[
-            {"role": "system", "content": "あなたは自然な雰囲気で日記を書く風俗キャストです。"},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.85
-    )
-    return response.choices[0].message.content.strip()
-
-def generate_premium_diary(user_info, diary_type, diary_samples, premium, keyword_text=None):
-    diary_goal = DIARY_PURPOSES.get(diary_type, "自然な写メ日記を書く")
-    premium_text = f"""
-【プレミアム設定】
-使用絵文字: {premium.get("emoji_list", "")}
-日記テイスト: {premium.get("tone_tags", "")}
-避けたい表現: {premium.get("ng_elements", "")}
-推したい特徴: {premium.get("appeal_elements", "")}
-得意ポイント: {premium.get("appeal_tags", "")}
-出勤傾向: {premium.get("weekly_schedule", "")}
-口癖: {premium.get("fav_words", "")}
-要望: {premium.get("other_requests", "")}
-"""
-    keyword_section = f"\n【キーワード】{keyword_text}" if keyword_text else ""
 
-    prompt = f"""
+PREMIUM_PROMPT_TEMPLATE = """
 あなたは風俗キャストで人気者です。
 
 🎯 目的
-{diary_goal}
+{purpose}
 
 【キャスト情報】
-源氏名: {user_info['name']}
-年代: {user_info['age_range']}
-口調: {user_info['tone']}
-{premium_text}
-{keyword_section}
+{character}
+{premium}
+{keywords}
 
 【参考日記】
-{diary_samples}
+{references}
 
 📝 これらを踏まえた自然な1通の日記を作成してください。
 """
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo-0125",
-        messages=[
-            {"role": "system", "content": "あなたは自然な雰囲気で日記を書くプロフェッショナルな風俗キャストです。"},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.85
+
+# ✅ プレミアム設定の項目と表示名
+PREMIUM_PROMPT_FIELDS = [
+    ("emoji_list", "使用絵文字"),
+    ("tone_tags", "日記テイスト"),
+    ("ng_elements", "避けたい表現"),
+    ("appeal_elements", "推したい特徴"),
+    ("appeal_tags", "得意ポイント"),
+    ("weekly_schedule", "出勤傾向"),
+    ("fav_words", "口癖"),
+    ("other_requests", "要望"),
+]
+
+def render_premium_block(premium):
+    lines = [
+        f"{label}: {truncate_tokens(str(premium.get(key, '')), PROMPT_FIELD_MAX_TOKENS)}"
+        for key, label in PREMIUM_PROMPT_FIELDS
+    ]
+    return "\n【プレミアム設定】\n" + "\n".join(lines) + "\n"
+
+def generate_free_diary(user_info, diary_type, references=()):
+    user_id = user_info["user_id"]
+    character = (user_info["name"], user_info["age_range"], user_info["tone"])
+    purpose = FREE_PROMPTS.get(diary_type, "あなたは風俗キャストです。自然な写メ日記を書いてください。")
+    prompt = assemble("free", diary_type, FREE_PROMPT_TEMPLATE, {
+        "purpose": cached_section(None, f"free_purpose:{diary_type}", purpose, lambda: purpose),
+        "character": cached_section(user_id, "free_character", character, lambda: "・源氏名：{}\n・年代：{}\n・口調：{}".format(*character)),
+    }, list(references))
+    return create_diary_completion(
+        "あなたは自然な雰囲気で日記を書く風俗キャストです。",
+        prompt,
+        "free",
+        diary_type
     )
-    return response.choices[0].message.content.strip()
 
-def generate_simple_diary(user_info, diary_type, keyword_text=None):
+def generate_premium_diary(user_info, diary_type, references, premium, keyword_text=None):
+    user_id = user_info["user_id"]
+    character = (user_info["name"], user_info["age_range"], user_info["tone"])
+    purpose = DIARY_PURPOSES.get(diary_type, "自然な写メ日記を書く")
+    keywords = f"\n【キーワード】{truncate_tokens(keyword_text, PROMPT_FIELD_MAX_TOKENS)}" if keyword_text else ""
+    prompt = assemble("premium", diary_type, PREMIUM_PROMPT_TEMPLATE, {
+        "purpose": cached_section(None, f"premium_purpose:{diary_type}", purpose, lambda: purpose),
+        "character": cached_section(user_id, "premium_character", character, lambda: "源氏名: {}\n年代: {}\n口調: {}".format(*character)),
+        "premium": cached_section(user_id, "premium_settings", premium, lambda: render_premium_block(premium)),
+        "keywords": (keywords, count_tokens(keywords)),
+    }, list(references))
+    return create_diary_completion(
+        "あなたは自然な雰囲気で日記を書くプロフェッショナルな風俗キャストです。",
+        prompt,
+        "premium",
+        diary_type
+    )
+
+# ✅ 参考にした自作日記・テンプレートの使用回数 {"user_id", "samples": [本文], "templates": [(タブ, セクション, 本文)]}
+# 生成しただけでは数えず、実際に送る日記の分だけ commit_usage で反映する
+def commit_usage(usage):
+    if usage["samples"]:
+        increment_diary_usage_bulk(usage["user_id"], usage["samples"])
+    for tab_name, section, text in usage["templates"]:
+        increment_template_usage("DiaryTemplates", tab_name, section, text)
+
+# ✅ 日記を生成し、送った時に反映する使用回数と一緒に返す → (本文, usage)
+def generate_diary(user_info, diary_type, keyword_text=None, context=None):
     user_id = user_info["user_id"]
     is_premium = user_info.get("is_premium", False)
+    if context is None:
+        context = gather_diary_context(user_info, diary_type, keyword_text)
+    usage = {"user_id": user_id, "samples": [], "templates": []}
 
     if is_premium:
-        premium = load_premium_settings(user_id)
-        user_diaries = get_user_diary_samples(user_id, diary_type)
-        diary_samples = "\n".join(random.sample(user_diaries, min(len(user_diaries), 5))) if user_diaries else ""
-
-        for diary in user_diaries:
-            increment_diary_usage(user_id, diary)
-
-        generated_text = generate_premium_diary(user_info, diary_type, diary_samples, premium, keyword_text)
-        return adjust_tone_style(
-            generated_text,
-            user_info["tone"],
-            user_info["name"],
-            fav_words=premium.get("fav_words", ""),
-            other_requests=premium.get("other_requests", "")
-        )
+        premium = context["premium"]
+        selected = context["user_diaries"]
+
+        # 使用回数は自作日記（PremiumDiarySamples）の分だけ数える
+        usage["samples"] = [text for source, text in selected if source == "sample"]
 
-    reference_examples = ""
-    feedbacks = get_positive_feedback(user_id, diary_type)
+        generated_text = generate_premium_diary(user_info, diary_type, [text for _, text in selected], premium, keyword_text)
+        with timed("tone"):
+            return adjust_tone_style(
+                generated_text,
+                user_info["tone"],
+                user_info["name"],
+                fav_words=premium.get("fav_words", ""),
+                other_requests=premium.get("other_requests", "")
+            ), usage
 
-    if diary_type == "orei" and len(feedbacks) >= 10:
+    reference_examples = []
+    feedbacks = context["feedbacks"]
+    # 件数は取得件数（最大 FEEDBACK_RECENT_SIZE）ではなく索引の実件数で判定する
+    enough_feedback = context["feedback_count"] >= FEEDBACK_REFERENCE_THRESHOLD
+
+    if diary_type == "orei" and enough_feedback:
         tab_name = TAB_MAPPING.get(diary_type, "")
-        templates = get_templates_with_cache(tab_name)
-        sheet = connect_sheet("DiaryTemplates", tab_name)
-        records = sheet.get_all_records()
+        templates = context["templates"]
 
         selected_templates = []
         for section, texts in templates.items():
             if texts:
                 selected = random.choice(texts)
                 selected_templates.append(selected)
-                increment_template_usage(sheet, section, selected, records)
+                usage["templates"].append((tab_name, section, selected))
                 if len(selected_templates) >= 3:
                     break
 
         selected_feedbacks = random.sample(feedbacks, 2)
         combined = selected_templates + selected_feedbacks
         random.shuffle(combined)
-        reference_examples = "\n".join(combined)
+        reference_examples = combined
 
     else:
-        if len(feedbacks) >= 10:
-            reference_examples = "\n".join(feedbacks[:5])
+        if enough_feedback:
+            reference_examples = feedbacks[:5]
         else:
             tab_name = TAB_MAPPING.get(diary_type, "")
-            templates = get_templates_with_cache(tab_name)
+            templates = context["templates"]
             selected_texts = []
-            sheet = connect_sheet("DiaryTemplates", tab_name)
-            records = sheet.get_all_records()
 
             for section, texts in templates.items():
                 if texts:
                     selected = random.choice(texts)
                     selected_texts.append(selected)
-                    increment_template_usage(sheet, section, selected, records)
+                    usage["templates"].append((tab_name, section, selected))
 
-            reference_examples = "\n".join(selected_texts)
+            reference_examples = selected_texts
 
     generated_text = generate_free_diary(user_info, diary_type, reference_examples)
-    return adjust_tone_style(generated_text, user_info["tone"], user_info["name"])
+    with timed("tone"):
+        return adjust_tone_style(generated_text, user_info["tone"], user_info["name"]), usage
+
+# ✅ 日記を生成し、使用回数もすぐに反映する（生成したものをそのまま送る場合）
+def generate_simple_diary(user_info, diary_type, keyword_text=None, context=None):
+    text, usage = generate_diary(user_info, diary_type, keyword_text, context)
+    commit_usage(usage)
+    return text
@@ -0,0 +1,49 @@
+import re
+import logging
+from datetime import datetime
+
+from google_sheets import append_diary_samples_to_sheet
+from diary_classifier import classify_many
+import sample_index
+
+# ✅ 日記の一括取り込み（日記追加モード・プレミアム設定の日記サンプル）
+# 貼り付けられた文章を分割 → タイプ判定 → 既存・同じ貼り付け内の重複を除外 → まとめて1回で書き込む
+
+def split_diaries(raw_text):
+    return [entry.strip() for entry in raw_text.split("\n\n") if entry.strip()]
+
+def _normalize(text):
+    return re.sub(r"\s+", "", text)
+
+# ✅ 取り込み結果を1件ずつ返す [{"text", "diary_type", "status"}]
+# status: "added"（追加）/ "duplicate"（登録済み・同じ貼り付け内で重複）
+# diary_type を指定しなければ本文から判定する
+def ingest_diaries(user_id, raw_text, diary_type=None):
+    entries = split_diaries(raw_text)
+    if not entries:
+        return []
+
+    seen = {_normalize(text) for text in sample_index.get_sample_texts(user_id)}
+    types = [diary_type] * len(entries) if diary_type else classify_many(entries)
+    results = []
+    new_rows = []
+    for text, entry_type in zip(entries, types):
+        key = _normalize(text)
+        if key in seen:
+            results.append({"text": text, "diary_type": entry_type, "status": "duplicate"})
+            continue
+        seen.add(key)
+        new_rows.append((entry_type, text))
+        results.append({"text": text, "diary_type": entry_type, "status": "added"})
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    append_diary_samples_to_sheet(user_id, new_rows, now)
+    for entry_type, text in new_rows:
+        sample_index.add(user_id, "sample", entry_type, text)
+
+    logging.info(f"[日記取り込み] user_id={user_id}, 追加={len(new_rows)}件, 重複={len(entries) - len(new_rows)}件")
+    return results
+
+def summarize(results):
+    added = sum(1 for r in results if r["status"] == "added")
+    return added, len(results) - added
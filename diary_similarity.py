@@ -0,0 +1,97 @@
+import os
+import re
+import time
+import zlib
+import heapq
+import logging
+import threading
+
+import session_store
+
+# ✅ 直近の日記とほぼ同じ日記を返さないための類似チェック
+# 日記は文字3-gramの bottom-k MinHash（小さい順に k 個のハッシュ値）として保存し、
+# 新しい日記をユーザーごとの直近 N 件とまとめて比べる（推定 Jaccard 類似度）
+
+DUP_SHINGLE_SIZE = 3
+# ✅ 1件あたりのハッシュ数（保存サイズ・精度）
+DUP_SIGNATURE_SIZE = int(os.getenv("DUP_SIGNATURE_SIZE", "64"))
+# ✅ 1ユーザーあたり比べる直近の日記数
+DUP_HISTORY_SIZE = int(os.getenv("DUP_HISTORY_SIZE", "8"))
+# ✅ これ以上似ていたら作り直す（0〜1）
+DUP_THRESHOLD = float(os.getenv("DUP_THRESHOLD", "0.5"))
+
+# 複数ワーカーで共有できるよう、シグネチャ（int のリスト）は会話ステートと同じ場所に置く
+recent_signatures = session_store.namespace("recent_diary_signatures")
+
+_lock = threading.Lock()
+
+metrics = {
+    "checks": 0,
+    "duplicates": 0,
+    "regenerated": 0,
+    "still_similar": 0,
+    "check_seconds_total": 0.0,
+    "check_seconds_max": 0.0,
+}
+
+# 🔧 空白を除いた文字3-gramを crc32 でハッシュし、小さい順に k 個（プロセスをまたいで同じ値になる）
+def signature(text):
+    normalized = re.sub(r"\s+", "", text or "")
+    if len(normalized) < DUP_SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + DUP_SHINGLE_SIZE] for i in range(len(normalized) - DUP_SHINGLE_SIZE + 1)}
+    return sorted(heapq.nsmallest(DUP_SIGNATURE_SIZE, {zlib.crc32(s.encode("utf-8")) for s in shingles}))
+
+# 🔧 bottom-k 同士の推定 Jaccard 類似度
+def similarity(a, b):
+    a, b = set(a), set(b)
+    union = heapq.nsmallest(DUP_SIGNATURE_SIZE, a | b)
+    if not union:
+        return 0.0
+    both = a & b
+    return sum(1 for h in union if h in both) / len(union)
+
+def max_similarity(user_id, sig):
+    return max((similarity(sig, past) for past in recent_signatures.get(user_id, [])), default=0.0)
+
+def remember(user_id, sig):
+    history = recent_signatures.get(user_id, [])
+    history.append(sig)
+    recent_signatures[user_id] = history[-DUP_HISTORY_SIZE:]
+
+# ✅ 直近の日記とほぼ同じなら1回だけ作り直し、採用した日記を履歴に残す
+def avoid_repeat(user_id, text, regenerate):
+    started_at = time.perf_counter()
+    sig = signature(text)
+    score = max_similarity(user_id, sig)
+    _record(time.perf_counter() - started_at, score >= DUP_THRESHOLD)
+
+    if score >= DUP_THRESHOLD:
+        logging.info(f"[類似チェック] 直近の日記と類似 user_id={user_id}, score={score:.2f} → 作り直し")
+        try:
+            retry_text = regenerate()
+        except Exception as e:
+            logging.warning(f"[類似チェック] 作り直しに失敗 user_id={user_id}: {e}")
+            retry_text = None
+        if retry_text:
+            text = retry_text
+            sig = signature(text)
+            still_similar = max_similarity(user_id, sig) >= DUP_THRESHOLD
+            with _lock:
+                metrics["regenerated"] += 1
+                metrics["still_similar"] += int(still_similar)
+
+    remember(user_id, sig)
+    return text
+
+def _record(elapsed, duplicate):
+    with _lock:
+        metrics["checks"] += 1
+        metrics["duplicates"] += int(duplicate)
+        metrics["check_seconds_total"] += elapsed
+        metrics["check_seconds_max"] = max(metrics["check_seconds_max"], elapsed)
+
+def get_metrics():
+    with _lock:
+        return dict(metrics)
@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+from collections import deque, Counter
+
+import local_store
+from google_sheets import (
+    log_feedback as _log_feedback, get_all_positive_feedback, use_local_store, init_local_store
+)
+
+# ✅ 👍の日記の索引（user_id, 日記タイプ）→ 件数と新しい順の最大 N 件
+# 件数・しきい値の確認は本文を読まずに O(1)。👍の記録時に差分だけ追加する
+# ローカルDBを使うモードでは、索引付きのテーブルを直接引く
+
+# ✅ 1つの (user_id, 日記タイプ) あたりに持つ新しい👍の件数
+FEEDBACK_RECENT_SIZE = int(os.getenv("FEEDBACK_RECENT_SIZE", "10"))
+# ✅ 他プロセスでの👍を取り込むための再構築間隔（秒）
+FEEDBACK_INDEX_TTL = int(os.getenv("FEEDBACK_INDEX_TTL", "600"))
+
+_lock = threading.Lock()
+_build_lock = threading.Lock()   # 作り直しは1スレッドだけ（FeedbackLog の読み込みは _lock の外で行う）
+_entries = {}       # (user_id, diary_type) → {"count": 件数, "recent": deque[(timestamp, 本文)]}
+_built_at = None
+_logged_during_build = None   # 作り直し中に記録された👍 [(user_id, diary_type, timestamp, 本文)]（作り直し中でなければ None）
+
+metrics = {
+    "builds": 0,
+    "last_build_seconds": 0.0,
+    "appended": 0,
+}
+
+def _add(user_id, diary_type, timestamp, text):
+    entry = _entries.get((user_id, diary_type))
+    if entry is None:
+        entry = _entries[(user_id, diary_type)] = {"count": 0, "recent": deque(maxlen=FEEDBACK_RECENT_SIZE)}
+    entry["count"] += 1
+    # 記録は時刻順に来るので基本は先頭に積むだけ（シートの行順が前後した時だけ並べ直す）
+    recent = entry["recent"]
+    if not recent or timestamp >= recent[0][0]:
+        recent.appendleft((timestamp, text))
+    elif len(recent) < recent.maxlen or timestamp > recent[-1][0]:
+        items = sorted(list(recent) + [(timestamp, text)], key=lambda item: item[0], reverse=True)
+        entry["recent"] = deque(items[:FEEDBACK_RECENT_SIZE], maxlen=FEEDBACK_RECENT_SIZE)
+
+def _is_fresh():
+    return _built_at is not None and time.monotonic() - _built_at < FEEDBACK_INDEX_TTL
+
+# 🔧 FeedbackLog を1回読んで作り直す（TTL 内は何もしない）
+# 読み込みは _lock の外で行い、その間の件数・本文の問い合わせには古い索引で答える
+# 読み込み中に記録された👍は控えておき、読み込んだ行に含まれていない分だけ足してから差し替える
+def _ensure_index():
+    global _built_at, _logged_during_build
+    with _lock:
+        if _is_fresh() or (_built_at is not None and _logged_during_build is not None):
+            return
+    with _build_lock:
+        with _lock:
+            if _is_fresh():
+                return
+            _logged_during_build = []
+        started = time.perf_counter()
+        try:
+            rows = get_all_positive_feedback()
+        except Exception:
+            with _lock:
+                _logged_during_build = None
+            raise
+        with _lock:
+            fetched = Counter(rows)
+            for row in _logged_during_build:
+                if fetched[row]:
+                    fetched[row] -= 1
+                else:
+                    rows.append(row)
+            _logged_during_build = None
+            _entries.clear()
+            for user_id, diary_type, timestamp, text in sorted(rows, key=lambda row: row[2]):
+                _add(user_id, diary_type, timestamp, text)
+            _built_at = time.monotonic()
+            metrics["builds"] += 1
+            metrics["last_build_seconds"] = time.perf_counter() - started
+
+# ✅ 👍の件数（diary_type=None は全タイプの合計）
+def count(user_id, diary_type=None):
+    if use_local_store():
+        init_local_store()
+        return local_store.count_positive_feedback(user_id, diary_type)
+    _ensure_index()
+    with _lock:
+        if diary_type is not None:
+            entry = _entries.get((user_id, diary_type))
+            return entry["count"] if entry else 0
+        return sum(entry["count"] for (uid, _), entry in _entries.items() if uid == user_id)
+
+# ✅ 新しい順の👍の本文（最大 FEEDBACK_RECENT_SIZE 件）
+def recent(user_id, diary_type, limit=FEEDBACK_RECENT_SIZE):
+    if use_local_store():
+        init_local_store()
+        return local_store.get_positive_feedback(user_id, diary_type, limit)
+    _ensure_index()
+    with _lock:
+        entry = _entries.get((user_id, diary_type))
+        return [text for _, text in list(entry["recent"])[:limit]] if entry else []
+
+# ✅ フィードバックを記録し、👍なら索引にも追加する
+def log_feedback(user_id, diary_type, result, diary_text):
+    if use_local_store():
+        _log_feedback(user_id=user_id, diary_type=diary_type, result=result, diary_text=diary_text)
+        return
+    # バッファへの追加と索引への追加の間に差し替えが入らないよう、まとめてロックする
+    with _lock:
+        timestamp = _log_feedback(user_id=user_id, diary_type=diary_type, result=result, diary_text=diary_text)
+        text = str(diary_text).strip()
+        if result != "good" or not text:
+            return
+        if _logged_during_build is not None:
+            _logged_during_build.append((user_id, diary_type, timestamp, text))
+        if _built_at is not None:
+            _add(user_id, diary_type, timestamp, text)
+            metrics["appended"] += 1
+
+def discard():
+    global _built_at
+    with _lock:
+        _entries.clear()
+        _built_at = None
+
+def get_metrics():
+    with _lock:
+        return dict(metrics, keys=len(_entries), ttl=FEEDBACK_INDEX_TTL, recent_size=FEEDBACK_RECENT_SIZE)
@@ -0,0 +1,284 @@
+import os
+import glob
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows ではロックなし（単一プロセス前提）
+    fcntl = None
+
+# ✅ 👍/👎された日記の保存先（内容アドレス方式）
+# 本文は SHA-256 で1回だけハッシュし、同じ本文は1つだけ保存する
+# ユーザーごとのマニフェスト（manifests/<user_id>.tsv）に「結果・タイプ・時刻・ハッシュ」を1行ずつ追記する
+# 本文の置き場所は FEEDBACK_STORE_PACK で切り替える
+#   false: objects/<先頭2文字>/<ハッシュ>.txt に1本文1ファイル
+#   true : segment.dat に追記し、segment.idx に「ハッシュ・位置・長さ」を追記する（ファイル数が増えない）
+# 旧レイアウト feedback/<good|bad>/<user_id>/<タイプ>_<時刻>.txt は export で作り直せる（migrate で取り込み）
+
+FEEDBACK_STORE_DIR = os.getenv("FEEDBACK_STORE_DIR", "feedback_store")
+FEEDBACK_STORE_PACK = os.getenv("FEEDBACK_STORE_PACK", "true").lower() == "true"
+
+# ✅ 旧レイアウトのフォルダとファイル名の時刻書式
+LEGACY_FEEDBACK_DIR = "feedback"
+TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+_lock = threading.Lock()
+_index = {}         # ハッシュ → (位置, 長さ)
+_index_pos = 0      # segment.idx のどこまで読んだか
+_index_ino = None   # segment.idx が作り直されたら（gc）読み直す
+
+metrics = {
+    "saved": 0,
+    "deduplicated": 0,
+    "bytes_written": 0,
+    "removed_entries": 0,
+}
+
+def _path(*parts):
+    return os.path.join(FEEDBACK_STORE_DIR, *parts)
+
+def digest_of(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# 🔧 同じディレクトリを使うプロセス間の書き込みロック（セグメントへの追記・マニフェストの書き換え）
+class _FileLock:
+    def __enter__(self):
+        os.makedirs(FEEDBACK_STORE_DIR, exist_ok=True)
+        self.file = open(_path(".lock"), "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+# ---------------------------
+# 本文（objects/ または segment.dat）
+# ---------------------------
+
+def _object_path(digest):
+    return _path("objects", digest[:2], f"{digest}.txt")
+
+# 🔧 他のプロセスが追記した分だけ索引に読み込む（呼び出し側で _lock を持つ）
+def _refresh_index():
+    global _index_pos, _index_ino
+    path = _path("segment.idx")
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _index.clear()
+        _index_pos, _index_ino = 0, None
+        return
+    if stat.st_ino != _index_ino or stat.st_size < _index_pos:
+        _index.clear()
+        _index_pos, _index_ino = 0, stat.st_ino
+    if stat.st_size == _index_pos:
+        return
+    with open(path, "rb") as f:
+        f.seek(_index_pos)
+        data = f.read()
+    # 書き込み途中の最終行は次回に回す
+    complete = data[:data.rfind(b"\n") + 1]
+    for line in complete.decode("utf-8").splitlines():
+        digest, offset, length = line.split("\t")
+        _index[digest] = (int(offset), int(length))
+    _index_pos += len(complete)
+
+def _has_object(digest):
+    with _lock:
+        _refresh_index()
+        if digest in _index:
+            return True
+    return os.path.exists(_object_path(digest))
+
+# 🔧 本文を1回だけ保存する（呼び出し側で _FileLock を持つ）→ 新しく書いたか
+def _put_object(digest, text):
+    if _has_object(digest):
+        return False
+    data = text.encode("utf-8")
+    if FEEDBACK_STORE_PACK:
+        with open(_path("segment.dat"), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+        with open(_path("segment.idx"), "a", encoding="utf-8") as f:
+            f.write(f"{digest}\t{offset}\t{len(data)}\n")
+    else:
+        path = _object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    with _lock:
+        metrics["bytes_written"] += len(data)
+    return True
+
+def _read_packed(digest):
+    with _lock:
+        _refresh_index()
+        location = _index.get(digest)
+    if location is None:
+        return None
+    offset, length = location
+    with open(_path("segment.dat"), "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return data.decode("utf-8") if hashlib.sha256(data).hexdigest() == digest else None
+
+# ✅ ハッシュから本文を読む（なければ None）
+def read(digest):
+    global _index_ino
+    # gc でセグメントが作り直された直後は位置がずれるので、ハッシュが合わなければ索引を読み直す
+    for _ in range(2):
+        text = _read_packed(digest)
+        if text is not None:
+            return text
+        with _lock:
+            _index_ino = None
+    path = _object_path(digest)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    return None
+
+# ---------------------------
+# マニフェスト（ユーザーごと）
+# ---------------------------
+
+def _manifest_path(user_id):
+    return _path("manifests", f"{user_id}.tsv")
+
+# ✅ ユーザーのフィードバック [(result, diary_type, timestamp, digest)]（古い順）
+def entries(user_id):
+    path = _manifest_path(user_id)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [tuple(line.rstrip("\n").split("\t")) for line in f if line.strip()]
+
+def user_ids():
+    return sorted(os.path.basename(path)[:-len(".tsv")] for path in glob.glob(_path("manifests", "*.tsv")))
+
+# ✅ フィードバックを1件保存する → ハッシュ
+def save(user_id, result, diary_type, text, timestamp=None):
+    timestamp = timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+    digest = digest_of(text)
+    with _FileLock():
+        written = _put_object(digest, text)
+        os.makedirs(_path("manifests"), exist_ok=True)
+        with open(_manifest_path(user_id), "a", encoding="utf-8") as f:
+            f.write(f"{result}\t{diary_type}\t{timestamp}\t{digest}\n")
+    with _lock:
+        metrics["saved"] += 1
+        if not written:
+            metrics["deduplicated"] += 1
+    return digest
+
+# ✅ ユーザーのフィードバックを消す（result=None は👍👎とも）。本文は gc で消える
+def remove_user(user_id, result=None):
+    path = _manifest_path(user_id)
+    with _FileLock():
+        current = entries(user_id)
+        keep = [entry for entry in current if result is not None and entry[0] != result]
+        if keep:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines("\t".join(entry) + "\n" for entry in keep)
+            os.replace(tmp_path, path)
+        elif os.path.exists(path):
+            os.remove(path)
+    removed = len(current) - len(keep)
+    with _lock:
+        metrics["removed_entries"] += removed
+    return removed
+
+# ✅ どのマニフェストからも参照されていない本文を消す（セグメントは参照分だけで作り直す）→ 消した件数
+def gc():
+    global _index_ino
+    with _FileLock():
+        referenced = {entry[3] for user_id in user_ids() for entry in entries(user_id)}
+        removed = 0
+        for path in glob.glob(_path("objects", "*", "*.txt")):
+            if os.path.basename(path)[:-len(".txt")] not in referenced:
+                os.remove(path)
+                removed += 1
+
+        with _lock:
+            _refresh_index()
+            packed = dict(_index)
+        unreferenced = [digest for digest in packed if digest not in referenced]
+        if unreferenced:
+            with open(_path("segment.dat"), "rb") as src, \
+                 open(_path("segment.dat.tmp"), "wb") as dat, \
+                 open(_path("segment.idx.tmp"), "w", encoding="utf-8") as idx:
+                for digest, (offset, length) in packed.items():
+                    if digest not in referenced:
+                        continue
+                    src.seek(offset)
+                    idx.write(f"{digest}\t{dat.tell()}\t{length}\n")
+                    dat.write(src.read(length))
+            os.replace(_path("segment.dat.tmp"), _path("segment.dat"))
+            os.replace(_path("segment.idx.tmp"), _path("segment.idx"))
+            removed += len(unreferenced)
+            with _lock:
+                _index_ino = None
+    return removed
+
+# ---------------------------
+# 旧レイアウトとの変換
+# ---------------------------
+
+# ✅ feedback/<good|bad>/<user_id>/<タイプ>_<時刻>.txt を作り直す → 書き出した件数
+def export(dest=LEGACY_FEEDBACK_DIR, user_id=None):
+    exported = 0
+    for uid in [user_id] if user_id else user_ids():
+        for result, diary_type, timestamp, digest in entries(uid):
+            text = read(digest)
+            if text is None:
+                logging.warning(f"[フィードバック保存] 本文が見つかりません: {uid} {digest}")
+                continue
+            folder = os.path.join(dest, result, uid)
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"{diary_type}_{timestamp}.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+            exported += 1
+    return exported
+
+# ✅ 旧レイアウトのファイルを取り込む（取り込み済みの行は飛ばす）→ 取り込んだ件数
+def migrate(src=LEGACY_FEEDBACK_DIR):
+    imported = 0
+    for folder in sorted(glob.glob(os.path.join(src, "*", "*"))):
+        result, user_id = os.path.basename(os.path.dirname(folder)), os.path.basename(folder)
+        known = set(entries(user_id))
+        for path in sorted(glob.glob(os.path.join(folder, "*.txt"))):
+            diary_type, _, timestamp = os.path.basename(path)[:-len(".txt")].partition("_")
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            if (result, diary_type, timestamp, digest_of(text)) in known:
+                continue
+            save(user_id, result, diary_type, text, timestamp)
+            imported += 1
+    return imported
+
+def get_metrics():
+    with _lock:
+        return dict(metrics, packed=FEEDBACK_STORE_PACK, packed_objects=len(_index))
+
+# ✅ python feedback_store.py export|migrate|gc [フォルダ]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="フィードバック日記の保存先の管理")
+    parser.add_argument("command", choices=["export", "migrate", "gc"])
+    parser.add_argument("folder", nargs="?", default=LEGACY_FEEDBACK_DIR, help="旧レイアウトのフォルダ")
+    parser.add_argument("--user", help="export するユーザー（省略時は全員）")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"{export(args.folder, args.user)}件を {args.folder}/ に書き出しました")
+    elif args.command == "migrate":
+        print(f"{migrate(args.folder)}件を {FEEDBACK_STORE_DIR}/ に取り込みました")
+    else:
+        print(f"参照されていない本文を{gc()}件削除しました")
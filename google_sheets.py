@@ -1,17 +1,444 @@
+import os
+import re
+import csv
+import glob
+import time
+import queue
+import atexit
+import logging
+import threading
+import functools
 import gspread
+from collections import OrderedDict
+from contextlib import contextmanager
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import Request
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows ではロックなし（単一プロセス前提）
+    fcntl = None
+
+import local_store
+from instrumentation import instrument_worksheet
+
 SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
 ]
 
-# 🔧 汎用：指定スプレッドシート・タブへ接続
+CREDENTIALS_FILE = '/etc/secrets/credentials.json'
+
+# ✅ トークンを先回りで更新する間隔（秒）。アクセストークンの有効期限は1時間
+TOKEN_REFRESH_INTERVAL = 45 * 60
+
+# ✅ データの保存先
+#   primary: Google Sheets を正とする（従来通り）
+#   replica: ローカルDB（SQLite）を正とし、Sheets へは非同期で複製
+#   off:     ローカルDBのみ（Sheets へは書き込まない）
+SHEETS_MODE = os.getenv("SHEETS_MODE", "primary")
+
+# ✅ プロセス共通のクライアント・スプレッドシート・ワークシートのキャッシュ
+_client_lock = threading.RLock()
+_creds = None
+_client = None
+_spreadsheets = {}
+_worksheets = {}
+_refresh_thread = None
+
+# 🔧 認証済みクライアントを取得（初回のみ認証）
+def get_client():
+    global _creds, _client
+    with _client_lock:
+        if _client is None:
+            _creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPES)
+            _client = gspread.authorize(_creds)
+            _start_token_refresher()
+        return _client
+
+# 🔧 スプレッドシートを取得（open は1回だけ）
+def get_spreadsheet(spreadsheet_name):
+    with _client_lock:
+        if spreadsheet_name not in _spreadsheets:
+            _spreadsheets[spreadsheet_name] = get_client().open(spreadsheet_name)
+        return _spreadsheets[spreadsheet_name]
+
+# 🔧 汎用：指定スプレッドシート・タブへ接続（ハンドルは使い回し）
 def connect_sheet(spreadsheet_name, worksheet_name):
-    creds = Credentials.from_service_account_file('/etc/secrets/credentials.json', scopes=SCOPES)
-    client = gspread.authorize(creds)
-    return client.open(spreadsheet_name).worksheet(worksheet_name)
+    key = (spreadsheet_name, worksheet_name)
+    with _client_lock:
+        if key not in _worksheets:
+            _worksheets[key] = instrument_worksheet(
+                get_spreadsheet(spreadsheet_name).worksheet(worksheet_name), worksheet_name
+            )
+        return _worksheets[key]
+
+# 🔧 タブが無ければ見出し行付きで作成してから接続
+def get_or_create_sheet(spreadsheet_name, worksheet_name, header):
+    try:
+        return connect_sheet(spreadsheet_name, worksheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = get_spreadsheet(spreadsheet_name).add_worksheet(title=worksheet_name, rows=1000, cols=len(header))
+        worksheet.append_row(header)
+        logging.info(f"[Sheets] {worksheet_name} タブを作成しました")
+        return connect_sheet(spreadsheet_name, worksheet_name)
+
+# 🔧 タブ名変更・削除などでハンドルが無効になった時に破棄
+def invalidate_sheet(spreadsheet_name, worksheet_name=None):
+    with _client_lock:
+        if worksheet_name is None:
+            _spreadsheets.pop(spreadsheet_name, None)
+            for key in [k for k in _worksheets if k[0] == spreadsheet_name]:
+                del _worksheets[key]
+        else:
+            _worksheets.pop((spreadsheet_name, worksheet_name), None)
+
+# 🔧 クライアントごと作り直す（認証情報の差し替え時など）
+def reset_sheet_clients():
+    global _creds, _client
+    with _client_lock:
+        _creds = None
+        _client = None
+        _spreadsheets.clear()
+        _worksheets.clear()
+
+# 🔧 バックグラウンドでアクセストークンを更新
+def _refresh_token_loop():
+    while True:
+        time.sleep(TOKEN_REFRESH_INTERVAL)
+        with _client_lock:
+            creds = _creds
+        if creds is None:
+            continue
+        try:
+            creds.refresh(Request())
+        except Exception as e:
+            logging.warning(f"[Sheets] トークン更新に失敗: {e}")
+
+def _start_token_refresher():
+    global _refresh_thread
+    if _refresh_thread is None:
+        _refresh_thread = threading.Thread(target=_refresh_token_loop, daemon=True)
+        _refresh_thread.start()
+
+# ---------------------------
+# ⓪ UserInfoLog のメモリ上ミラー（user_id → 行番号・レコード）
+# ---------------------------
+USER_INFO_SHEET = ("DiaryUserData", "UserInfoLog")
+
+# ✅ シートとの再同期間隔（秒）。オペレーターがシートを直接編集した分はここで反映
+USER_INFO_TTL = int(os.getenv("USER_INFO_TTL", "300"))
+# ✅ ミラーに無い user_id を引いた時に読み直す最短間隔（秒）。他のワーカーで登録されたユーザーをすぐ見つける
+USER_INFO_MISS_REFRESH_INTERVAL = float(os.getenv("USER_INFO_MISS_REFRESH_INTERVAL", "5"))
+
+_user_info_lock = threading.RLock()
+_user_info_refresh_lock = threading.RLock()   # 読み直しは同時に1つだけ
+_user_info_header = []
+_user_info_rows = {}       # user_id → {"row": 行番号, "record": dict}
+_approved_user_ids = set()
+_user_info_loaded_at = 0.0
+
+def _user_key(user_id):
+    return str(user_id or "").strip()
+
+def _index_user_record(user_id, row_number, record):
+    key = _user_key(user_id)
+    _user_info_rows[key] = {"row": row_number, "record": record}
+    if record.get("ステータス") == "承認済":
+        _approved_user_ids.add(key)
+    else:
+        _approved_user_ids.discard(key)
+
+# 🔧 UserInfoLog を1回の読み込みでインデックス化
+def refresh_user_info_index():
+    global _user_info_header, _user_info_loaded_at
+    with _user_info_refresh_lock:
+        sheet = connect_sheet(*USER_INFO_SHEET)
+        values = sheet.get_all_values()
+        with _user_info_lock:
+            _user_info_header = values[0] if values else []
+            _user_info_rows.clear()
+            _approved_user_ids.clear()
+            for idx, row in enumerate(values[1:]):
+                record = dict(zip(_user_info_header, gspread.utils.numericise_all(row)))
+                if _user_key(record.get("user_id")):
+                    _index_user_record(record["user_id"], idx + 2, record)
+            _user_info_loaded_at = time.monotonic()
+
+def invalidate_user_info_index():
+    global _user_info_loaded_at
+    with _user_info_lock:
+        _user_info_loaded_at = 0.0
+
+def _user_info_age():
+    with _user_info_lock:
+        return time.monotonic() - _user_info_loaded_at if _user_info_loaded_at else None
+
+# 🔧 TTL 切れなら読み直す（同時に切れても読み込みは1回）
+def _ensure_user_info_index():
+    age = _user_info_age()
+    if age is not None and age < USER_INFO_TTL:
+        return
+    with _user_info_refresh_lock:
+        age = _user_info_age()
+        if age is None or age >= USER_INFO_TTL:
+            refresh_user_info_index()
+
+# 🔧 ミラーに無い user_id は、前回の読み込みから USER_INFO_MISS_REFRESH_INTERVAL 以上経っていれば1回だけ読み直す
+def _get_user_entry(user_id):
+    _ensure_user_info_index()
+    key = _user_key(user_id)
+    with _user_info_lock:
+        entry = _user_info_rows.get(key)
+        if entry:
+            return entry["row"], dict(entry["record"])
+        seen_loaded_at = _user_info_loaded_at
+    with _user_info_refresh_lock:
+        with _user_info_lock:
+            # 待っている間に他のスレッドが読み直していれば、その結果を使う
+            refreshed = _user_info_loaded_at != seen_loaded_at
+        age = _user_info_age()
+        if not refreshed and (age is None or age >= USER_INFO_MISS_REFRESH_INTERVAL):
+            refresh_user_info_index()
+    with _user_info_lock:
+        entry = _user_info_rows.get(key)
+        return (entry["row"], dict(entry["record"])) if entry else (None, None)
+
+# 🔧 user_id からレコード・行番号を取得（ミラーにあれば通信なし）
+def get_user_record(user_id):
+    if use_local_store():
+        init_local_store()
+        return local_store.get_user_record(user_id)
+    return _get_user_entry(user_id)[1]
+
+def find_user_row(user_id):
+    return _get_user_entry(user_id)[0]
+
+def is_approved_user(user_id):
+    if use_local_store():
+        return (get_user_record(user_id) or {}).get("ステータス") == "承認済"
+    _get_user_entry(user_id)
+    with _user_info_lock:
+        return _user_key(user_id) in _approved_user_ids
+
+# 🔧 書き込み後にミラーも更新（cells: {列番号: 値}）
+def _update_user_info_mirror(user_id, cells):
+    with _user_info_lock:
+        entry = _user_info_rows.get(_user_key(user_id))
+        if not entry:
+            return
+        record = entry["record"]
+        for col, value in cells.items():
+            if col <= len(_user_info_header):
+                record[_user_info_header[col - 1]] = value
+        _index_user_record(user_id, entry["row"], record)
+
+def _update_user_cells(user_id, cells):
+    dispatch_write(local_store.update_user_cells, _sheet_update_user_cells, user_id, cells)
+
+def _sheet_update_user_cells(user_id, cells):
+    row = find_user_row(user_id)
+    if row is None:
+        return
+    sheet = connect_sheet(*USER_INFO_SHEET)
+    sheet.batch_update([
+        {"range": gspread.utils.rowcol_to_a1(row, col), "values": [[value]]} for col, value in cells.items()
+    ])
+    _update_user_info_mirror(user_id, cells)
+
+def _append_user_info_row(sheet, values):
+    response = sheet.append_row(values)
+    updated_range = (response or {}).get("updates", {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    if not match:
+        invalidate_user_info_index()
+        return
+    with _user_info_lock:
+        record = {name: "" for name in _user_info_header}
+        record.update({_user_info_header[i]: v for i, v in enumerate(values) if i < len(_user_info_header)})
+        _index_user_record(values[0], int(match.group(1)), record)
+
+# ---------------------------
+# ⓪-2 書き込みバッファ（ログ追記・使用回数カウントをまとめて書き込む）
+# ---------------------------
+# ✅ まとめて書き込む間隔（秒）
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "5"))
+
+# ✅ 行番号で書き込む処理（バッファの反映・アーカイブの詰め直し）を同じサーバー上のプロセス間で排他にするロックファイル
+SHEETS_ROW_LOCK_FILE = os.getenv("SHEETS_ROW_LOCK_FILE", "sheets_rows.lock")
+
+_write_lock = threading.RLock()
+_flush_lock = threading.Lock()
+_pending_appends = {}     # (スプレッドシート, タブ) → [行]
+_pending_counters = {}    # (スプレッドシート, タブ) → {キー: 加算数}
+_counter_resolvers = {}   # (スプレッドシート, タブ) → resolver(sheet, counts) → (batch_update用リスト, 追記行)
+_flusher_thread = None
+
+# 🔧 カウンタ用タブの書き込み方法を登録
+def register_counter(spreadsheet_name, worksheet_name, resolver):
+    _counter_resolvers[(spreadsheet_name, worksheet_name)] = resolver
+
+def buffer_append_row(spreadsheet_name, worksheet_name, row):
+    with _write_lock:
+        _pending_appends.setdefault((spreadsheet_name, worksheet_name), []).append(row)
+    _start_flusher()
+
+# 🔧 同じキーの加算は1回の書き込みにまとめる
+def buffer_increment(spreadsheet_name, worksheet_name, key, amount=1):
+    with _write_lock:
+        counts = _pending_counters.setdefault((spreadsheet_name, worksheet_name), {})
+        counts[key] = counts.get(key, 0) + amount
+    _start_flusher()
+
+def get_pending_increment(spreadsheet_name, worksheet_name, key):
+    with _write_lock:
+        return _pending_counters.get((spreadsheet_name, worksheet_name), {}).get(key, 0)
+
+# 🔧 行の読み取りから行番号での書き込みまでの間に、別プロセスのアーカイブで行がずれないようにする
+# プロセス内は _flush_lock、プロセス間は SHEETS_ROW_LOCK_FILE の flock で排他にする
+@contextmanager
+def _row_write_lock():
+    with _flush_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(SHEETS_ROW_LOCK_FILE, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+# 🔧 溜まった書き込みをタブごとに batch_update / append_rows で反映
+def flush_pending_writes():
+    with _row_write_lock():
+        with _write_lock:
+            appends = dict(_pending_appends)
+            counters = dict(_pending_counters)
+            _pending_appends.clear()
+            _pending_counters.clear()
+
+        for sheet_key in set(appends) | set(counters):
+            rows = appends.get(sheet_key, [])
+            counts = counters.get(sheet_key, {})
+            try:
+                sheet = connect_sheet(*sheet_key)
+                if counts:
+                    updates, new_rows = _counter_resolvers[sheet_key](sheet, counts)
+                    if updates:
+                        sheet.batch_update(updates)
+                    # カウンタ反映済み。以降の失敗では新規行だけを再送する
+                    rows, counts = new_rows + rows, {}
+                if rows:
+                    sheet.append_rows(rows)
+            except Exception as e:
+                logging.warning(f"[Sheets] {sheet_key[1]} への書き込みに失敗。次回に再送します: {e}")
+                _requeue(sheet_key, rows, counts)
+
+# ✅ アーカイブで詰め直すタブ（log_archive.ARCHIVE_TABS）へバッファを通さず追記する
+# 詰め直しの読み取りから書き戻しまでの間に追記された行が上書き・削除されないよう _row_write_lock の中で行う
+def append_log_rows(spreadsheet_name, worksheet_name, rows, **kwargs):
+    with _row_write_lock():
+        connect_sheet(spreadsheet_name, worksheet_name).append_rows(rows, **kwargs)
+
+def _requeue(sheet_key, rows, counts):
+    with _write_lock:
+        _pending_appends[sheet_key] = rows + _pending_appends.get(sheet_key, [])
+        pending = _pending_counters.setdefault(sheet_key, {})
+        for key, amount in counts.items():
+            pending[key] = pending.get(key, 0) + amount
+
+def _flush_loop():
+    while True:
+        time.sleep(WRITE_FLUSH_INTERVAL)
+        flush_pending_writes()
+
+def _start_flusher():
+    global _flusher_thread
+    with _write_lock:
+        if _flusher_thread is None:
+            _flusher_thread = threading.Thread(target=_flush_loop, daemon=True)
+            _flusher_thread.start()
+
+# ---------------------------
+# ⓪-3 ローカルDB（SQLite）と Sheets への複製
+# ---------------------------
+# ✅ 複製に失敗した時のリトライ回数
+REPLICATION_MAX_RETRIES = 5
+
+_local_store_lock = threading.Lock()
+_local_store_ready = False
+_replication_queue = queue.Queue()
+_replicator_thread = None
+
+def use_local_store():
+    return SHEETS_MODE in ("replica", "off")
+
+# 🔧 初回のみ、既存のシートの内容をローカルDBへ取り込む
+def init_local_store():
+    global _local_store_ready
+    if _local_store_ready:
+        return
+    with _local_store_lock:
+        if _local_store_ready:
+            return
+        if SHEETS_MODE == "replica" and not local_store.get_meta("imported_from_sheets"):
+            import_sheets_to_local_store()
+        _local_store_ready = True
+
+def import_sheets_to_local_store():
+    values = connect_sheet(*USER_INFO_SHEET).get_all_values()
+    header = values[0] if values else local_store.DEFAULT_USER_INFO_HEADER
+    local_store.import_user_info(header, [dict(zip(header, gspread.utils.numericise_all(row))) for row in values[1:]])
+    local_store.import_usage(connect_sheet("DiaryUserData", "UsageLog").get_all_records())
+    local_store.import_feedback(connect_sheet("DiaryUserData", "FeedbackLog").get_all_records())
+    local_store.import_diary_samples(connect_sheet("DiaryUserData", "PremiumDiarySamples").get_all_records())
+    local_store.import_premium_user_info(connect_sheet("DiaryUserData", "PremiumUserInfo").get_all_records())
+    local_store.set_meta("imported_from_sheets", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    logging.info("[LocalStore] シートの内容をローカルDBへ取り込みました")
+
+# 🔧 書き込みの振り分け：ローカルDBへ書いてから Sheets へ複製（SHEETS_MODE に従う）
+def dispatch_write(local_fn, sheet_fn, *args):
+    if use_local_store():
+        init_local_store()
+        local_fn(*args)
+        if SHEETS_MODE == "replica":
+            _replicate(sheet_fn, *args)
+        return
+    sheet_fn(*args)
+
+def _replicate(sheet_fn, *args):
+    global _replicator_thread
+    _replication_queue.put((sheet_fn, args, 0))
+    with _local_store_lock:
+        if _replicator_thread is None:
+            _replicator_thread = threading.Thread(target=_replication_loop, daemon=True)
+            _replicator_thread.start()
+
+def _replication_loop():
+    while True:
+        _run_replication(*_replication_queue.get())
+
+def _run_replication(sheet_fn, args, attempts):
+    try:
+        sheet_fn(*args)
+    except Exception as e:
+        if attempts + 1 >= REPLICATION_MAX_RETRIES:
+            logging.error(f"[LocalStore] Sheetsへの複製を諦めました: {sheet_fn.__name__} {e}")
+            return
+        logging.warning(f"[LocalStore] Sheetsへの複製に失敗。再試行します: {sheet_fn.__name__} {e}")
+        time.sleep(2 ** attempts)
+        _replication_queue.put((sheet_fn, args, attempts + 1))
+
+# 🔧 終了時：未複製分を流してから書き込みバッファを書き出す
+def shutdown_writes():
+    while True:
+        try:
+            item = _replication_queue.get_nowait()
+        except queue.Empty:
+            break
+        _run_replication(*item)
+    flush_pending_writes()
+
+atexit.register(shutdown_writes)
 
 # ---------------------------
 # ① 有料プラン申請管理 (user_requests)
@@ -28,70 +455,56 @@ def append_user_to_sheet(user_id, nickname="未設定", status="未承認", stor
     sheet.append_row(new_row)
 
 def get_approved_users():
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    records = sheet.get_all_records()
-    return [row["user_id"] for row in records if row.get("ステータス") == "承認済"]
+    if use_local_store():
+        init_local_store()
+        return local_store.get_approved_user_ids()
+    _ensure_user_info_index()
+    with _user_info_lock:
+        return [_user_info_rows[key]["record"]["user_id"] for key in _approved_user_ids]
 
 def complete_premium_registration(user_id, nickname, store):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    records = sheet.get_all_records()
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    for idx, row in enumerate(records):
-        if row["user_id"] == user_id:
-            sheet.update_cell(idx + 2, 7, "承認待ち")
-            sheet.update_cell(idx + 2, 8, now)
-            sheet.update_cell(idx + 2, 9, store)
-            return
+    _update_user_cells(user_id, {7: "承認待ち", 8: now, 9: store})
 
 # ---------------------------
 # ② ユーザー登録情報管理
 # ---------------------------
 def register_user_info(user_id, name, age_range, tone):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    records = sheet.get_all_records()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    for idx, row in enumerate(records):
-        if row["user_id"] == user_id:
-            sheet.update_cell(idx + 2, 2, name)
-            sheet.update_cell(idx + 2, 3, age_range)
-            sheet.update_cell(idx + 2, 4, tone)
-            sheet.update_cell(idx + 2, 5, now)
-            return
-
-    sheet.append_row([user_id, name, age_range, tone, now])
+    save_user_info_to_sheet(user_id, {"name": name, "age_range": age_range, "tone": tone})
 
 def save_user_info_to_sheet(user_id, info):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    records = sheet.get_all_records()
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    for idx, row in enumerate(records):
-        if row["user_id"] == user_id:
-            sheet.update(f"A{idx + 2}:E{idx + 2}", [[
-                user_id,
-                info.get("name", ""),
-                info.get("age_range", ""),
-                info.get("tone", ""),
-                now
-            ]])
-            return
-
-    sheet.append_row([
+    values = [
         user_id,
         info.get("name", ""),
         info.get("age_range", ""),
         info.get("tone", ""),
         now
-    ])
+    ]
+    dispatch_write(_local_save_user_info, _sheet_save_user_info, user_id, values)
+
+def _local_save_user_info(user_id, values):
+    local_store.update_user_cells(user_id, dict(enumerate(values, start=1)), create=True)
+
+def _sheet_save_user_info(user_id, values):
+    sheet = connect_sheet(*USER_INFO_SHEET)
+    row = find_user_row(user_id)
+    if row is not None:
+        sheet.update(f"A{row}:E{row}", [values])
+        _update_user_info_mirror(user_id, dict(enumerate(values, start=1)))
+        return
+
+    _append_user_info_row(sheet, values)
 
 # ---------------------------
 # ②-2 プレミアムユーザー情報保存
 # ---------------------------
 def save_premium_user_info_to_sheet(user_id, premium_data):
-    sheet = connect_sheet("DiaryUserData", "PremiumUserInfo")
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    dispatch_write(local_store.insert_premium_user_info, _sheet_save_premium_user_info, user_id, premium_data, now)
+
+def _sheet_save_premium_user_info(user_id, premium_data, now):
+    sheet = connect_sheet("DiaryUserData", "PremiumUserInfo")
     sheet.append_row([
         user_id,
         premium_data.get("emoji_list", ""),
@@ -109,39 +522,59 @@ def save_premium_user_info_to_sheet(user_id, premium_data):
 # ---------------------------
 # ③ 使用回数ログ管理
 # ---------------------------
-def log_usage(user_id):
-    sheet = connect_sheet("DiaryUserData", "UsageLog")
-    today = datetime.now().strftime("%Y-%m-%d")
+# ✅ 回数の判定・加算は usage_quota（ローカルDBのカウンタ）で行い、シートへは非同期で反映する
+
+def _sheet_log_usage(user_id, today, amount=1):
+    buffer_increment("DiaryUserData", "UsageLog", (user_id, today), amount)
+
+def _resolve_usage_counts(sheet, counts):
     records = sheet.get_all_records()
+    updates = []
+    remaining = dict(counts)
 
     for i, row in enumerate(records):
-        if row["user_id"] == user_id and row["date"] == today:
-            sheet.update_cell(i + 2, 3, int(row["count"]) + 1)
-            return
+        key = (row["user_id"], row["date"])
+        if key in remaining:
+            count = int(row["count"]) + remaining.pop(key)
+            updates.append({"range": gspread.utils.rowcol_to_a1(i + 2, 3), "values": [[count]]})
 
-    sheet.append_row([user_id, today, 1])
+    new_rows = [[user_id, date, amount] for (user_id, date), amount in remaining.items()]
+    return updates, new_rows
 
-def get_usage_count(user_id):
-    sheet = connect_sheet("DiaryUserData", "UsageLog")
-    today = datetime.now().strftime("%Y-%m-%d")
-    records = sheet.get_all_records()
+register_counter("DiaryUserData", "UsageLog", _resolve_usage_counts)
 
-    for row in records:
-        if row["user_id"] == user_id and row["date"] == today:
-            return int(row["count"])
-    return 0
+# ✅ ローカルで数えた使用回数を UsageLog へ反映（書き込みバッファ経由。off では反映しない）
+def sync_usage_to_sheet(user_id, date, amount=1):
+    if SHEETS_MODE != "off":
+        _sheet_log_usage(user_id, date, amount)
+
+# 🔧 指定日の使用回数 {user_id: 回数}（カウンタの初期値用に UsageLog を1回だけ読む）
+def get_usage_counts_from_sheet(date):
+    counts = {}
+    for row in connect_sheet("DiaryUserData", "UsageLog").get_all_records():
+        if str(row.get("date", "")) == date and row.get("user_id"):
+            counts[row["user_id"]] = counts.get(row["user_id"], 0) + local_store._to_int(row.get("count", 0))
+    return counts
 
 # ---------------------------
 # ④ フィードバックログ管理
 # ---------------------------
 def log_feedback(user_id, diary_type, result, diary_text):
-    sheet = connect_sheet("DiaryUserData", "FeedbackLog")
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    sheet.append_row([user_id, diary_type, result, now, diary_text])
+    dispatch_write(local_store.insert_feedback, _sheet_log_feedback, user_id, diary_type, result, now, diary_text)
+    return now
+
+def _sheet_log_feedback(user_id, diary_type, result, now, diary_text):
+    buffer_append_row("DiaryUserData", "FeedbackLog", [user_id, diary_type, result, now, diary_text])
+
+# include_archive=True の時だけアーカイブ済みの行も見る（ローカルDBは全件を持つので常に全件）
+def get_positive_feedback(user_id, diary_type=None, limit=5, include_archive=False):
+    if use_local_store():
+        init_local_store()
+        return local_store.get_positive_feedback(user_id, diary_type, limit)
 
-def get_positive_feedback(user_id, diary_type=None, limit=5):
     sheet = connect_sheet("DiaryUserData", "FeedbackLog")
-    records = sheet.get_all_records()
+    records = (get_archived_records("FeedbackLog") if include_archive else []) + sheet.get_all_records()
     filtered = [
         row for row in records
         if row["user_id"] == user_id and row["result"] == "good"
@@ -150,14 +583,51 @@ def get_positive_feedback(user_id, diary_type=None, limit=5):
     filtered = sorted(filtered, key=lambda x: x["timestamp"], reverse=True)
     return [row["diary_text"] for row in filtered[:limit]]
 
+# 🔧 全ユーザーの👍 [(user_id, diary_type, timestamp, diary_text)]（FeedbackLog を1回だけ読む。未反映のバッファ分も含める）
+def get_all_positive_feedback():
+    # 読み込みとバッファの確認の間に反映されて取りこぼさないよう、フラッシュと排他にする
+    with _flush_lock:
+        rows = [
+            [row["user_id"], row["diary_type"], row["result"], row["timestamp"], row["diary_text"]]
+            for row in connect_sheet("DiaryUserData", "FeedbackLog").get_all_records()
+        ]
+        with _write_lock:
+            rows += _pending_appends.get(("DiaryUserData", "FeedbackLog"), [])
+    return [
+        (user_id, diary_type, str(timestamp), str(diary_text).strip())
+        for user_id, diary_type, result, timestamp, diary_text in rows
+        if result == "good" and str(diary_text).strip()
+    ]
+
 def append_diary_sample_to_sheet(user_id, diary_type, diary_text, timestamp):
-    sheet = connect_sheet("DiaryUserData", "PremiumDiarySamples")
-    sheet.append_row([user_id, diary_type, timestamp, diary_text])
+    dispatch_write(_local_append_diary_sample, _sheet_append_diary_sample, user_id, diary_type, diary_text, timestamp)
+
+def _local_append_diary_sample(user_id, diary_type, diary_text, timestamp):
+    local_store.insert_diary_sample(user_id, diary_type, timestamp, diary_text)
+
+def _sheet_append_diary_sample(user_id, diary_type, diary_text, timestamp):
+    append_log_rows("DiaryUserData", "PremiumDiarySamples", [[user_id, diary_type, timestamp, diary_text]])
+
+# ✅ 複数の日記をまとめて追加（シートは append_rows 1回）
+# entries: [(diary_type, diary_text)]
+def append_diary_samples_to_sheet(user_id, entries, timestamp):
+    if entries:
+        dispatch_write(_local_append_diary_samples, _sheet_append_diary_samples, user_id, list(entries), timestamp)
+
+def _local_append_diary_samples(user_id, entries, timestamp):
+    local_store.insert_diary_samples([(user_id, diary_type, timestamp, text, 0) for diary_type, text in entries])
+
+def _sheet_append_diary_samples(user_id, entries, timestamp):
+    append_log_rows("DiaryUserData", "PremiumDiarySamples", [[user_id, diary_type, timestamp, text] for diary_type, text in entries])
 
 # ---------------------------
 # ⑤ 有料ユーザーの自作日記
 # ---------------------------
 def get_premium_diary_samples(user_id, diary_type, limit=10):
+    if use_local_store():
+        init_local_store()
+        return [text.strip() for text in local_store.get_diary_samples(user_id, diary_type, limit)]
+
     sheet = connect_sheet("DiaryUserData", "PremiumDiarySamples")
     records = sheet.get_all_records()
     samples = [
@@ -167,17 +637,39 @@ def get_premium_diary_samples(user_id, diary_type, limit=10):
     ]
     return samples[:limit]
 
+# ✅ 参考日記の検索インデックス用：自作日記と👍の日記をまとめて (source, diary_type, text)
+def get_user_reference_texts(user_id, include_archive=False):
+    if use_local_store():
+        init_local_store()
+        return local_store.get_user_reference_texts(user_id)
+
+    sample_records = connect_sheet("DiaryUserData", "PremiumDiarySamples").get_all_records()
+    feedback_records = connect_sheet("DiaryUserData", "FeedbackLog").get_all_records()
+    if include_archive:
+        sample_records = get_archived_records("PremiumDiarySamples") + sample_records
+        feedback_records = get_archived_records("FeedbackLog") + feedback_records
+    samples = [
+        ("sample", row["diary_type"], str(row["diary_text"]).strip())
+        for row in sample_records
+        if row["user_id"] == user_id and str(row.get("diary_text", "")).strip()
+    ]
+    feedbacks = [
+        ("feedback", row["diary_type"], str(row["diary_text"]).strip())
+        for row in feedback_records
+        if row["user_id"] == user_id and row["result"] == "good" and str(row.get("diary_text", "")).strip()
+    ]
+    return samples + feedbacks
+
 # ---------------------------
 # ⑥ ユーザー提出日記の保存
 # ---------------------------
 def save_user_diary_entry(user_id, diary_type, diary_text):
-    sheet = connect_sheet("DiaryUserData", "UserDiaries")
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    sheet.append_row([user_id, diary_type, diary_text, now], value_input_option="USER_ENTERED")
+    append_log_rows("DiaryUserData", "UserDiaries", [[user_id, diary_type, diary_text, now]], value_input_option="USER_ENTERED")
 
-def get_user_diary_samples_from_sheet(user_id, diary_type=None, limit=10):
+def get_user_diary_samples_from_sheet(user_id, diary_type=None, limit=10, include_archive=False):
     sheet = connect_sheet("DiaryUserData", "UserDiaries")
-    records = sheet.get_all_records()
+    records = (get_archived_records("UserDiaries") if include_archive else []) + sheet.get_all_records()
     filtered = [
         row for row in records
         if row["user_id"] == user_id and (diary_type is None or row["diary_type"] == diary_type)
@@ -189,6 +681,10 @@ def get_user_diary_samples_from_sheet(user_id, diary_type=None, limit=10):
 # ⑦ テンプレート取得・使用カウント
 # ---------------------------
 def get_templates_by_section(sheet_name, tab_name):
+    if use_local_store():
+        _ensure_local_templates(sheet_name, tab_name)
+        return local_store.get_templates(tab_name)
+
     sheet = connect_sheet(sheet_name, tab_name)
     data = sheet.get_all_records()
     templates = {}
@@ -198,15 +694,151 @@ def get_templates_by_section(sheet_name, tab_name):
         templates.setdefault(section, []).append(content)
     return templates
 
-def increment_template_usage(sheet, section, text, records):
+# ✅ テンプレートキャッシュ（TTL + LRU）。TTL切れ時はスプレッドシートの最終更新時刻を確認し、
+# 変わっていなければ再ダウンロードしない
+TEMPLATE_CACHE_TTL = int(os.getenv("TEMPLATE_CACHE_TTL", "600"))
+TEMPLATE_CACHE_SIZE = 16
+# ✅ 最終更新時刻（Drive の modifiedTime）を問い合わせる最短間隔（秒）。同じブックの複数タブの TTL 切れで1回にまとめる
+TEMPLATE_VERSION_CHECK_INTERVAL = int(os.getenv("TEMPLATE_VERSION_CHECK_INTERVAL", "60"))
+
+_template_lock = threading.RLock()
+_template_cache = OrderedDict()     # (スプレッドシート, タブ) → キャッシュ情報
+_spreadsheet_versions = {}          # スプレッドシート → (最終更新時刻, 確認した時刻)
+_local_templates_loaded_at = {}
+
+# 🔧 lastUpdateTime プロパティは open 時の値のまま変わらないため、毎回 Drive に問い合わせる get_lastUpdateTime を使う
+def _get_spreadsheet_version(sheet_name):
+    with _template_lock:
+        cached = _spreadsheet_versions.get(sheet_name)
+    if cached and time.monotonic() - cached[1] < TEMPLATE_VERSION_CHECK_INTERVAL:
+        return cached[0]
+    try:
+        version = get_spreadsheet(sheet_name).get_lastUpdateTime()
+    except Exception as e:
+        logging.warning(f"[Sheets] {sheet_name} の更新時刻を取得できません: {e}")
+        return None
+    with _template_lock:
+        _spreadsheet_versions[sheet_name] = (version, time.monotonic())
+    return version
+
+# 🔧 タブを1回読み込み、セクション別テンプレートと (section, text) → 行番号 の対応を作る
+def _load_template_entry(sheet_name, tab_name, version):
+    values = connect_sheet(sheet_name, tab_name).get_all_values()
+    header = values[0] if values else []
+    templates = {}
+    rows = {}
+    for idx, row in enumerate(values[1:]):
+        record = dict(zip(header, row))
+        section = str(record.get("section", "")).strip()
+        text = str(record.get("text", "")).strip()
+        if section and text:
+            templates.setdefault(section, []).append(text)
+            rows.setdefault((section, text), idx + 2)
+    return {
+        "templates": templates,
+        "rows": rows,
+        "header": header,
+        "version": version,
+        "checked_at": time.monotonic()
+    }
+
+def get_cached_templates(sheet_name, tab_name):
+    key = (sheet_name, tab_name)
+    with _template_lock:
+        entry = _template_cache.get(key)
+        if entry and time.monotonic() - entry["checked_at"] < TEMPLATE_CACHE_TTL:
+            _template_cache.move_to_end(key)
+            return entry["templates"]
+
+    version = _get_spreadsheet_version(sheet_name)
+    if entry and version is not None and version == entry["version"]:
+        with _template_lock:
+            entry["checked_at"] = time.monotonic()
+        return entry["templates"]
+
+    entry = _load_template_entry(sheet_name, tab_name, version)
+    with _template_lock:
+        _template_cache[key] = entry
+        _template_cache.move_to_end(key)
+        while len(_template_cache) > TEMPLATE_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+    return entry["templates"]
+
+def invalidate_template_cache(sheet_name=None, tab_name=None):
+    with _template_lock:
+        for key in list(_template_cache):
+            if (sheet_name is None or key[0] == sheet_name) and (tab_name is None or key[1] == tab_name):
+                del _template_cache[key]
+        for name in list(_spreadsheet_versions):
+            if sheet_name is None or name == sheet_name:
+                del _spreadsheet_versions[name]
+        for tab in list(_local_templates_loaded_at):
+            if tab_name is None or tab == tab_name:
+                del _local_templates_loaded_at[tab]
+
+def _get_template_entry(sheet_name, tab_name):
+    with _template_lock:
+        return _template_cache.get((sheet_name, tab_name))
+
+# 🔧 テンプレートはシートで編集されるため、replica 時は TTL ごとにシートから取り込み直す
+def _ensure_local_templates(sheet_name, tab_name):
+    init_local_store()
+    if SHEETS_MODE != "replica":
+        return
+    with _template_lock:
+        loaded_at = _local_templates_loaded_at.get(tab_name)
+    if loaded_at is not None and time.monotonic() - loaded_at < TEMPLATE_CACHE_TTL:
+        return
+    local_store.replace_templates(tab_name, connect_sheet(sheet_name, tab_name).get_all_records())
+    with _template_lock:
+        _local_templates_loaded_at[tab_name] = time.monotonic()
+
+def increment_template_usage(sheet_name, tab_name, section, text):
+    dispatch_write(_local_increment_template_usage, _sheet_increment_template_usage, sheet_name, tab_name, section, text)
+
+def _local_increment_template_usage(sheet_name, tab_name, section, text):
+    local_store.increment_template_usage(tab_name, section, text)
+
+def _sheet_increment_template_usage(sheet_name, tab_name, section, text):
+    if (sheet_name, tab_name) not in _counter_resolvers:
+        register_counter(sheet_name, tab_name, functools.partial(_resolve_template_counts, sheet_name, tab_name))
+    buffer_increment(sheet_name, tab_name, (section, text.strip()))
+
+# 🔧 キャッシュの行番号を使い、対象行だけを読んで加算する（タブ全体は読まない）
+def _resolve_template_counts(sheet_name, tab_name, sheet, counts):
+    entry = _get_template_entry(sheet_name, tab_name)
+    if entry and "used_count" in entry["header"] and all(key in entry["rows"] for key in counts):
+        header = entry["header"]
+        count_col = header.index("used_count") + 1
+        rows = [entry["rows"][key] for key in counts]
+        current_rows = sheet.batch_get([f"{row}:{row}" for row in rows])
+        updates = []
+        for key, row, value_range in zip(counts, rows, current_rows):
+            record = dict(zip(header, value_range[0] if value_range else []))
+            if (str(record.get("section", "")).strip(), str(record.get("text", "")).strip()) != key:
+                # 行がずれている（シートが編集された）のでタブ全体から探し直す
+                invalidate_template_cache(sheet_name, tab_name)
+                return _resolve_template_counts_full(sheet, counts)
+            current = record.get("used_count", 0)
+            count = int(current) if str(current).isdigit() else 0
+            updates.append({"range": gspread.utils.rowcol_to_a1(row, count_col), "values": [[count + counts[key]]]})
+        return updates, []
+    return _resolve_template_counts_full(sheet, counts)
+
+def _resolve_template_counts_full(sheet, counts):
     header = sheet.row_values(1)
     count_col = header.index("used_count") + 1
+    records = sheet.get_all_records()
+    updates = []
+    remaining = dict(counts)
+
     for i, row in enumerate(records):
-        if row["section"].strip() == section and row["text"].strip() == text.strip():
+        key = (row["section"].strip(), row["text"].strip())
+        if key in remaining:
             current = row.get("used_count", 0)
             count = int(current) if str(current).isdigit() else 0
-            sheet.update_cell(i + 2, count_col, count + 1)
-            break
+            updates.append({"range": gspread.utils.rowcol_to_a1(i + 2, count_col), "values": [[count + remaining.pop(key)]]})
+    return updates, []
 
 # ---------------------------
 # ⑧ テストユーザー
@@ -216,40 +848,34 @@ def get_test_users():
     return [row["user_id"] for row in sheet.get_all_records() if row.get("user_id")]
 
 def is_test_user(user_id):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    for row in sheet.get_all_records():
-        if row.get("user_id") == user_id:
-            return str(row.get("is_test_user", "")).strip().upper() == "TRUE"
+    row = get_user_record(user_id)
+    if row:
+        return str(row.get("is_test_user", "")).strip().upper() == "TRUE"
     return False
 
 # ---------------------------
 # ⑨ その他補助関数
 # ---------------------------
 def get_user_info(user_id):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    for row in sheet.get_all_records():
-        if row.get("user_id") == user_id:
-            return row
-    return {}
-
-def get_user_info(user_id):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    records = sheet.get_all_records()
-    for row in records:
-        if str(row.get("user_id", "")).strip() == str(user_id):
-            return {
-                "user_id": user_id,
-                "name": row.get("源氏名", ""),  # ←ここが必要！
-                "age_range": row.get("年代", ""),
-                "tone": row.get("口調", ""),
-                "is_premium": row.get("ステータス", "") == "承認済"
-            }
+    row = get_user_record(user_id)
+    if row:
+        return {
+            "user_id": user_id,
+            "name": row.get("源氏名", ""),  # ←ここが必要！
+            "age_range": row.get("年代", ""),
+            "tone": row.get("口調", ""),
+            "is_premium": row.get("ステータス", "") == "承認済"
+        }
     return None
 
 # ✅ 追加：PremiumUserInfo タブからプレミアム情報を取得する関数
 def get_premium_user_info(user_id):
-    sheet = connect_sheet("DiaryUserData", "PremiumUserInfo")
-    records = sheet.get_all_records()
+    if use_local_store():
+        init_local_store()
+        records = [row for row in [local_store.get_premium_user_info(user_id)] if row]
+    else:
+        sheet = connect_sheet("DiaryUserData", "PremiumUserInfo")
+        records = sheet.get_all_records()
 
     for row in records:
         if str(row.get("user_id", "")).strip() == str(user_id).strip():
@@ -267,41 +893,219 @@ def get_premium_user_info(user_id):
     
 # ✅ LINEユーザーIDから基本情報を取得（name, age_range, tone のみ）
 def get_user_info_from_sheet(user_id):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    records = sheet.get_all_records()
-    for row in records:
-        if str(row.get("user_id", "")).strip() == str(user_id):
-            return {
-                "name": row.get("源氏名", ""),
-                "age_range": row.get("年代", ""),
-                "tone": row.get("口調", "")
-            }
+    row = get_user_record(user_id)
+    if row:
+        return {
+            "name": row.get("源氏名", ""),
+            "age_range": row.get("年代", ""),
+            "tone": row.get("口調", "")
+        }
     return {}
 
 def update_premium_status(user_id, status):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for idx, row in enumerate(sheet.get_all_records()):
-        if row["user_id"] == user_id:
-            sheet.update_cell(idx + 2, 7, status)
-            sheet.update_cell(idx + 2, 8, now)
-            return
+    _update_user_cells(user_id, {7: status, 8: now})
 
 def mark_premium_notified(user_id):
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    for idx, row in enumerate(sheet.get_all_records()):
-        if row["user_id"] == user_id:
-            sheet.update_cell(idx + 2, 10, "TRUE")
-            return
+    mark_premium_notified_many([user_id])
+
+# 🔧 まとめて通知済みにする（シートは batch_update 1回）
+def mark_premium_notified_many(user_ids):
+    if user_ids:
+        dispatch_write(local_store.update_many_user_cells, _sheet_update_many_user_cells, list(user_ids), {10: "TRUE"})
+
+def _sheet_update_many_user_cells(user_ids, cells):
+    rows = {user_id: find_user_row(user_id) for user_id in user_ids}
+    rows = {user_id: row for user_id, row in rows.items() if row is not None}
+    if not rows:
+        return
+    sheet = connect_sheet(*USER_INFO_SHEET)
+    sheet.batch_update([
+        {"range": gspread.utils.rowcol_to_a1(row, col), "values": [[value]]}
+        for row in rows.values() for col, value in cells.items()
+    ])
+    for user_id in rows:
+        _update_user_info_mirror(user_id, cells)
+
+# ✅ 承認状況のスナップショット {user_id: (ステータス, 通知済み)}
+# シートは user_id・ステータス・通知済み の3列だけ読む
+def get_user_status_snapshot():
+    if use_local_store():
+        init_local_store()
+        if SHEETS_MODE == "replica":
+            _pull_user_status_from_sheet()
+        return local_store.get_user_status_snapshot()
+    return _read_user_status_columns()
+
+def _read_user_status_columns():
+    with _user_info_lock:
+        header = list(_user_info_header)
+    if not header:
+        refresh_user_info_index()
+        with _user_info_lock:
+            header = list(_user_info_header)
+    if not all(name in header for name in ("user_id", "ステータス", "通知済み")):
+        refresh_user_info_index()
+        with _user_info_lock:
+            return {
+                key: (entry["record"].get("ステータス", ""), _is_true_cell(entry["record"].get("通知済み", "")))
+                for key, entry in _user_info_rows.items()
+            }
+
+    cols = [header.index(name) + 1 for name in ("user_id", "ステータス", "通知済み")]
+    letters = [re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, col)) for col in cols]
+    id_values, status_values, notified_values = connect_sheet(*USER_INFO_SHEET).batch_get(
+        [f"{letter}2:{letter}" for letter in letters]
+    )
+
+    def cell(values, idx):
+        return values[idx][0] if idx < len(values) and values[idx] else ""
+
+    snapshot = {}
+    unknown = False
+    for idx in range(len(id_values)):
+        key = _user_key(cell(id_values, idx))
+        if not key:
+            continue
+        status, notified = cell(status_values, idx), cell(notified_values, idx)
+        snapshot[key] = (status, _is_true_cell(notified))
+        with _user_info_lock:
+            entry = _user_info_rows.get(key)
+            if entry is None or entry["row"] != idx + 2:
+                unknown = True
+                continue
+            stale = (entry["record"].get("ステータス", ""), entry["record"].get("通知済み", "")) != (status, notified)
+        if stale:
+            _update_user_info_mirror(key, {cols[1]: status, cols[2]: notified})
+
+    # 新規行・行ずれがあればミラーを次回読み直す
+    if unknown:
+        invalidate_user_info_index()
+    return snapshot
+
+def _is_true_cell(value):
+    return str(value).strip().upper() == "TRUE"
 
 def get_newly_approved_users():
-    sheet = connect_sheet("DiaryUserData", "UserInfoLog")
-    return [
-        row for row in sheet.get_all_records()
-        if row.get("ステータス") == "承認済" and str(row.get("通知済み", "")).strip().upper() != "TRUE"
-    ]
+    if use_local_store():
+        init_local_store()
+        if SHEETS_MODE == "replica":
+            _pull_user_status_from_sheet()
+        return local_store.get_unnotified_approved_users()
+
+    # 承認はシート上で手動で行われるため、毎回最新を読み直す
+    refresh_user_info_index()
+    with _user_info_lock:
+        return [
+            dict(_user_info_rows[key]["record"]) for key in _approved_user_ids
+            if str(_user_info_rows[key]["record"].get("通知済み", "")).strip().upper() != "TRUE"
+        ]
+
+# 🔧 承認はシート上で行われるため、ステータス列だけシートからローカルDBへ反映
+def _pull_user_status_from_sheet():
+    sheet_statuses = _read_user_status_columns()
+    local_statuses = local_store.get_user_statuses()
+    changed = {
+        key: status for key, (status, _) in sheet_statuses.items()
+        if key in local_statuses and local_statuses[key] != status
+    }
+    for user_id, status in changed.items():
+        local_store.update_user_cells(user_id, {7: status})
 
 def append_user_diary_entry(user_id, diary_type, diary_text):
-    sheet = connect_sheet("DiaryUserData", "UserDiaryLog")
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    sheet.append_row([user_id, diary_type, diary_text, now])
+    append_log_rows("DiaryUserData", "UserDiaryLog", [[user_id, diary_type, diary_text, now]])
+
+# ---------------------------
+# ⑨ ログタブのアーカイブ（古い行を月別に移す）
+# ---------------------------
+# ✅ 移す先  sheets: 同じスプレッドシートの月別タブ <タブ名>_YYYY-MM / csv: LOG_ARCHIVE_DIR/<タブ名>/YYYY-MM.csv
+LOG_ARCHIVE_TARGET = os.getenv("LOG_ARCHIVE_TARGET", "sheets")
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "log_archive")
+
+_DATE_PATTERN = re.compile(r"(\d{4})[-/](\d{1,2})[-/](\d{1,2})")
+
+def _normalize_date(value):
+    match = _DATE_PATTERN.match(str(value).strip())
+    if not match:
+        return None
+    year, month, day = match.groups()
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+def archive_tab_name(tab_name, month):
+    return f"{tab_name}_{month}"
+
+def _write_archive(spreadsheet_name, tab_name, header, rows_by_month):
+    if LOG_ARCHIVE_TARGET == "csv":
+        folder = os.path.join(LOG_ARCHIVE_DIR, tab_name)
+        os.makedirs(folder, exist_ok=True)
+        for month, rows in sorted(rows_by_month.items()):
+            path = os.path.join(folder, f"{month}.csv")
+            is_new = not os.path.exists(path)
+            with open(path, "a", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(header)
+                writer.writerows(rows)
+        return
+    for month, rows in sorted(rows_by_month.items()):
+        get_or_create_sheet(spreadsheet_name, archive_tab_name(tab_name, month), header).append_rows(rows, value_input_option="USER_ENTERED")
+
+# 🔧 日付列（date_columns のうち見出しにある最初の列）が cutoff より前の行を月別アーカイブへ移し、
+# タブには残りの行だけを詰めて残す → 移した行数
+# 書き込みバッファの反映（行番号で更新する）と重ならないよう、他プロセスの分も含めて _row_write_lock の中で行う
+def archive_log_rows(tab_name, date_columns, cutoff, spreadsheet_name="DiaryUserData"):
+    with _row_write_lock():
+        try:
+            sheet = connect_sheet(spreadsheet_name, tab_name)
+        except gspread.exceptions.WorksheetNotFound:
+            logging.info(f"[アーカイブ] {tab_name} タブがないためスキップします")
+            return 0
+        values = sheet.get_all_values()
+        if len(values) < 2:
+            return 0
+        header, rows = values[0], values[1:]
+        col = next((header.index(name) for name in date_columns if name in header), None)
+        if col is None:
+            logging.warning(f"[アーカイブ] {tab_name} に日付列 {date_columns} がありません")
+            return 0
+
+        rows_by_month = {}
+        keep = []
+        for row in rows:
+            if not any(row):
+                continue
+            date = _normalize_date(row[col]) if col < len(row) else None
+            if date and date < cutoff:
+                rows_by_month.setdefault(date[:7], []).append(row)
+            else:
+                keep.append(row)
+        moved = sum(len(month_rows) for month_rows in rows_by_month.values())
+        if not moved:
+            return 0
+
+        # 先にアーカイブへ書き、成功してからホットなタブを詰める
+        # get_all_values は表示用の文字列なので、USER_ENTERED で書き戻して数値・日付の型を保つ
+        _write_archive(spreadsheet_name, tab_name, header, rows_by_month)
+        if keep:
+            sheet.update(range_name="A2", values=keep, value_input_option="USER_ENTERED")
+        sheet.delete_rows(len(keep) + 2, len(rows) + 1)
+    logging.info(f"[アーカイブ] {tab_name} の {moved}行を移しました（{cutoff} より前）")
+    return moved
+
+# ✅ アーカイブ済みの行（読み出し関数で include_archive=True の時だけ使う）
+def get_archived_records(tab_name, spreadsheet_name="DiaryUserData"):
+    records = []
+    if LOG_ARCHIVE_TARGET == "csv":
+        for path in sorted(glob.glob(os.path.join(LOG_ARCHIVE_DIR, tab_name, "*.csv"))):
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, [])
+                records.extend(dict(zip(header, gspread.utils.numericise_all(row))) for row in reader)
+        return records
+
+    pattern = re.compile(re.escape(tab_name) + r"_\d{4}-\d{2}")
+    titles = sorted(ws.title for ws in get_spreadsheet(spreadsheet_name).worksheets() if pattern.fullmatch(ws.title))
+    for title in titles:
+        records.extend(connect_sheet(spreadsheet_name, title).get_all_records())
+    return records
@@ -0,0 +1,7 @@
+# ✅ gunicorn はカレントディレクトリの gunicorn.conf.py を自動で読む
+# ワーカーごとに、アプリを読み込んだ後でバックグラウンドの定期処理を始める
+# （承認通知・ログ整理はそれぞれロックを取れた1プロセスだけが実際に動く）
+
+def post_worker_init(worker):
+    import app
+    app.start_background_jobs()
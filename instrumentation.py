@@ -0,0 +1,161 @@
+import os
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ✅ 処理段階ごとのレイテンシ計測（Prometheus 形式で /metrics に出す）
+# METRICS_STAGES で計測する段階を指定（既定 all）。外した段階は計測処理そのものを行わない
+# 段階: webhook（イベント1件全体）/ signature / sheets / openai / tone / line
+
+METRICS_STAGES = {s.strip() for s in os.getenv("METRICS_STAGES", "all").split(",") if s.strip()}
+
+# ✅ ヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = "diary_bot"
+
+_lock = threading.Lock()
+_histograms = {}   # (段階, ラベル) → [バケットごとの件数, 合計秒, 件数]
+_counters = {}     # (名前, ラベル) → 値
+_gauges = {}       # 名前 → 値を返す関数
+
+# 🔧 スレッドプールへは contextvars.copy_context().run で引き継ぐ（threading.local だと途切れる）
+_trace_id = contextvars.ContextVar("trace_id", default="-")
+
+def enabled(stage):
+    return "all" in METRICS_STAGES or stage in METRICS_STAGES
+
+def observe(stage, seconds, **labels):
+    if not enabled(stage):
+        return
+    key = (stage, tuple(sorted(labels.items())))
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+def increment(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+# ✅ /metrics 出力時に値を読むゲージ（キュー深さなど）
+def register_gauge(name, fn):
+    _gauges[name] = fn
+
+@contextmanager
+def _timer(stage, labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, **labels)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
+
+# ✅ with timed("sheets", tab=..., op=...): で計測（無効な段階は何もしない）
+def timed(stage, **labels):
+    if not enabled(stage):
+        return _null_timer
+    return _timer(stage, labels)
+
+# ---------------------------
+# Google Sheets のワークシート呼び出しをタブ・操作別に計測
+# ---------------------------
+class InstrumentedWorksheet:
+    def __init__(self, worksheet, tab):
+        self._worksheet = worksheet
+        self._tab = tab
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+
+        def call(*args, **kwargs):
+            with _timer("sheets", {"tab": self._tab, "op": name}):
+                return attr(*args, **kwargs)
+        return call
+
+def instrument_worksheet(worksheet, tab):
+    if not enabled("sheets"):
+        return worksheet
+    return InstrumentedWorksheet(worksheet, tab)
+
+# ---------------------------
+# トレースID（イベントごとにログへ付ける）
+# ---------------------------
+def start_trace(trace_id=None):
+    trace_id = trace_id or uuid.uuid4().hex[:12]
+    _trace_id.set(trace_id)
+    return trace_id
+
+def current_trace():
+    return _trace_id.get()
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = current_trace()
+        return True
+
+# ---------------------------
+# Prometheus テキスト形式
+# ---------------------------
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+def render_prometheus():
+    with _lock:
+        histograms = {key: ([*h[0]], h[1], h[2]) for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    described = set()
+    for (stage, labels), (buckets, total, count) in sorted(histograms.items()):
+        name = f"{METRIC_PREFIX}_{stage}_seconds"
+        if name not in described:
+            lines.append(f"# TYPE {name} histogram")
+            described.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + (float("inf"),), buckets):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for (counter, labels), value in sorted(counters.items()):
+        name = f"{METRIC_PREFIX}_{counter}_total"
+        if name not in described:
+            lines.append(f"# TYPE {name} counter")
+            described.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for gauge, fn in sorted(_gauges.items()):
+        try:
+            value = fn()
+        except Exception as e:
+            logging.warning(f"[メトリクス] {gauge} を取得できません: {e}")
+            continue
+        name = f"{METRIC_PREFIX}_{gauge}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,722 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import hmac
+import base64
+import random
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+from openai import RateLimitError
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error
+
+from instrumentation import current_trace
+
+# ✅ オフライン負荷試験
+# LINE・Google Sheets・OpenAI をローカルの代役に差し替え、署名付きの Webhook を /callback に流す
+# 代役ごとにレイテンシとクォータエラー（429）の発生率を指定できる
+#
+# 使い方:
+#   python load_test.py --sessions 200 --concurrency 8 --mix free=60,premium=25,register=10,premium_setting=5
+#   python load_test.py --sessions 50 --concurrency 1 --sheets-client per-call   # クライアント共有前との往復回数の比較
+#
+# 1セッション = 1ユーザーのシナリオ（メッセージを順に送り、返信が届いてから次を送る）
+#   free            : 登録済みの無料ユーザーが「出勤」「退勤」「お礼」のどれかを送る
+#   premium         : 承認済みユーザーが生成コマンド → キーワードを送る
+#   register        : 未登録ユーザーが「情報を登録する」から3ステップで登録
+#   premium_setting : 登録済みユーザーが「プレミアム登録」から10ステップを回答
+#
+# レイテンシは Webhook 送信から最初の返信が届くまで（STREAM_GENERATION 時は「作成中」の返信まで）
+# WEBHOOK_ASYNC・STREAM_GENERATION・SHEETS_MODE などは本番と同じ環境変数で切り替える
+
+SCENARIOS = ("free", "premium", "register", "premium_setting")
+DEFAULT_MIX = "free=60,premium=25,register=10,premium_setting=5"
+
+# ✅ 返信が届くまで待つ上限（秒）
+REPLY_TIMEOUT = 60
+
+# ✅ アプリが例外時に返す文言（失敗として数える）
+ERROR_REPLY = "内部エラー"
+
+TONE_NUMBERS = [str(i) for i in range(1, 16)]
+
+SAMPLE_DIARIES = [
+    "おはようございます☀️\n今日も元気に出勤してます♪\n空き枠あるので会いに来てね💕",
+    "お疲れ様でした🌙\n今日も沢山の出会いに感謝です✨\nまた明日もよろしくね♪",
+    "今日来てくれたお兄様ありがとう💕\nいっぱいお話できて楽しかったよ🥰\nまた会いたいな♪",
+    "雨だけど出勤してるよ☔️\nまったり癒しの時間にしようね😊",
+    "本日もありがとうございました🌸\n次の出勤は金曜日です♪",
+]
+
+DIARY_PHRASES = [
+    "今日はぽかぽか陽気で気持ちいいね☀️", "新しいネイルにしてきたよ💅", "空き枠まだあるので会いに来てね💕",
+    "最近ハマってるカフェの話を聞いてほしいな☕️", "今日のお洋服お気に入りなの👗", "まったり癒しの時間にしようね😊",
+    "ぎゅーってしたい気分だよ🥺", "今日もたくさん笑わせてもらったよ🥰", "次の出勤は週末だよ♪",
+    "雨の日はおうちでゆっくりもいいけど会いに来てほしいな☔️", "いっぱいお話できて嬉しかったよ✨",
+]
+
+TEMPLATE_SECTIONS = {
+    "opening": ["おはようございます☀️", "こんにちは♪", "今日もよろしくね💕"],
+    "body": ["空き枠あるよ♪", "得意なマッサージで癒します✨", "今日はまったりモードだよ😊"],
+    "closing": ["会いに来てね💕", "待ってるね♪", "またね🌙"],
+}
+
+# ---------------------------
+# 代役の共通部分（呼び出し回数・レイテンシ・エラー注入）
+# ---------------------------
+class Backend:
+    def __init__(self, name, latency, error_rate):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.calls = {}    # 操作名 → 回数
+        self.by_trace = {} # トレースID（= Webhook イベントID）→ 回数。イベント外（バッファの反映など）は "-"
+        self.errors = 0
+
+    # 🔧 レイテンシは指定値の 0.5〜1.5 倍でばらつかせる
+    # 呼び出し元のイベントはアプリが付けるトレースIDで見分ける（プリフェッチ・先回り生成のスレッドにも引き継がれる）
+    def call(self, op, latency=None):
+        trace = current_trace()
+        with self.lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+            self.by_trace[trace] = self.by_trace.get(trace, 0) + 1
+        latency = self.latency if latency is None else latency
+        if latency:
+            time.sleep(latency * random.uniform(0.5, 1.5))
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return False
+        return True
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.calls), self.errors
+
+    def calls_for(self, trace):
+        with self.lock:
+            return self.by_trace.get(trace, 0)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.by_trace.clear()
+            self.errors = 0
+
+# ---------------------------
+# LINE Messaging API の代役
+# ---------------------------
+class FakeLineBotApi:
+    def __init__(self, backend):
+        self.backend = backend
+        self.condition = threading.Condition()
+        self.replies = {}   # reply_token → (届いた時刻, 本文リスト)
+        self.pushes = {}    # user_id → [(届いた時刻, 本文リスト)]
+
+    def _check(self, op):
+        if not self.backend.call(op):
+            raise LineBotApiError(429, {}, error=Error(message="You have reached your monthly limit. (load test)"))
+
+    @staticmethod
+    def _texts(messages):
+        messages = messages if isinstance(messages, (list, tuple)) else [messages]
+        return [getattr(m, "text", "") for m in messages]
+
+    def reply_message(self, reply_token, messages, **kwargs):
+        self._check("reply_message")
+        with self.condition:
+            if reply_token in self.replies:
+                raise LineBotApiError(400, {}, error=Error(message="Invalid reply token"))
+            self.replies[reply_token] = (time.perf_counter(), self._texts(messages))
+            self.condition.notify_all()
+
+    def push_message(self, to, messages, **kwargs):
+        self._check("push_message")
+        with self.condition:
+            self.pushes.setdefault(to, []).append((time.perf_counter(), self._texts(messages)))
+            self.condition.notify_all()
+
+    def multicast(self, to, messages, **kwargs):
+        self._check("multicast")
+        for user_id in to:
+            with self.condition:
+                self.pushes.setdefault(user_id, []).append((time.perf_counter(), self._texts(messages)))
+        with self.condition:
+            self.condition.notify_all()
+
+    # 🔧 start〜end の間に push で届いたエラー通知があるか（返信済みの reply_token では送れないため push になる）
+    def pushed_error_between(self, user_id, start, end):
+        with self.condition:
+            return any(
+                start <= at < end and any(ERROR_REPLY in t for t in texts)
+                for at, texts in self.pushes.get(user_id, [])
+            )
+
+    # 🔧 reply_token への返信（返信失敗時は同じユーザーへの push）が届くまで待つ → (届いた時刻, 本文リスト)
+    def wait_for(self, reply_token, user_id, sent_at, timeout=REPLY_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                if reply_token in self.replies:
+                    return self.replies[reply_token]
+                pushed = [p for p in self.pushes.get(user_id, []) if p[0] >= sent_at]
+                if pushed:
+                    return pushed[0]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+# ---------------------------
+# gspread（スプレッドシート・ワークシート）の代役
+# ---------------------------
+_A1_PATTERN = re.compile(r"^([A-Z]*)(\d*)$")
+
+def _parse_a1(ref):
+    letters, digits = _A1_PATTERN.match(ref).groups()
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - 64
+    return (int(digits) if digits else None), (col or None)
+
+class _QuotaResponse:
+    status_code = 429
+    text = '{"error": {"code": 429, "message": "Quota exceeded (load test)", "status": "RESOURCE_EXHAUSTED"}}'
+
+    def json(self):
+        return json.loads(self.text)
+
+class FakeWorksheet:
+    def __init__(self, backend, title, rows, spreadsheet=None):
+        self.backend = backend
+        self.title = title
+        self.rows = [list(map(str, row)) for row in rows]
+        self.lock = threading.Lock()
+        self.spreadsheet = spreadsheet
+
+    def _check(self, op):
+        if not self.backend.call(f"{self.title}.{op}"):
+            raise gspread.exceptions.APIError(_QuotaResponse())
+
+    # 書き込むとスプレッドシートの最終更新時刻が進む
+    def _touch(self):
+        if self.spreadsheet is not None:
+            self.spreadsheet.touch()
+
+    def _ensure(self, row, col):
+        while len(self.rows) < row:
+            self.rows.append([])
+        while len(self.rows[row - 1]) < col:
+            self.rows[row - 1].append("")
+
+    def _write(self, ref, values):
+        row, col = _parse_a1(ref.split(":")[0])
+        for i, value_row in enumerate(values):
+            for j, value in enumerate(value_row):
+                self._ensure(row + i, col + j)
+                self.rows[row + i - 1][col + j - 1] = str(value)
+
+    def get_all_values(self, **kwargs):
+        self._check("get_all_values")
+        with self.lock:
+            return [list(row) for row in self.rows]
+
+    def get_all_records(self, **kwargs):
+        self._check("get_all_records")
+        with self.lock:
+            header = self.rows[0] if self.rows else []
+            return [
+                dict(zip(header, gspread.utils.numericise_all(row + [""] * (len(header) - len(row)))))
+                for row in self.rows[1:]
+            ]
+
+    def row_values(self, row, **kwargs):
+        self._check("row_values")
+        with self.lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def batch_get(self, ranges, **kwargs):
+        self._check("batch_get")
+        results = []
+        with self.lock:
+            for ref in ranges:
+                start, _, end = ref.partition(":")
+                row1, col1 = _parse_a1(start)
+                row2, col2 = _parse_a1(end or start)
+                rows = self.rows[(row1 or 1) - 1:row2 or len(self.rows)]
+                results.append([
+                    row[(col1 or 1) - 1:col2 or len(row)] for row in rows
+                ])
+        return results
+
+    def update(self, range_name, values=None, **kwargs):
+        self._check("update")
+        with self.lock:
+            self._write(range_name, values)
+        self._touch()
+
+    def batch_update(self, data, **kwargs):
+        self._check("batch_update")
+        with self.lock:
+            for entry in data:
+                self._write(entry["range"], entry["values"])
+        self._touch()
+
+    def delete_rows(self, start, end=None, **kwargs):
+        self._check("delete_rows")
+        with self.lock:
+            del self.rows[start - 1:end or start]
+        self._touch()
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], op="append_row")
+
+    def append_rows(self, rows, op="append_rows", **kwargs):
+        self._check(op)
+        with self.lock:
+            start = len(self.rows) + 1
+            self.rows.extend([str(v) for v in row] for row in rows)
+            end = len(self.rows)
+        self._touch()
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:Z{end}"}}
+
+class FakeSpreadsheet:
+    def __init__(self, backend, title, tabs):
+        self.backend = backend
+        self.title = title
+        self.tabs = {name: FakeWorksheet(backend, name, rows, self) for name, rows in tabs.items()}
+        self.revision = 0
+        self.lock = threading.Lock()
+
+    def touch(self):
+        with self.lock:
+            self.revision += 1
+
+    # Drive の modifiedTime の代わり（書き込みのたびに進む）
+    def get_lastUpdateTime(self):
+        self.backend.call(f"{self.title}.get_lastUpdateTime")
+        with self.lock:
+            return f"2024-01-01T00:00:00.{self.revision:06d}Z"
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self.backend.call(f"{self.title}.add_worksheet")
+        self.tabs[title] = FakeWorksheet(self.backend, title, [], self)
+        self.touch()
+        return self.tabs[title]
+
+    def worksheets(self):
+        self.backend.call(f"{self.title}.worksheets")
+        return list(self.tabs.values())
+
+    def worksheet(self, name):
+        self.backend.call(f"{self.title}.worksheet")
+        if name not in self.tabs:
+            raise gspread.exceptions.WorksheetNotFound(name)
+        return self.tabs[name]
+
+class FakeGspreadClient:
+    def __init__(self, backend, books):
+        self.backend = backend
+        self.books = {title: FakeSpreadsheet(backend, title, tabs) for title, tabs in books.items()}
+
+    def open(self, title):
+        self.backend.call(f"{title}.open")
+        if title not in self.books:
+            raise gspread.exceptions.SpreadsheetNotFound(title)
+        return self.books[title]
+
+class _FakeCredentials:
+    @classmethod
+    def from_service_account_file(cls, filename, scopes=None):
+        return cls()
+
+# ✅ google_sheets の認証を代役に差し替える（認証も Sheets の呼び出し client.authorize として数える）
+def install_fake_sheets(backend, books):
+    import google_sheets
+
+    fake_client = FakeGspreadClient(backend, books)
+
+    def authorize(creds):
+        backend.call("client.authorize")
+        return fake_client
+
+    google_sheets.Credentials = _FakeCredentials
+    gspread.authorize = authorize
+    google_sheets.reset_sheet_clients()
+    return fake_client
+
+class _ForgetfulDict(dict):
+    # 入れた値は1回取り出すと消える（キャッシュしない）
+    def __getitem__(self, key):
+        return self.pop(key)
+
+# 🔧 変更前の connect_sheet（呼ぶたびに認証・open・worksheet）を再現する。比較用
+def use_per_call_sheets_client():
+    import google_sheets
+
+    def get_client():
+        creds = google_sheets.Credentials.from_service_account_file(google_sheets.CREDENTIALS_FILE, scopes=google_sheets.SCOPES)
+        return gspread.authorize(creds)
+
+    google_sheets.get_client = get_client
+    google_sheets._spreadsheets = _ForgetfulDict()
+    google_sheets._worksheets = _ForgetfulDict()
+
+# ---------------------------
+# OpenAI クライアントの代役（chat.completions.create のみ）
+# ---------------------------
+class FakeOpenAI:
+    def __init__(self, backend):
+        self.backend = backend
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _raise_rate_limit(self):
+        response = SimpleNamespace(status_code=429, headers={}, request=None)
+        raise RateLimitError("Rate limit reached (load test)", response=response, body=None)
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages or [])
+        text = "\n".join(random.sample(DIARY_PHRASES, 4))
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(text), total_tokens=prompt_tokens + len(text))
+        if not stream:
+            if not self.backend.call("chat.completions"):
+                self._raise_rate_limit()
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+                usage=usage
+            )
+
+        # ストリーム時は最初のチャンクまでにレイテンシの 1/3、残りを行ごとに分けて流す
+        latency = self.backend.latency
+        if not self.backend.call("chat.completions.stream", latency / 3):
+            self._raise_rate_limit()
+
+        lines = text.split("\n")
+
+        def chunks():
+            for i, line in enumerate(lines):
+                if i:
+                    time.sleep(latency * 2 / 3 / max(len(lines) - 1, 1))
+                content = line + ("\n" if i < len(lines) - 1 else "")
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+            yield SimpleNamespace(choices=[], usage=usage)
+        return chunks()
+
+# ---------------------------
+# 初期データ（シナリオごとのユーザーを用意）
+# ---------------------------
+def _user_id():
+    return "U" + uuid.uuid4().hex
+
+def _template_rows():
+    rows = [["section", "text", "used_count"]]
+    for section, texts in TEMPLATE_SECTIONS.items():
+        rows.extend([section, text, 0] for text in texts)
+    return rows
+
+def build_books(sessions):
+    from local_store import DEFAULT_USER_INFO_HEADER, PREMIUM_USER_INFO_COLUMNS
+    user_info = [DEFAULT_USER_INFO_HEADER]
+    samples = [["user_id", "diary_type", "timestamp", "diary_text", "used_count"]]
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    for scenario, user_id in sessions:
+        if scenario == "register":
+            continue
+        status = "承認済" if scenario == "premium" else ""
+        record = {
+            "user_id": user_id, "源氏名": "みく", "年代": "20代前半", "口調": random.choice(["甘えんぼ系", "ギャル系", "清楚系"]),
+            "登録日時": now, "ステータス": status, "通知済み": "TRUE" if status else "", "is_test_user": "",
+        }
+        user_info.append([record.get(name, "") for name in DEFAULT_USER_INFO_HEADER])
+        if scenario == "premium":
+            for i, text in enumerate(SAMPLE_DIARIES):
+                samples.append([user_id, ["shukkin", "taikin", "orei", "shukkin", "taikin"][i], now, text, 0])
+
+    return {
+        "DiaryUserData": {
+            "UserInfoLog": user_info,
+            "UsageLog": [["user_id", "date", "count"]],
+            "FeedbackLog": [["user_id", "diary_type", "result", "timestamp", "diary_text"]],
+            "PremiumDiarySamples": samples,
+            "PremiumUserInfo": [["user_id"] + PREMIUM_USER_INFO_COLUMNS + ["updated_at"]],
+            "UserDiaries": [["user_id", "diary_type", "diary_text", "created_at"]],
+            "user_requests": [["user_id", "status", "timestamp", "nickname", "store"]],
+            "TestUserList": [["user_id"]],
+        },
+        "DiaryTemplates": {
+            "ShukkinTemplates": _template_rows(),
+            "TaikinTemplates": _template_rows(),
+            "OreiTemplates": _template_rows(),
+        },
+    }
+
+def premium_settings_answers():
+    return [
+        "💕、✨、🥰", "甘えん坊、清楚", "下品", "恥ずかしがり屋", "方言",
+        "金土メイン", "〜だよぉ", "なし", "\n\n".join(SAMPLE_DIARIES[:3]), "ラブリー学園",
+    ]
+
+def scenario_messages(scenario):
+    command = random.choice(["出勤", "退勤", "お礼"])
+    if scenario == "free":
+        return [command]
+    if scenario == "premium":
+        return [command, random.choice(["雨、カフェ", "新しいネイル", "週末、空き枠"])]
+    if scenario == "register":
+        return ["情報を登録する", "みく", "20代前半", random.choice(TONE_NUMBERS)]
+    if scenario == "premium_setting":
+        return ["プレミアム登録"] + premium_settings_answers()
+    raise ValueError(f"不明なシナリオ: {scenario}")
+
+# ---------------------------
+# Webhook の生成・送信
+# ---------------------------
+# → (本文, reply_token, イベントID)。アプリはイベントIDをトレースIDに使う
+def webhook_body(user_id, text):
+    reply_token = uuid.uuid4().hex
+    event_id = uuid.uuid4().hex.upper()[:26]
+    event = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": event_id,
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": reply_token,
+        "message": {"type": "text", "id": str(random.randint(10 ** 13, 10 ** 14)), "text": text},
+    }
+    return json.dumps({"destination": "Uloadtest", "events": [event]}, ensure_ascii=False), reply_token, event_id
+
+def sign(body):
+    secret = os.getenv("LINE_CHANNEL_SECRET").strip().encode("utf-8")
+    return base64.b64encode(hmac.new(secret, body.encode("utf-8"), hashlib.sha256).digest()).decode("utf-8")
+
+# ✅ app を読み込み、外部サービスを代役に差し替える
+# ローカルDBなどのパスはモジュール読み込み時に決まるため、アプリのモジュールはここで初めて import する
+def load_app(workdir, backends, sessions):
+    os.environ.setdefault("OPENAI_API_KEY", "sk-load-test")
+    os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "load-test-token")
+    os.environ.setdefault("LINE_CHANNEL_SECRET", "load-test-secret")
+    os.environ["APPROVAL_NOTIFIER"] = "false"
+    os.environ["LOG_ARCHIVE"] = "false"
+    os.environ["LOCAL_DB_PATH"] = os.path.join(workdir, "diary_bot.db")
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "sessions.db")
+
+    import app
+    import diary_generator
+
+    app.line_bot_api = FakeLineBotApi(backends["line"])
+    diary_generator.client = FakeOpenAI(backends["openai"])
+    install_fake_sheets(backends["sheets"], build_books(sessions))
+    return app
+
+def seed_premium_settings(sessions):
+    from premium_setting import save_premium_settings
+    keys = [
+        "emoji_list", "tone_tags", "ng_elements", "appeal_tags", "appeal_elements",
+        "weekly_schedule", "fav_words", "other_requests", "diary_samples", "store_name",
+    ]
+    for scenario, user_id in sessions:
+        if scenario == "premium":
+            save_premium_settings(user_id, dict(zip(keys, premium_settings_answers())))
+
+# 🔧 1セッション分のメッセージを順に送る（返信が届いてから次を送る）
+def run_session(app, client, scenario, user_id, backends, results, results_lock):
+    line_api = app.line_bot_api
+    for text in scenario_messages(scenario):
+        body, reply_token, event_id = webhook_body(user_id, text)
+        sent_at = time.perf_counter()
+        response = client.post("/callback", data=body.encode("utf-8"), headers={"X-Line-Signature": sign(body)}, content_type="application/json")
+        http_seconds = time.perf_counter() - sent_at
+        delivered = line_api.wait_for(reply_token, user_id, sent_at)
+        result = {
+            "scenario": scenario,
+            "user_id": user_id,
+            "event_id": event_id,
+            "sent_at": sent_at,
+            "http_seconds": http_seconds,
+            "reply_seconds": delivered[0] - sent_at if delivered else None,
+            "ok": response.status_code == 200 and bool(delivered) and not any(ERROR_REPLY in t for t in delivered[1]),
+        }
+        with results_lock:
+            results.append(result)
+        if not result["ok"]:
+            return
+
+# 🔧 返信の後に push で届いたエラー（ストリーミング生成中の失敗など）も、そのイベントの失敗にする
+def mark_pushed_errors(line_api, results):
+    by_user = {}
+    for result in results:
+        by_user.setdefault(result["user_id"], []).append(result)
+    for rows in by_user.values():
+        rows.sort(key=lambda r: r["sent_at"])
+        for result, following in zip(rows, rows[1:] + [None]):
+            end = following["sent_at"] if following else float("inf")
+            if line_api.pushed_error_between(result["user_id"], result["sent_at"], end):
+                result["ok"] = False
+
+# ---------------------------
+# 集計
+# ---------------------------
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def summarize(results, elapsed, backends):
+    # シナリオ別の呼び出し数は、そのイベントのトレースIDが付いた呼び出しだけを数える（並列でも他セッションの分は混ざらない）
+    for result in results:
+        result["calls"] = {name: backend.calls_for(result["event_id"]) for name, backend in backends.items()}
+
+    def stats(rows):
+        replies = [r["reply_seconds"] for r in rows if r["reply_seconds"] is not None]
+        summary = {
+            "events": len(rows),
+            "failed": sum(1 for r in rows if not r["ok"]),
+            "p50": percentile(replies, 50),
+            "p95": percentile(replies, 95),
+            "p99": percentile(replies, 99),
+            "http_p95": percentile([r["http_seconds"] for r in rows], 95),
+        }
+        for name in backends:
+            summary[f"{name}_calls_per_event"] = sum(r["calls"][name] for r in rows) / len(rows) if rows else 0.0
+        return summary
+
+    report = {
+        "elapsed_seconds": elapsed,
+        "events_per_second": len(results) / elapsed if elapsed else 0.0,
+        "total": stats(results),
+        "scenarios": {
+            scenario: stats([r for r in results if r["scenario"] == scenario])
+            for scenario in SCENARIOS if any(r["scenario"] == scenario for r in results)
+        },
+        "calls": {},
+    }
+    # 全体の呼び出し数は代役の合計（どのイベントにも属さないバックグラウンドの書き込みも含む）から出す
+    for name, backend in backends.items():
+        calls, errors = backend.snapshot()
+        report["calls"][name] = {
+            "total": sum(calls.values()),
+            "background": backend.calls_for("-"),
+            "injected_errors": errors,
+            "by_op": dict(sorted(calls.items())),
+        }
+        report["total"][f"{name}_calls_per_event"] = sum(calls.values()) / len(results) if results else 0.0
+    return report
+
+def print_report(report):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}ms"
+
+    print(f"所要時間 {report['elapsed_seconds']:.1f}秒 / {report['total']['events']}イベント / {report['events_per_second']:.1f}件/秒")
+    rows = [("全体", report["total"])] + list(report["scenarios"].items())
+    for name, s in rows:
+        print(
+            f"  {name:<16} 件数={s['events']:<5} 失敗={s['failed']:<4} "
+            f"p50={ms(s['p50'])} p95={ms(s['p95'])} p99={ms(s['p99'])} (HTTP p95={ms(s['http_p95'])}) "
+            f"Sheets={s['sheets_calls_per_event']:.2f}/件 OpenAI={s['openai_calls_per_event']:.2f}/件 LINE={s['line_calls_per_event']:.2f}/件"
+        )
+    for name, calls in report["calls"].items():
+        print(f"[{name}] 呼び出し {calls['total']}回（うちイベント外 {calls['background']}回、注入エラー {calls['injected_errors']}回）")
+        for op, count in calls["by_op"].items():
+            print(f"    {op}: {count}")
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise ValueError(f"不明なシナリオ: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def run(sessions=100, concurrency=8, mix=DEFAULT_MIX, line_latency=0.05, sheets_latency=0.2, openai_latency=1.5,
+        line_error_rate=0.0, sheets_error_rate=0.0, openai_error_rate=0.0, seed=None, verbose=False,
+        sheets_client="shared"):
+    random.seed(seed)
+    weights = parse_mix(mix)
+    plan = [(scenario, _user_id()) for scenario in random.choices(list(weights), weights=list(weights.values()), k=sessions)]
+    backends = {
+        "line": Backend("line", line_latency, line_error_rate),
+        "sheets": Backend("sheets", sheets_latency, sheets_error_rate),
+        "openai": Backend("openai", openai_latency, openai_error_rate),
+    }
+
+    workdir = tempfile.mkdtemp(prefix="diary_bot_load_test_")
+    app = load_app(workdir, backends, plan)
+    if sheets_client == "per-call":
+        use_per_call_sheets_client()
+    seed_premium_settings(plan)
+    if not verbose:
+        logging.disable(logging.CRITICAL)
+    for backend in backends.values():
+        backend.reset()
+
+    import google_sheets
+    import webhook_worker
+
+    results = []
+    results_lock = threading.Lock()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(run_session, app, app.app.test_client(), scenario, user_id, backends, results, results_lock)
+            for scenario, user_id in plan
+        ]
+        for future in futures:
+            future.result()
+    webhook_worker.drain(REPLY_TIMEOUT)
+    elapsed = time.perf_counter() - started
+
+    # バッファ済みの書き込みも呼び出し回数に含める
+    google_sheets.flush_pending_writes()
+    mark_pushed_errors(app.line_bot_api, results)
+    return summarize(results, elapsed, backends)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LINE・Sheets・OpenAI を代役にした負荷試験")
+    parser.add_argument("--sessions", type=int, default=100, help="セッション（ユーザー）数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に動かすセッション数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="シナリオの比率（例: free=60,premium=25,register=10,premium_setting=5）")
+    parser.add_argument("--line-latency", type=float, default=0.05, help="LINE API のレイテンシ（秒）")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="Sheets API のレイテンシ（秒）")
+    parser.add_argument("--openai-latency", type=float, default=1.5, help="OpenAI の生成レイテンシ（秒）")
+    parser.add_argument("--line-error-rate", type=float, default=0.0, help="LINE API の 429 発生率（0〜1）")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0, help="Sheets API の 429 発生率（0〜1）")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="OpenAI の 429 発生率（0〜1）")
+    parser.add_argument("--sheets-client", choices=["shared", "per-call"], default="shared",
+                        help="per-call は変更前と同じく connect_sheet のたびに認証・open する（往復回数の比較用）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    parser.add_argument("--verbose", action="store_true", help="アプリのログも出す")
+    args = parser.parse_args()
+
+    report = run(
+        sessions=args.sessions, concurrency=args.concurrency, mix=args.mix,
+        line_latency=args.line_latency, sheets_latency=args.sheets_latency, openai_latency=args.openai_latency,
+        line_error_rate=args.line_error_rate, sheets_error_rate=args.sheets_error_rate,
+        openai_error_rate=args.openai_error_rate, seed=args.seed, verbose=args.verbose,
+        sheets_client=args.sheets_client,
+    )
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_report(report)
@@ -0,0 +1,445 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# ✅ Google Sheets の代わりに使うローカルDB（SQLite）
+# SHEETS_MODE=replica / off の時に google_sheets.py から使われる
+
+DB_PATH = os.getenv("LOCAL_DB_PATH", "diary_bot.db")
+
+# ✅ UserInfoLog の列（シートから取り込めなかった時の既定値）
+DEFAULT_USER_INFO_HEADER = [
+    "user_id", "源氏名", "年代", "口調", "登録日時", "メモ",
+    "ステータス", "申請日時", "店舗名", "通知済み", "is_test_user"
+]
+
+PREMIUM_USER_INFO_COLUMNS = [
+    "emoji_list", "tone_tags", "ng_elements", "appeal_tags", "appeal_elements",
+    "weekly_schedule", "fav_words", "other_requests", "store_name"
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS user_info (
+    user_id TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    status TEXT DEFAULT '',
+    notified INTEGER DEFAULT 0,
+    is_test_user INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_user_info_status ON user_info (status, notified);
+CREATE TABLE IF NOT EXISTS usage_log (
+    user_id TEXT,
+    date TEXT,
+    count INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, date)
+);
+CREATE TABLE IF NOT EXISTS feedback_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    diary_type TEXT,
+    result TEXT,
+    timestamp TEXT,
+    diary_text TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_feedback_user ON feedback_log (user_id, result, diary_type, timestamp);
+CREATE TABLE IF NOT EXISTS premium_diary_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    diary_type TEXT,
+    timestamp TEXT,
+    diary_text TEXT,
+    used_count INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_samples_user ON premium_diary_samples (user_id, diary_type);
+CREATE TABLE IF NOT EXISTS premium_user_info (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    emoji_list TEXT, tone_tags TEXT, ng_elements TEXT, appeal_tags TEXT, appeal_elements TEXT,
+    weekly_schedule TEXT, fav_words TEXT, other_requests TEXT, store_name TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_premium_user ON premium_user_info (user_id);
+CREATE TABLE IF NOT EXISTS premium_settings (
+    user_id TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS templates (
+    tab TEXT,
+    section TEXT,
+    text TEXT,
+    used_count INTEGER DEFAULT 0,
+    PRIMARY KEY (tab, section, text)
+);
+"""
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+# 🔧 スレッドごとに接続を持つ（WALで読み書きを並行させる）
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+def _write(sql, params=()):
+    conn = get_connection()
+    with _write_lock, conn:
+        return conn.execute(sql, params)
+
+def _write_many(sql, rows):
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.executemany(sql, rows)
+
+# ---------------------------
+# メタ情報
+# ---------------------------
+def get_meta(key, default=None):
+    row = get_connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row["value"]) if row else default
+
+def set_meta(key, value):
+    _write("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False)))
+
+# 🔧 値が変わる時だけ書き込み、書き込んだら True（複数プロセスで1回だけ行う処理の取り合いに使う）
+def claim_meta(key, value):
+    cursor = _write(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value WHERE meta.value != excluded.value",
+        (key, json.dumps(value, ensure_ascii=False))
+    )
+    return cursor.rowcount == 1
+
+# ---------------------------
+# UserInfoLog
+# ---------------------------
+def get_user_info_header():
+    return get_meta("user_info_header", DEFAULT_USER_INFO_HEADER)
+
+def _is_true(value):
+    return str(value).strip().upper() == "TRUE"
+
+USER_INFO_UPSERT = "INSERT OR REPLACE INTO user_info (user_id, record, status, notified, is_test_user) VALUES (?, ?, ?, ?, ?)"
+
+def _user_info_params(record):
+    return (
+        str(record["user_id"]).strip(),
+        json.dumps(record, ensure_ascii=False),
+        record.get("ステータス", ""),
+        int(_is_true(record.get("通知済み", ""))),
+        int(_is_true(record.get("is_test_user", "")))
+    )
+
+def save_user_record(record):
+    _write(USER_INFO_UPSERT, _user_info_params(record))
+
+def get_user_record(user_id):
+    row = get_connection().execute("SELECT record FROM user_info WHERE user_id = ?", (str(user_id).strip(),)).fetchone()
+    return json.loads(row["record"]) if row else None
+
+# 🔧 列番号 → 値 で更新（シートの update_cell と同じ指定方法）
+# create=False なら未登録ユーザーは何もしない
+def update_user_cells(user_id, cells, create=False):
+    header = get_user_info_header()
+    record = get_user_record(user_id)
+    if record is None:
+        if not create:
+            return
+        record = {name: "" for name in header}
+        record["user_id"] = user_id
+    for col, value in cells.items():
+        if col <= len(header):
+            record[header[col - 1]] = value
+    save_user_record(record)
+
+# 🔧 複数ユーザーの同じ列をまとめて更新（1トランザクション）
+def update_many_user_cells(user_ids, cells):
+    header = get_user_info_header()
+    params = []
+    for user_id in user_ids:
+        record = get_user_record(user_id)
+        if record is None:
+            continue
+        for col, value in cells.items():
+            if col <= len(header):
+                record[header[col - 1]] = value
+        params.append(_user_info_params(record))
+    _write_many(USER_INFO_UPSERT, params)
+
+def get_approved_user_ids():
+    rows = get_connection().execute("SELECT user_id FROM user_info WHERE status = '承認済'").fetchall()
+    return [row["user_id"] for row in rows]
+
+def get_user_statuses():
+    rows = get_connection().execute("SELECT user_id, status FROM user_info").fetchall()
+    return {row["user_id"]: row["status"] for row in rows}
+
+# 🔧 {user_id: (ステータス, 通知済み)}
+def get_user_status_snapshot():
+    rows = get_connection().execute("SELECT user_id, status, notified FROM user_info").fetchall()
+    return {row["user_id"]: (row["status"], bool(row["notified"])) for row in rows}
+
+def get_unnotified_approved_users():
+    rows = get_connection().execute(
+        "SELECT record FROM user_info WHERE status = '承認済' AND notified = 0"
+    ).fetchall()
+    return [json.loads(row["record"]) for row in rows]
+
+# ---------------------------
+# UsageLog
+# ---------------------------
+def increment_usage(user_id, date, amount=1):
+    _write(
+        "INSERT INTO usage_log (user_id, date, count) VALUES (?, ?, ?) "
+        "ON CONFLICT (user_id, date) DO UPDATE SET count = count + excluded.count",
+        (user_id, date, amount)
+    )
+
+# 🔧 回数が limit 未満の時だけ1回分加算（判定と加算を1つの UPDATE で行うので同時に来ても上限を超えない）
+# limit=None は上限なし → (加算できたか, 加算後の回数)
+def try_increment_usage(user_id, date, limit=None):
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute(
+            "INSERT INTO usage_log (user_id, date, count) VALUES (?, ?, 0) ON CONFLICT (user_id, date) DO NOTHING",
+            (user_id, date)
+        )
+        if limit is None:
+            cursor = conn.execute("UPDATE usage_log SET count = count + 1 WHERE user_id = ? AND date = ?", (user_id, date))
+        else:
+            cursor = conn.execute(
+                "UPDATE usage_log SET count = count + 1 WHERE user_id = ? AND date = ? AND count < ?",
+                (user_id, date, limit)
+            )
+        count = conn.execute("SELECT count FROM usage_log WHERE user_id = ? AND date = ?", (user_id, date)).fetchone()["count"]
+    return cursor.rowcount == 1, count
+
+# 🔧 シートの回数を取り込む（ローカルの方が多ければそのまま）
+def merge_usage(date, counts):
+    _write_many(
+        "INSERT INTO usage_log (user_id, date, count) VALUES (?, ?, ?) "
+        "ON CONFLICT (user_id, date) DO UPDATE SET count = MAX(count, excluded.count)",
+        [(user_id, date, count) for user_id, count in counts.items()]
+    )
+
+def get_usage_count(user_id, date):
+    row = get_connection().execute(
+        "SELECT count FROM usage_log WHERE user_id = ? AND date = ?", (user_id, date)
+    ).fetchone()
+    return row["count"] if row else 0
+
+# ---------------------------
+# FeedbackLog
+# ---------------------------
+FEEDBACK_INSERT = "INSERT INTO feedback_log (user_id, diary_type, result, timestamp, diary_text) VALUES (?, ?, ?, ?, ?)"
+
+def insert_feedback(user_id, diary_type, result, timestamp, diary_text):
+    _write(FEEDBACK_INSERT, (user_id, diary_type, result, timestamp, diary_text))
+
+def get_positive_feedback(user_id, diary_type=None, limit=5):
+    sql = "SELECT diary_text FROM feedback_log WHERE user_id = ? AND result = 'good'"
+    params = [user_id]
+    if diary_type is not None:
+        sql += " AND diary_type = ?"
+        params.append(diary_type)
+    sql += " ORDER BY timestamp DESC, id ASC LIMIT ?"
+    params.append(limit)
+    return [row["diary_text"] for row in get_connection().execute(sql, params)]
+
+# 🔧 👍の件数（本文は読まない）
+def count_positive_feedback(user_id, diary_type=None):
+    sql = "SELECT COUNT(*) AS n FROM feedback_log WHERE user_id = ? AND result = 'good'"
+    params = [user_id]
+    if diary_type is not None:
+        sql += " AND diary_type = ?"
+        params.append(diary_type)
+    return get_connection().execute(sql, params).fetchone()["n"]
+
+# ---------------------------
+# PremiumDiarySamples
+# ---------------------------
+SAMPLE_INSERT = "INSERT INTO premium_diary_samples (user_id, diary_type, timestamp, diary_text, used_count) VALUES (?, ?, ?, ?, ?)"
+
+def insert_diary_sample(user_id, diary_type, timestamp, diary_text, used_count=0):
+    _write(SAMPLE_INSERT, (user_id, diary_type, timestamp, diary_text, used_count))
+
+def insert_diary_samples(rows):
+    # rows: [(user_id, diary_type, timestamp, diary_text, used_count)]
+    _write_many(SAMPLE_INSERT, rows)
+
+def get_diary_samples(user_id, diary_type, limit=10, newest=False):
+    # newest=True なら末尾（新しい方）から limit 件
+    order = "DESC" if newest else "ASC"
+    rows = get_connection().execute(
+        f"SELECT diary_text FROM premium_diary_samples WHERE user_id = ? AND diary_type = ? "
+        f"AND diary_text != '' ORDER BY id {order} LIMIT ?",
+        (user_id, diary_type, limit)
+    ).fetchall()
+    texts = [row["diary_text"] for row in rows]
+    return texts[::-1] if newest else texts
+
+# 🔧 参考日記の検索インデックス用：自作日記と👍の日記をまとめて (source, diary_type, text)
+def get_user_reference_texts(user_id):
+    conn = get_connection()
+    samples = conn.execute(
+        "SELECT diary_type, diary_text FROM premium_diary_samples WHERE user_id = ? AND diary_text != '' ORDER BY id",
+        (user_id,)
+    ).fetchall()
+    feedbacks = conn.execute(
+        "SELECT diary_type, diary_text FROM feedback_log WHERE user_id = ? AND result = 'good' AND diary_text != '' ORDER BY id",
+        (user_id,)
+    ).fetchall()
+    return (
+        [("sample", row["diary_type"], row["diary_text"].strip()) for row in samples]
+        + [("feedback", row["diary_type"], row["diary_text"].strip()) for row in feedbacks]
+    )
+
+DIARY_USAGE_UPDATE = (
+    "UPDATE premium_diary_samples SET used_count = used_count + ? WHERE id = ("
+    "SELECT id FROM premium_diary_samples WHERE user_id = ? AND TRIM(diary_text) = ? ORDER BY id LIMIT 1)"
+)
+
+def increment_diary_usage(user_id, diary_text, amount=1):
+    _write(DIARY_USAGE_UPDATE, (amount, user_id, diary_text.strip()))
+
+# 🔧 複数の日記の使用回数を1トランザクションで加算（counts: {本文: 加算数}）
+def increment_diary_usage_many(user_id, counts):
+    _write_many(DIARY_USAGE_UPDATE, [(amount, user_id, text) for text, amount in counts.items()])
+
+# ---------------------------
+# PremiumUserInfo
+# ---------------------------
+PREMIUM_USER_INFO_INSERT = (
+    f"INSERT INTO premium_user_info (user_id, {', '.join(PREMIUM_USER_INFO_COLUMNS)}, updated_at) "
+    f"VALUES (?, {', '.join('?' for _ in PREMIUM_USER_INFO_COLUMNS)}, ?)"
+)
+
+def _premium_user_info_params(user_id, premium_data, updated_at):
+    return [user_id] + [premium_data.get(c, "") for c in PREMIUM_USER_INFO_COLUMNS] + [updated_at]
+
+def insert_premium_user_info(user_id, premium_data, updated_at):
+    _write(PREMIUM_USER_INFO_INSERT, _premium_user_info_params(user_id, premium_data, updated_at))
+
+def get_premium_user_info(user_id):
+    row = get_connection().execute(
+        "SELECT * FROM premium_user_info WHERE user_id = ? ORDER BY id LIMIT 1", (str(user_id).strip(),)
+    ).fetchone()
+    return dict(row) if row else None
+
+# ---------------------------
+# プレミアム設定（premium_settings.json の置き換え）
+# ---------------------------
+# 保存のたびに全体のバージョンを上げ、他プロセスのキャッシュ無効化に使う
+def save_premium_settings(user_id, settings):
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO premium_settings (user_id, settings, updated_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(settings, ensure_ascii=False), time.time())
+        )
+        _bump_premium_settings_version(conn)
+
+def get_premium_settings(user_id):
+    row = get_connection().execute("SELECT settings FROM premium_settings WHERE user_id = ?", (user_id,)).fetchone()
+    return json.loads(row["settings"]) if row else None
+
+def get_premium_settings_version():
+    return get_meta("premium_settings_version", 0)
+
+def import_premium_settings(data):
+    conn = get_connection()
+    now = time.time()
+    with _write_lock, conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO premium_settings (user_id, settings, updated_at) VALUES (?, ?, ?)",
+            [(user_id, json.dumps(settings, ensure_ascii=False), now) for user_id, settings in data.items()]
+        )
+        _bump_premium_settings_version(conn)
+
+def _bump_premium_settings_version(conn):
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('premium_settings_version', '1') "
+        "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+
+# ---------------------------
+# テンプレート
+# ---------------------------
+def replace_templates(tab, records):
+    conn = get_connection()
+    with _write_lock, conn:
+        conn.execute("DELETE FROM templates WHERE tab = ?", (tab,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO templates (tab, section, text, used_count) VALUES (?, ?, ?, ?)",
+            [
+                (tab, str(row.get("section", "")).strip(), str(row.get("text", "")).strip(),
+                 int(row["used_count"]) if str(row.get("used_count", "")).isdigit() else 0)
+                for row in records
+            ]
+        )
+
+def has_templates(tab):
+    return get_connection().execute("SELECT 1 FROM templates WHERE tab = ? LIMIT 1", (tab,)).fetchone() is not None
+
+def get_templates(tab):
+    templates = {}
+    rows = get_connection().execute(
+        "SELECT section, text FROM templates WHERE tab = ? AND section != '' AND text != '' ORDER BY rowid", (tab,)
+    )
+    for row in rows:
+        templates.setdefault(row["section"], []).append(row["text"])
+    return templates
+
+def increment_template_usage(tab, section, text, amount=1):
+    _write(
+        "UPDATE templates SET used_count = used_count + ? WHERE tab = ? AND section = ? AND text = ?",
+        (amount, tab, section, text.strip())
+    )
+
+# ---------------------------
+# シートからの初回取り込み（タブごとに1トランザクション）
+# ---------------------------
+def _to_int(value):
+    return int(value) if str(value).isdigit() else 0
+
+def import_user_info(header, records):
+    set_meta("user_info_header", header)
+    _write_many(USER_INFO_UPSERT, [
+        _user_info_params(record) for record in records if str(record.get("user_id", "")).strip()
+    ])
+
+def import_usage(records):
+    _write_many(
+        "INSERT OR REPLACE INTO usage_log (user_id, date, count) VALUES (?, ?, ?)",
+        [(row["user_id"], row["date"], _to_int(row["count"])) for row in records]
+    )
+
+def import_feedback(records):
+    _write_many(FEEDBACK_INSERT, [
+        (row["user_id"], row["diary_type"], row["result"], row["timestamp"], row["diary_text"]) for row in records
+    ])
+
+def import_diary_samples(records):
+    _write_many(SAMPLE_INSERT, [
+        (row["user_id"], row["diary_type"], row.get("timestamp", ""), str(row.get("diary_text", "")).strip(),
+         _to_int(row.get("used_count", 0)))
+        for row in records
+    ])
+
+def import_premium_user_info(records):
+    _write_many(PREMIUM_USER_INFO_INSERT, [
+        _premium_user_info_params(row["user_id"], row, row.get("updated_at", "")) for row in records
+    ])
@@ -0,0 +1,99 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import local_store
+import feedback_store
+from google_sheets import SHEETS_MODE, archive_log_rows, LOG_ARCHIVE_TARGET
+
+# ✅ 追記だけのログタブの定期整理
+# 日付が保持日数より前の行を月別アーカイブ（タブまたは CSV。google_sheets の LOG_ARCHIVE_TARGET）へ移し、
+# ホットなタブには直近の行だけを残す。アーカイブは読み出し関数で include_archive=True の時だけ読む
+# 同じローカルDBを使うプロセスのうち、その日の実行権を取れた1つだけが動く
+# あわせて feedback_store の gc で、どのユーザーからも参照されなくなった日記本文を消す（SHEETS_MODE=off でも動く）
+
+LOG_ARCHIVE_ENABLED = os.getenv("LOG_ARCHIVE", "true").lower() == "true"
+# ✅ 実行権を確認する間隔（秒）。実際の整理は1日1回
+LOG_ARCHIVE_CHECK_INTERVAL = int(os.getenv("LOG_ARCHIVE_CHECK_INTERVAL", "3600"))
+
+# ✅ タブごとの日付列（見出しにある最初の列を使う）と残す日数（今日を含む。0 は移さない）
+ARCHIVE_TABS = {
+    "UsageLog": (["date"], int(os.getenv("USAGE_LOG_KEEP_DAYS", "2"))),
+    "FeedbackLog": (["timestamp"], int(os.getenv("FEEDBACK_LOG_KEEP_DAYS", "90"))),
+    "UserDiaryLog": (["timestamp", "created_at", "date"], int(os.getenv("USER_DIARY_LOG_KEEP_DAYS", "90"))),
+    "UserDiaries": (["created_at", "timestamp"], int(os.getenv("USER_DIARIES_KEEP_DAYS", "90"))),
+    # 自作日記は参考日記として使い続けるため、既定では移さない
+    "PremiumDiarySamples": (["timestamp"], int(os.getenv("PREMIUM_DIARY_SAMPLES_KEEP_DAYS", "0"))),
+}
+
+_lock = threading.Lock()
+_thread = None
+
+metrics = {
+    "runs": 0,
+    "last_run": None,
+    "last_seconds": 0.0,
+    "archived_rows": {},
+    "feedback_gc_removed": 0,
+    "failed": 0,
+}
+
+def start():
+    global _thread
+    if not LOG_ARCHIVE_ENABLED:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, name="log-archive", daemon=True)
+        _thread.start()
+
+def _run():
+    while True:
+        today = datetime.now().strftime("%Y-%m-%d")
+        if local_store.claim_meta("log_archive_date", today):
+            run_once(today)
+        time.sleep(LOG_ARCHIVE_CHECK_INTERVAL)
+
+def cutoff_for(today, keep_days):
+    return (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=keep_days - 1)).strftime("%Y-%m-%d")
+
+# ✅ 全タブを1回整理する → {タブ名: 移した行数}
+def run_once(today=None):
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    started = time.perf_counter()
+    results = {}
+    for tab_name, (date_columns, keep_days) in ARCHIVE_TABS.items():
+        if keep_days <= 0 or SHEETS_MODE == "off":
+            continue
+        try:
+            results[tab_name] = archive_log_rows(tab_name, date_columns, cutoff_for(today, keep_days))
+        except Exception as e:
+            logging.warning(f"[アーカイブ] {tab_name} の整理に失敗しました: {e}")
+            with _lock:
+                metrics["failed"] += 1
+
+    # 🔧 remove_user（プレミアム移行時の👍の削除など）で参照が外れた本文を物理的に消す
+    removed = 0
+    try:
+        removed = feedback_store.gc()
+    except Exception as e:
+        logging.warning(f"[アーカイブ] フィードバック本文の整理に失敗しました: {e}")
+        with _lock:
+            metrics["failed"] += 1
+
+    with _lock:
+        metrics["runs"] += 1
+        metrics["last_run"] = today
+        metrics["last_seconds"] = time.perf_counter() - started
+        metrics["feedback_gc_removed"] += removed
+        for tab_name, moved in results.items():
+            metrics["archived_rows"][tab_name] = metrics["archived_rows"].get(tab_name, 0) + moved
+    logging.info(f"[アーカイブ] 整理完了（{LOG_ARCHIVE_TARGET}）: {results}, フィードバック本文 {removed}件削除")
+    return results
+
+def get_metrics():
+    with _lock:
+        return dict(metrics, archived_rows=dict(metrics["archived_rows"]))
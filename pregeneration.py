@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from diary_generator import generate_diary, last_completion_tokens
+
+# ✅ 無料ユーザー向けの先回り生成プール
+# 返信後に同じユーザー・同じ日記タイプの次の1通をバックグラウンドで作っておき、
+# 次のリクエストではOpenAIを待たずに返す（PREGENERATION=true で有効）
+# テンプレート・自作日記の使用回数は作り置きと一緒に返し、送ると決まった時に呼び出し側で数える
+
+PREGENERATION_ENABLED = os.getenv("PREGENERATION", "false").lower() == "true"
+
+# ✅ 作り置きの有効期限（秒）
+PREGEN_TTL = int(os.getenv("PREGEN_TTL", str(3 * 60 * 60)))
+# ✅ 1ユーザーあたりの作り置き数（日記タイプごとに1通）
+PREGEN_PER_USER = int(os.getenv("PREGEN_PER_USER", "3"))
+# ✅ 作り置きを持つユーザー数の上限（超えたら古いユーザーから破棄）
+PREGEN_MAX_USERS = int(os.getenv("PREGEN_MAX_USERS", "500"))
+# ✅ 先回り生成に使ってよい1日あたりのトークン数
+PREGEN_DAILY_TOKEN_BUDGET = int(os.getenv("PREGEN_DAILY_TOKEN_BUDGET", "200000"))
+
+PREGEN_DIARY_TYPES = ("shukkin", "taikin", "orei")
+
+_lock = threading.Lock()
+_pool = OrderedDict()      # user_id → OrderedDict(diary_type → (本文, 作成時刻, 使用回数))
+_in_flight = set()
+_budget = {"date": "", "tokens": 0}
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PREGEN_WORKERS", "2")), thread_name_prefix="pregen")
+
+metrics = {
+    "hits": 0,
+    "misses": 0,
+    "generated": 0,
+    "expired": 0,
+    "evicted": 0,
+    "budget_skipped": 0,
+    "failed": 0,
+    "tokens_used": 0,
+}
+
+# 🔧 作り置きがあれば (本文, 使用回数) を取り出す（取り出したものはプールから消える）
+def take(user_id, diary_type):
+    if not PREGENERATION_ENABLED:
+        return None
+    with _lock:
+        entries = _pool.get(user_id)
+        item = entries.pop(diary_type, None) if entries else None
+        if entries is not None and not entries:
+            del _pool[user_id]
+        if item and time.monotonic() - item[1] > PREGEN_TTL:
+            metrics["expired"] += 1
+            item = None
+        metrics["hits" if item else "misses"] += 1
+    return (item[0], item[2]) if item else None
+
+# 🔧 次の1通を予約生成（無料枠が残っている場合のみ呼ぶ）
+def schedule(user_info, diary_type):
+    if not PREGENERATION_ENABLED or diary_type not in PREGEN_DIARY_TYPES:
+        return
+    key = (user_info["user_id"], diary_type)
+    with _lock:
+        if key in _in_flight or diary_type in _pool.get(key[0], {}):
+            return
+        if _remaining_budget() <= 0:
+            metrics["budget_skipped"] += 1
+            return
+        _in_flight.add(key)
+    # 生成のログにも予約したイベントのトレースIDが付くよう、コンテキストごと渡す
+    _executor.submit(contextvars.copy_context().run, _generate, dict(user_info), diary_type)
+
+# 🔧 ユーザー情報の変更時などに作り置きを破棄
+def discard(user_id):
+    with _lock:
+        _pool.pop(user_id, None)
+
+def get_metrics():
+    with _lock:
+        snapshot = dict(metrics)
+        snapshot["pooled"] = sum(len(entries) for entries in _pool.values())
+        snapshot["budget_remaining"] = _remaining_budget()
+    return snapshot
+
+def _remaining_budget():
+    today = datetime.now().strftime("%Y-%m-%d")
+    if _budget["date"] != today:
+        _budget["date"] = today
+        _budget["tokens"] = 0
+    return PREGEN_DAILY_TOKEN_BUDGET - _budget["tokens"]
+
+def _generate(user_info, diary_type):
+    user_id = user_info["user_id"]
+    try:
+        text, usage = generate_diary(user_info, diary_type)
+        tokens = last_completion_tokens()
+    except Exception as e:
+        logging.warning(f"[先回り生成] 失敗 user_id={user_id}, type={diary_type}: {e}")
+        with _lock:
+            metrics["failed"] += 1
+            _in_flight.discard((user_id, diary_type))
+        return
+
+    with _lock:
+        _in_flight.discard((user_id, diary_type))
+        _remaining_budget()
+        _budget["tokens"] += tokens
+        metrics["tokens_used"] += tokens
+        metrics["generated"] += 1
+
+        entries = _pool.setdefault(user_id, OrderedDict())
+        entries[diary_type] = (text, time.monotonic(), usage)
+        _pool.move_to_end(user_id)
+        while len(entries) > PREGEN_PER_USER:
+            entries.popitem(last=False)
+            metrics["evicted"] += 1
+        while len(_pool) > PREGEN_MAX_USERS:
+            _, dropped = _pool.popitem(last=False)
+            metrics["evicted"] += len(dropped)
@@ -1,22 +1,31 @@
 import os
 import json
-import datetime
+import time
+import threading
+import local_store
+import session_store
+from diary_ingest import ingest_diaries
 from google_sheets import (
     connect_sheet,
     complete_premium_registration,
-    append_diary_sample_to_sheet,
     save_premium_user_info_to_sheet,  # ✅ 追加
     get_user_info_from_sheet
 )
 
-# ✅ プレミアム設定保存ファイル
+# ✅ 旧プレミアム設定ファイル（初回のみローカルDBへ移行）
 PREMIUM_FILE = "premium_settings.json"
 
-# ✅ プレミアム設定キャッシュ
+# ✅ プレミアム設定キャッシュ（他プロセスが保存したらバージョンが変わり破棄される）
 premium_settings_cache = {}
+_premium_cache_version = None
+# ✅ 他プロセスの保存（バージョン）を確認する間隔（秒）。自プロセスの保存はすぐ反映される
+PREMIUM_SETTINGS_VERSION_CHECK_INTERVAL = float(os.getenv("PREMIUM_SETTINGS_VERSION_CHECK_INTERVAL", "2"))
+_premium_version_checked_at = 0.0
+_premium_settings_lock = threading.Lock()
+_premium_settings_migrated = False
 
 # ✅ 登録中プレミアム設定の仮状態
-premium_state = {}
+premium_state = session_store.namespace("premium_state")
 
 # ✅ 口調登録管理（state更新用）
 def update_user_state(user_id, next_step):
@@ -86,6 +95,7 @@ def handle_premium_step(user_id, message):
         step += 1
 
         if step < len(premium_questions):
+            premium_state[user_id] = state
             return premium_questions[step]["question"]
         else:
             # ✅ 最終保存処理
@@ -103,48 +113,53 @@ def handle_premium_step(user_id, message):
 
     return "⚠️ 不明なステップです。再度設定してください。"
 
-# ✅ プレミアム設定保存
+# ✅ 旧 premium_settings.json をローカルDBへ取り込む（1回だけ）
+def _migrate_premium_settings_file():
+    global _premium_settings_migrated
+    if _premium_settings_migrated:
+        return
+    with _premium_settings_lock:
+        if _premium_settings_migrated:
+            return
+        if os.path.exists(PREMIUM_FILE) and not local_store.get_meta("premium_settings_migrated"):
+            with open(PREMIUM_FILE, "r", encoding="utf-8") as f:
+                local_store.import_premium_settings(json.load(f))
+            local_store.set_meta("premium_settings_migrated", True)
+        _premium_settings_migrated = True
+
+# ✅ 他プロセスの保存を検知したらキャッシュを破棄（確認は PREMIUM_SETTINGS_VERSION_CHECK_INTERVAL ごと）
+def _sync_premium_settings_cache():
+    global _premium_cache_version, _premium_version_checked_at
+    if time.monotonic() - _premium_version_checked_at < PREMIUM_SETTINGS_VERSION_CHECK_INTERVAL:
+        return
+    version = local_store.get_premium_settings_version()
+    with _premium_settings_lock:
+        if version != _premium_cache_version:
+            premium_settings_cache.clear()
+            _premium_cache_version = version
+        _premium_version_checked_at = time.monotonic()
+
+# ✅ プレミアム設定保存（ユーザー単位で上書き。ファイル全体は書き換えない）
 def save_premium_settings(user_id, settings):
-    if os.path.exists(PREMIUM_FILE):
-        with open(PREMIUM_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    else:
-        data = {}
-
-    data[user_id] = settings
-    with open(PREMIUM_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    _migrate_premium_settings_file()
+    local_store.save_premium_settings(user_id, settings)
+    premium_settings_cache.pop(user_id, None)
 
 # ✅ プレミアム設定読込（キャッシュ対応）
 def load_premium_settings(user_id):
+    _migrate_premium_settings_file()
+    _sync_premium_settings_cache()
     if user_id in premium_settings_cache:
         return premium_settings_cache[user_id]
 
-    if os.path.exists(PREMIUM_FILE):
-        with open(PREMIUM_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            setting = data.get(user_id, {})
-            premium_settings_cache[user_id] = setting
-            return setting
-    return {}
+    setting = local_store.get_premium_settings(user_id) or {}
+    premium_settings_cache[user_id] = setting
+    return setting
 
 # ✅ プレミアム設定中かどうかチェック
 def is_in_premium_setting(user_id):
     return user_id in premium_state
 
-# ✅ 日記サンプル保存（シート振り分け）
+# ✅ 日記サンプル保存（タイプを判定してまとめて1回で書き込む）
 def save_diary_samples(user_id, diary_samples):
-    keywords = {
-        "shukkin": ["出勤", "おはよう", "こんにちは", "今日も出勤"],
-        "taikin": ["退勤", "お疲れ様", "おやすみ", "また明日"],
-        "orei": ["ありがとう", "感謝", "お礼", "嬉しい", "また会いたい"]
-    }
-
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for diary in diary_samples.split("\n\n"):
-        diary_type = "diary"
-        for type_key, kw_list in keywords.items():
-            if any(kw in diary for kw in kw_list):
-                diary_type = type_key
-                break
-        append_diary_sample_to_sheet(user_id, diary_type, diary.strip(), now)
\ No newline at end of file
+    return ingest_diaries(user_id, diary_samples)
@@ -1,12 +1,16 @@
 import os
-import json
-import shutil
-import gspread
+import logging
 from datetime import datetime
-from oauth2client.service_account import ServiceAccountCredentials
-from google_sheets import connect_sheet
+import gspread
+import local_store
+import feedback_store
+from premium_setting import load_premium_settings
+from diary_ingest import ingest_diaries
+from google_sheets import (
+    connect_sheet, buffer_increment, register_counter, append_log_rows,
+    dispatch_write, use_local_store, init_local_store, get_archived_records
+)
 
-PREMIUM_FILE = "premium_settings.json"
 SAMPLE_FOLDER = "diary_data/sample"
 
 SHEET_NAME = "DiaryUserData"
@@ -15,11 +19,7 @@ DIARY_LOG_SHEET = "PremiumDiarySamples"
 
 # ✅ 有料ユーザーの設定を取得
 def get_premium_settings(user_id):
-    if not os.path.exists(PREMIUM_FILE):
-        return {}
-    with open(PREMIUM_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        return data.get(user_id, {})
+    return load_premium_settings(user_id)
 
 # ✅ プレミアム設定をプロンプトに反映
 def apply_premium_to_prompt(premium, base_prompt, diary_samples=None):
@@ -49,9 +49,7 @@ def apply_premium_to_prompt(premium, base_prompt, diary_samples=None):
 
 # ✅ 👍フィードバック削除（有料化時）
 def clean_feedback_on_upgrade(user_id):
-    feedback_dir = os.path.join("feedback", "good", user_id)
-    if os.path.exists(feedback_dir):
-        shutil.rmtree(feedback_dir)
+    feedback_store.remove_user(user_id, "good")
 
 # ✅ サンプル日記取得（無料ユーザー用）
 def get_sample_diary_entries(diary_type):
@@ -63,48 +61,65 @@ def get_sample_diary_entries(diary_type):
 
 # ✅ [旧関数] 提出された日記をUserDiariesシートに保存
 def save_user_diary_entry(user_id, diary_type, diary_text):
-    sheet = connect_sheet(SHEET_NAME, DIARY_SHEET)
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    sheet.append_row([user_id, diary_type, now, diary_text])
+    append_log_rows(SHEET_NAME, DIARY_SHEET, [[user_id, diary_type, now, diary_text]])
 
-# ✅ [新] 提出日記をまとめてUserDiaryLogに保存
+# ✅ [新] 提出日記をまとめて PremiumDiarySamples に保存（日記追加と同じ取り込み処理）
 def save_diary_entries_to_sheet(user_id, raw_text):
-    sheet = connect_sheet(SHEET_NAME, DIARY_LOG_SHEET)
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    entries = [entry.strip() for entry in raw_text.strip().split("\n\n") if entry.strip()]
-
-    for entry in entries:
-        lower = entry.lower()
-        if any(word in lower for word in ["出勤", "おはよう", "今日も頑張る"]):
-            diary_type = "shukkin"
-        elif any(word in lower for word in ["退勤", "おやすみ", "ありがとう", "今日も"]):
-            diary_type = "taikin"
-        elif any(word in lower for word in ["ありがとう", "感謝", "差し入れ"]):
-            diary_type = "orei"
-        else:
-            diary_type = "unknown"
-
-        sheet.append_row([user_id, diary_type, entry, now])
+    return ingest_diaries(user_id, raw_text)
 
 # ✅ [新] Google Sheetsから有料ユーザーの自作日記を取得
-def get_user_diary_samples(user_id, diary_type, limit=10):
+def get_user_diary_samples(user_id, diary_type, limit=10, include_archive=False):
+    if use_local_store():
+        init_local_store()
+        return local_store.get_diary_samples(user_id, diary_type, limit, newest=True)
+
     sheet = connect_sheet(SHEET_NAME, DIARY_LOG_SHEET)
-    records = sheet.get_all_records()
+    records = (get_archived_records(DIARY_LOG_SHEET) if include_archive else []) + sheet.get_all_records()
     filtered = [
         row["diary_text"] for row in records
         if row.get("user_id") == user_id and row.get("diary_type") == diary_type
     ]
     return filtered[-limit:]  # 新しい順に最大10件
 
-# ✅ 使用された日記の使用回数を+1する
+# ✅ 使用された日記の使用回数を+1する（書き込みはバッファでまとめて反映）
 def increment_diary_usage(user_id, diary_text):
-    sheet = connect_sheet("DiaryUserData", "PremiumDiarySamples")
-    records = sheet.get_all_records()
-
-    for idx, row in enumerate(records):
-        if row["user_id"] == user_id and row["diary_text"].strip() == diary_text.strip():
-            current = row.get("used_count", 0)
-            new_count = int(current) + 1 if str(current).isdigit() else 1
-            sheet.update_cell(idx + 2, 5, new_count)  # 5列目が used_count の列
-            break
+    increment_diary_usage_bulk(user_id, [diary_text])
+
+# ✅ 実際にプロンプトに使った日記だけをまとめて+1する
+# シートへは次回フラッシュ時に「1回の読み込み + 1回の batch_update」で反映される
+def increment_diary_usage_bulk(user_id, diary_texts):
+    counts = {}
+    for text in diary_texts:
+        key = text.strip()
+        if key:
+            counts[key] = counts.get(key, 0) + 1
+    if counts:
+        dispatch_write(local_store.increment_diary_usage_many, _sheet_increment_diary_usage, user_id, counts)
+
+def _sheet_increment_diary_usage(user_id, counts):
+    for text, amount in counts.items():
+        buffer_increment(SHEET_NAME, DIARY_LOG_SHEET, (user_id, text), amount)
+
+# 🔧 タブを1回読み、used_count の列は見出しから探す
+def _resolve_diary_usage_counts(sheet, counts):
+    values = sheet.get_all_values()
+    header = values[0] if values else []
+    if "used_count" not in header:
+        logging.warning(f"[Sheets] {DIARY_LOG_SHEET} に used_count 列がないため、使用回数を反映できません")
+        return [], []
+    count_col = header.index("used_count") + 1
+    updates = []
+    remaining = dict(counts)
+
+    for idx, row in enumerate(values[1:]):
+        record = dict(zip(header, row))
+        key = (record.get("user_id", ""), str(record.get("diary_text", "")).strip())
+        if key in remaining:
+            current = str(record.get("used_count", "")).strip()
+            new_count = (int(current) if current.isdigit() else 0) + remaining.pop(key)
+            updates.append({"range": gspread.utils.rowcol_to_a1(idx + 2, count_col), "values": [[new_count]]})
+    return updates, []
+
+register_counter(SHEET_NAME, DIARY_LOG_SHEET, _resolve_diary_usage_counts)
 
@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import logging
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+try:
+    import tiktoken
+except ImportError:  # 未インストールなら文字種ごとの概算で数える
+    tiktoken = None
+
+# ✅ プロンプト組み立て（セクションごとにトークン数を数え、上限に収める）
+# 目的文・キャラ情報・プレミアム設定は固定で入れ、参考日記は残りの枠に上位から詰める
+
+# ✅ ユーザープロンプト全体のトークン上限
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+# ✅ プレミアム設定の1項目・キーワードの上限（長文の貼り付け対策）
+PROMPT_FIELD_MAX_TOKENS = int(os.getenv("PROMPT_FIELD_MAX_TOKENS", "100"))
+# ✅ ユーザーごとの固定セクション（キャラ情報・プレミアム設定）のキャッシュ数
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "512"))
+
+_encoding = tiktoken.get_encoding("cl100k_base") if tiktoken else None
+
+_cache_lock = threading.Lock()
+_section_cache = OrderedDict()   # (user_id, セクション名) → (入力の指紋, 本文, トークン数)
+
+_metrics_lock = threading.Lock()
+prompt_metrics = {}
+
+# 🔧 トークン数（tiktoken が無い時は ASCII 4文字≒1、日本語1文字≒1、絵文字≒2 で概算）
+def count_tokens(text):
+    if not text:
+        return 0
+    if _encoding:
+        return len(_encoding.encode(text))
+    ascii_chars = sum(len(run) for run in re.findall(r"[\x00-\x7f]+", text))
+    wide_chars = sum(1 for ch in text if ord(ch) > 0xFFFF)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars) + wide_chars
+
+# 🔧 limit トークンに収まるよう末尾を切る
+def truncate_tokens(text, limit):
+    if count_tokens(text) <= limit:
+        return text
+    if _encoding:
+        return _encoding.decode(_encoding.encode(text)[:max(limit, 0)])
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= limit:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+# 🔧 参考日記を上位から limit トークンまで詰める（1件も入らなければ先頭を切り詰めて1件だけ）
+def fit_references(references, limit):
+    selected = []
+    used = 0
+    for text in references:
+        tokens = count_tokens(text) + 1  # 区切りの改行
+        if used + tokens > limit:
+            continue
+        selected.append(text)
+        used += tokens
+    if not selected and references and limit > 0:
+        first = truncate_tokens(references[0], limit - 1)
+        if first:
+            selected.append(first)
+            used = count_tokens(first) + 1
+    return selected, used
+
+# ✅ ユーザーごとの固定セクション。入力が前回と同じなら組み立て・カウントを省略
+def cached_section(user_id, name, source, render):
+    key = (user_id, name)
+    fingerprint = json.dumps(source, sort_keys=True, ensure_ascii=False, default=str)
+    with _cache_lock:
+        entry = _section_cache.get(key)
+        if entry and entry[0] == fingerprint:
+            _section_cache.move_to_end(key)
+            return entry[1], entry[2]
+
+    text = render()
+    tokens = count_tokens(text)
+    with _cache_lock:
+        _section_cache[key] = (fingerprint, text, tokens)
+        _section_cache.move_to_end(key)
+        while len(_section_cache) > PROMPT_CACHE_SIZE:
+            _section_cache.popitem(last=False)
+    return text, tokens
+
+@lru_cache(maxsize=16)
+def _template_tokens(template):
+    return count_tokens(re.sub(r"\{\w+\}", "", template))
+
+# ✅ template の {名前} に sections（名前 → (本文, トークン数)）を入れ、{references} に残りの枠で参考日記を詰める
+def assemble(plan, diary_type, template, sections, references, budget=None):
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    fixed_tokens = _template_tokens(template) + sum(tokens for _, tokens in sections.values())
+    selected, reference_tokens = fit_references([r for r in references if r], budget - fixed_tokens)
+
+    prompt = template.format(references="\n".join(selected), **{name: text for name, (text, _) in sections.items()})
+    usage = {name: tokens for name, (_, tokens) in sections.items()}
+    usage["template"] = _template_tokens(template)
+    usage["references"] = reference_tokens
+    usage["total"] = fixed_tokens + reference_tokens
+    _record(plan, diary_type, usage, len(references) - len(selected))
+
+    logging.info(
+        f"[プロンプト] {plan}:{diary_type} "
+        + " ".join(f"{name}={tokens}" for name, tokens in usage.items())
+        + f" 参考={len(selected)}/{len(references)}件"
+    )
+    return prompt
+
+def _record(plan, diary_type, usage, dropped):
+    key = f"{plan}:{diary_type}"
+    with _metrics_lock:
+        stats = prompt_metrics.setdefault(key, {"count": 0, "references_dropped": 0, "tokens_total": {}, "tokens_max": 0})
+        stats["count"] += 1
+        stats["references_dropped"] += dropped
+        stats["tokens_max"] = max(stats["tokens_max"], usage["total"])
+        for name, tokens in usage.items():
+            stats["tokens_total"][name] = stats["tokens_total"].get(name, 0) + tokens
+
+def get_prompt_metrics():
+    with _metrics_lock:
+        return {key: dict(stats, tokens_total=dict(stats["tokens_total"])) for key, stats in prompt_metrics.items()}
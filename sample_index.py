@@ -0,0 +1,120 @@
+import os
+import re
+import math
+import time
+import random
+import threading
+from collections import OrderedDict
+
+from google_sheets import get_user_reference_texts
+
+# ✅ プレミアム用の参考日記検索インデックス（ユーザーごと）
+# 自作日記（PremiumDiarySamples）と👍の日記を文字1〜2-gramの TF-IDF で引けるようにし、
+# 日記タイプが一致するもの・キーワードに近いものから上位 k 件を選ぶ
+# 日記の追加・👍のたびに add() で差分だけ追加する
+
+# ✅ 他プロセスでの追加分を取り込むための再構築間隔（秒）
+SAMPLE_INDEX_TTL = int(os.getenv("SAMPLE_INDEX_TTL", "600"))
+# ✅ インデックスを持つユーザー数の上限（超えたら古いユーザーから破棄）
+SAMPLE_INDEX_MAX_USERS = int(os.getenv("SAMPLE_INDEX_MAX_USERS", "200"))
+
+# ✅ 日記タイプが一致した時の加点（キーワード一致度は 0〜1）
+TYPE_MATCH_BONUS = 0.5
+# ✅ タイプ未分類の自作日記（プレミアム設定で登録した "diary"）の加点
+UNTYPED_BONUS = 0.25
+
+_lock = threading.Lock()
+_indexes = OrderedDict()   # user_id → UserSampleIndex
+
+# 🔧 文字1-gram + 2-gram（1文字のキーワードでも引けるように）
+def _grams(text):
+    normalized = re.sub(r"\s+", "", text)
+    return list(normalized) + [normalized[i:i + 2] for i in range(len(normalized) - 1)]
+
+class UserSampleIndex:
+    def __init__(self):
+        self.docs = []       # (source, diary_type, text, {n-gram: 重み})
+        self.postings = {}   # n-gram → 含む日記の番号リスト
+        self.texts = set()
+        self.built_at = time.monotonic()
+
+    def add(self, source, diary_type, text):
+        text = (text or "").strip()
+        if not text or text in self.texts:
+            return
+        counts = {}
+        for gram in _grams(text):
+            counts[gram] = counts.get(gram, 0) + 1
+        # サブリニアTF をL2正規化（日記の長さで有利不利が出ないように）
+        weights = {gram: 1 + math.log(count) for gram, count in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        doc_id = len(self.docs)
+        self.docs.append((source, diary_type, text, {gram: w / norm for gram, w in weights.items()}))
+        self.texts.add(text)
+        for gram in weights:
+            self.postings.setdefault(gram, []).append(doc_id)
+
+    def search(self, diary_type, keyword_text=None, k=5):
+        scores = [
+            TYPE_MATCH_BONUS if doc[1] == diary_type else UNTYPED_BONUS if doc[1] == "diary" else 0.0
+            for doc in self.docs
+        ]
+
+        # キーワードの n-gram を IDF で重み付けし、コサイン類似度（0〜1）を加点
+        query = set()
+        for keyword in re.split(r"[、,\s]+", keyword_text or ""):
+            query.update(_grams(keyword))
+        total = len(self.docs)
+        idf = {gram: math.log((total + 1) / (len(self.postings.get(gram, ())) + 1)) + 1 for gram in query}
+        query_norm = math.sqrt(sum(w * w for w in idf.values())) or 1.0
+        for gram, weight in idf.items():
+            for doc_id in self.postings.get(gram, ()):
+                scores[doc_id] += weight / query_norm * self.docs[doc_id][3][gram]
+
+        # 別タイプの日記はキーワードに当たった時だけ使う
+        # 同点はランダム（キーワードなしでも毎回同じ組み合わせにならないように）
+        order = [doc_id for doc_id in range(total) if scores[doc_id] > 0]
+        random.shuffle(order)
+        order.sort(key=lambda doc_id: scores[doc_id], reverse=True)
+        return [(self.docs[doc_id][0], self.docs[doc_id][2]) for doc_id in order[:k]]
+
+def _get_index(user_id):
+    with _lock:
+        index = _indexes.get(user_id)
+        if index and time.monotonic() - index.built_at < SAMPLE_INDEX_TTL:
+            _indexes.move_to_end(user_id)
+            return index
+
+    index = UserSampleIndex()
+    for source, diary_type, text in get_user_reference_texts(user_id):
+        index.add(source, diary_type, text)
+
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > SAMPLE_INDEX_MAX_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+# ✅ 参考日記を上位 k 件 [(source, text)]（source は "sample" / "feedback"）
+def search(user_id, diary_type, keyword_text=None, k=5):
+    index = _get_index(user_id)
+    with _lock:
+        return index.search(diary_type, keyword_text, k)
+
+# ✅ 登録済みの自作日記（取り込み時の重複チェック用）
+def get_sample_texts(user_id):
+    index = _get_index(user_id)
+    with _lock:
+        return {doc[2] for doc in index.docs if doc[0] == "sample"}
+
+# ✅ 日記追加・👍の時に呼ぶ（インデックス未作成のユーザーは次回の検索時にまとめて読み込む）
+def add(user_id, source, diary_type, text):
+    with _lock:
+        index = _indexes.get(user_id)
+        if index:
+            index.add(source, diary_type, text)
+
+def discard(user_id):
+    with _lock:
+        _indexes.pop(user_id, None)
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# ✅ 会話ステート（登録中・プレミアム設定中・直近の日記など）の保存先
+# SESSION_BACKEND=memory : プロセス内（従来通り。ワーカー1つ向け）
+# SESSION_BACKEND=sqlite : ローカルファイル（複数ワーカーで共有・再起動後も保持）
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+
+# ✅ 放置されたステートの有効期限（秒）。更新のたびに延長される
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 60 * 60)))
+
+# ✅ 期限切れステートの掃除間隔（秒）
+SESSION_SWEEP_INTERVAL = 10 * 60
+
+
+class MemorySessionStore:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self._swept_at = time.monotonic()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None or item[1] < time.monotonic():
+                return default
+            return item[0]
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._data[(namespace, key)] = (value, time.monotonic() + self.ttl)
+            self._sweep()
+
+    def delete(self, namespace, key):
+        with self._lock:
+            return self._data.pop((namespace, key), None) is not None
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._swept_at < SESSION_SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        for item_key in [k for k, (_, expires_at) in self._data.items() if expires_at < now]:
+            del self._data[item_key]
+
+
+class SqliteSessionStore:
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._swept_at = 0.0
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "namespace TEXT, key TEXT, value TEXT, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key, default=None):
+        row = self._conn().execute(
+            "SELECT value FROM sessions WHERE namespace = ? AND key = ? AND expires_at >= ?",
+            (namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace, key, value):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl)
+            )
+        self._sweep()
+
+    def delete(self, namespace, key):
+        with self._conn() as conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", (namespace, key))
+        return cursor.rowcount > 0
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._swept_at < SESSION_SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        with self._conn() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+
+
+# ✅ 既存コードの dict と同じ書き方（in / [] / get / pop / del）で使える名前空間
+# ネストした値を書き換えた時は、必ず ns[key] = value で書き戻すこと
+class SessionNamespace:
+    _missing = object()
+
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+
+    def __contains__(self, key):
+        return self.store.get(self.namespace, key, self._missing) is not self._missing
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key, self._missing)
+        if value is self._missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        if not self.store.delete(self.namespace, key):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self.store.get(self.namespace, key, default)
+
+    def pop(self, key, default=_missing):
+        value = self.store.get(self.namespace, key, self._missing)
+        if value is self._missing:
+            if default is self._missing:
+                raise KeyError(key)
+            return default
+        self.store.delete(self.namespace, key)
+        return value
+
+    def add(self, key):
+        self.store.set(self.namespace, key, True)
+
+    def discard(self, key):
+        self.store.delete(self.namespace, key)
+
+
+def _create_store():
+    if SESSION_BACKEND == "sqlite":
+        return SqliteSessionStore(SESSION_DB_PATH, SESSION_TTL)
+    return MemorySessionStore(SESSION_TTL)
+
+store = _create_store()
+
+def namespace(name):
+    return SessionNamespace(store, name)
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# ✅ アプリのモジュールは読み込み時に環境変数を読むため、import より先に設定する
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="diary_bot_tests_")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test-secret")
+os.environ["SHEETS_MODE"] = "primary"
+os.environ["APPROVAL_NOTIFIER"] = "false"
+os.environ["LOG_ARCHIVE"] = "false"
+os.environ["LOCAL_DB_PATH"] = os.path.join(_workdir, "diary_bot.db")
+os.environ["SESSION_DB_PATH"] = os.path.join(_workdir, "sessions.db")
+os.environ["SHEETS_ROW_LOCK_FILE"] = os.path.join(_workdir, "sheets_rows.lock")
+
+import load_test
+import google_sheets
+
+# 🔧 代役の Sheets（books: {スプレッドシート: {タブ: 行}}）を入れ、プロセス内のキャッシュを空にする
+@pytest.fixture
+def fake_sheets():
+    def install(books, latency=0):
+        backend = load_test.Backend("sheets", latency, 0)
+        client = load_test.install_fake_sheets(backend, books)
+        with google_sheets._write_lock:
+            google_sheets._pending_appends.clear()
+            google_sheets._pending_counters.clear()
+        google_sheets.invalidate_user_info_index()
+        google_sheets.invalidate_template_cache()
+        return backend, client
+    return install
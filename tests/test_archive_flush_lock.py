@@ -0,0 +1,122 @@
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+import load_test
+import google_sheets
+
+HEADER = ["user_id", "date", "count"]
+
+def _books():
+    return {"DiaryUserData": {"UsageLog": [
+        HEADER,
+        ["U1", "2026-01-05", "4"],
+        ["U2", "2026-01-06", "7"],
+        ["U3", "2026-03-01", "1"],
+    ]}}
+
+def _tab(client, name):
+    return client.books["DiaryUserData"].tabs[name].rows
+
+def _archive():
+    return google_sheets.archive_log_rows("UsageLog", ["date"], "2026-02-01")
+
+def test_compaction_between_increment_and_flush(fake_sheets):
+    _, client = fake_sheets(_books())
+    google_sheets.buffer_increment("DiaryUserData", "UsageLog", ("U3", "2026-03-01"), 2)
+
+    assert _archive() == 2
+    google_sheets.flush_pending_writes()
+
+    assert _tab(client, "UsageLog") == [HEADER, ["U3", "2026-03-01", "3"]]
+    assert _tab(client, "UsageLog_2026-01")[1:] == [["U1", "2026-01-05", "4"], ["U2", "2026-01-06", "7"]]
+
+# 🔧 反映が行を読んでから書くまでの間にアーカイブが走っても、詰め直しは反映の後になる
+def test_compaction_waits_for_flush_in_progress(fake_sheets, monkeypatch):
+    _, client = fake_sheets(_books())
+    google_sheets.buffer_increment("DiaryUserData", "UsageLog", ("U3", "2026-03-01"), 2)
+
+    resolve = google_sheets._counter_resolvers[("DiaryUserData", "UsageLog")]
+    archiver = threading.Thread(target=_archive)
+    def resolve_then_archive(sheet, counts):
+        result = resolve(sheet, counts)
+        archiver.start()
+        time.sleep(0.1)
+        return result
+    monkeypatch.setitem(google_sheets._counter_resolvers, ("DiaryUserData", "UsageLog"), resolve_then_archive)
+
+    google_sheets.flush_pending_writes()
+    archiver.join(5)
+
+    assert _tab(client, "UsageLog") == [HEADER, ["U3", "2026-03-01", "3"]]
+    assert _tab(client, "UsageLog_2026-01")[1:] == [["U1", "2026-01-05", "4"], ["U2", "2026-01-06", "7"]]
+
+@pytest.mark.skipif(google_sheets.fcntl is None, reason="flock が使えない環境")
+def test_flush_waits_for_other_process_holding_row_lock(fake_sheets):
+    _, client = fake_sheets(_books())
+    google_sheets.buffer_increment("DiaryUserData", "UsageLog", ("U3", "2026-03-01"), 2)
+
+    # 別プロセス（アーカイブ中のワーカーの代わり）がロックを持っている間は反映しない
+    holder = subprocess.Popen(
+        [sys.executable, "-c",
+         "import fcntl, sys\n"
+         f"f = open({google_sheets.SHEETS_ROW_LOCK_FILE!r}, 'a')\n"
+         "fcntl.flock(f, fcntl.LOCK_EX)\n"
+         "print('locked', flush=True)\n"
+         "sys.stdin.read()\n"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        flusher = threading.Thread(target=google_sheets.flush_pending_writes)
+        flusher.start()
+        flusher.join(0.3)
+        assert flusher.is_alive()
+        assert _tab(client, "UsageLog")[3] == ["U3", "2026-03-01", "1"]
+    finally:
+        holder.stdin.close()
+        holder.wait(5)
+    flusher.join(5)
+    assert not flusher.is_alive()
+    assert _tab(client, "UsageLog")[3] == ["U3", "2026-03-01", "3"]
+
+def _diary_log_books():
+    return {"DiaryUserData": {"UserDiaryLog": [
+        ["user_id", "diary_type", "diary_text", "timestamp"],
+        ["U1", "shukkin", "おはよう", "2026-01-05 09:00:00"],
+        ["U2", "taikin", "おつかれ", "2026-03-01 22:00:00"],
+    ]}}
+
+# 🔧 バッファを通さない追記も、詰め直しが終わるまで待つ
+def test_direct_append_waits_for_compaction(fake_sheets, monkeypatch):
+    _, client = fake_sheets(_diary_log_books())
+    appender = threading.Thread(target=google_sheets.append_user_diary_entry, args=("U3", "orei", "ありがとう"))
+    write_archive = google_sheets._write_archive
+    def archive_then_append(*args):
+        write_archive(*args)
+        appender.start()
+        appender.join(0.2)
+        assert appender.is_alive()
+    monkeypatch.setattr(google_sheets, "_write_archive", archive_then_append)
+
+    assert google_sheets.archive_log_rows("UserDiaryLog", ["timestamp"], "2026-02-01") == 1
+    appender.join(5)
+
+    rows = _tab(client, "UserDiaryLog")
+    assert [row[:3] for row in rows[1:]] == [["U2", "taikin", "おつかれ"], ["U3", "orei", "ありがとう"]]
+
+# 🔧 書き戻しは USER_ENTERED（RAW だと数値・日付が文字列になる）
+def test_compaction_rewrites_with_user_entered(fake_sheets, monkeypatch):
+    fake_sheets(_books())
+    options = []
+    original = load_test.FakeWorksheet.update
+    def update(self, range_name, values=None, **kwargs):
+        options.append(kwargs.get("value_input_option"))
+        return original(self, range_name, values, **kwargs)
+    monkeypatch.setattr(load_test.FakeWorksheet, "update", update)
+
+    assert _archive() == 2
+    assert options == ["USER_ENTERED"]
@@ -0,0 +1,16 @@
+import re
+
+import diary_classifier
+
+def _key(text):
+    return re.sub(r"\s+", "", text)
+
+def test_duplicates_are_collapsed_before_the_split():
+    examples = [("おはよう☀️\n出勤です", "shukkin"), ("おはよう☀️ 出勤です", "shukkin"), ("ありがとう💕", "orei")]
+    assert diary_classifier._unique_examples(examples) == [examples[0], examples[2]]
+
+def test_held_out_texts_never_appear_in_training():
+    examples = diary_classifier._unique_examples(diary_classifier.load_labelled_diaries())
+    train = {_key(text) for i, (text, _) in enumerate(examples) if i % 5}
+    held_out = [_key(text) for i, (text, _) in enumerate(examples) if not i % 5]
+    assert held_out and not any(text in train for text in held_out)
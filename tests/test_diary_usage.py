@@ -0,0 +1,34 @@
+import google_sheets
+import premium_utils
+
+def _books(header, rows):
+    return {"DiaryUserData": {"PremiumDiarySamples": [header] + rows}}
+
+def _cell(client, row, name):
+    rows = client.books["DiaryUserData"].tabs["PremiumDiarySamples"].rows
+    return rows[row - 1][rows[0].index(name)]
+
+def test_bulk_increment_reads_once_and_writes_once(fake_sheets):
+    header = ["user_id", "diary_type", "timestamp", "diary_text", "used_count"]
+    texts = [f"日記{i}" for i in range(10)]
+    backend, client = fake_sheets(_books(header, [["U1", "shukkin", "2026-01-01", text, "0"] for text in texts]))
+
+    premium_utils.increment_diary_usage_bulk("U1", texts + [" 日記0 "])
+    google_sheets.flush_pending_writes()
+
+    calls, _ = backend.snapshot()
+    assert calls.get("PremiumDiarySamples.get_all_values", 0) + calls.get("PremiumDiarySamples.get_all_records", 0) == 1
+    assert calls["PremiumDiarySamples.batch_update"] == 1
+    assert _cell(client, 2, "used_count") == "2"
+    assert all(_cell(client, row, "used_count") == "1" for row in range(3, 12))
+
+def test_usage_column_is_found_by_header(fake_sheets):
+    header = ["user_id", "used_count", "diary_type", "diary_text", "timestamp"]
+    backend, client = fake_sheets(_books(header, [["U1", "3", "orei", "ありがとう", "2026-01-01"], ["U2", "", "orei", "ありがとう", "2026-01-01"]]))
+
+    premium_utils.increment_diary_usage_bulk("U1", ["ありがとう"])
+    google_sheets.flush_pending_writes()
+
+    assert _cell(client, 2, "used_count") == "4"
+    assert _cell(client, 2, "timestamp") == "2026-01-01"
+    assert _cell(client, 3, "used_count") == ""
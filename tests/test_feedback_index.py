@@ -0,0 +1,70 @@
+import threading
+
+import feedback_index
+
+def _install(monkeypatch, rows):
+    fetch_started = threading.Event()
+    release = threading.Event()
+    release.set()
+    def fetch():
+        fetch_started.set()
+        release.wait(5)
+        return list(rows)
+    monkeypatch.setattr(feedback_index, "get_all_positive_feedback", fetch)
+    monkeypatch.setattr(feedback_index, "_log_feedback", lambda **kwargs: kwargs["diary_text"][-19:])
+    feedback_index.discard()
+    return fetch_started, release
+
+def _expire(monkeypatch):
+    monkeypatch.setattr(feedback_index, "FEEDBACK_INDEX_TTL", 0)
+
+def test_reads_use_old_index_while_rebuilding(monkeypatch):
+    rows = [("U1", "shukkin", "2026-01-01 09:00:00", "おはよう")]
+    fetch_started, release = _install(monkeypatch, rows)
+    assert feedback_index.count("U1", "shukkin") == 1
+
+    _expire(monkeypatch)
+    release.clear()
+    fetch_started.clear()
+    rows.append(("U1", "shukkin", "2026-01-02 09:00:00", "こんにちは"))
+    builder = threading.Thread(target=feedback_index.count, args=("U1", "shukkin"))
+    builder.start()
+    assert fetch_started.wait(5)
+
+    # 読み込み中でもロックで待たされず、古い索引で答える
+    reader = threading.Thread(target=lambda: feedback_index.recent("U1", "shukkin"))
+    reader.start()
+    reader.join(1)
+    assert not reader.is_alive()
+    assert feedback_index.count("U1", "shukkin") == 1
+
+    release.set()
+    builder.join(5)
+    monkeypatch.setattr(feedback_index, "FEEDBACK_INDEX_TTL", 600)
+    assert feedback_index.count("U1", "shukkin") == 2
+
+def test_feedback_logged_during_rebuild_is_counted_once(monkeypatch):
+    rows = [("U1", "orei", "2026-01-01 09:00:00", "ありがとう")]
+    fetch_started, release = _install(monkeypatch, rows)
+    assert feedback_index.count("U1", "orei") == 1
+
+    _expire(monkeypatch)
+    release.clear()
+    fetch_started.clear()
+    builder = threading.Thread(target=feedback_index.count, args=("U1", "orei"))
+    builder.start()
+    assert fetch_started.wait(5)
+
+    # 読み込みに含まれる記録（バッファから拾われた）と、含まれない記録
+    feedback_index.log_feedback("U1", "orei", "good", "また来てね 2026-01-02 09:00:00")
+    feedback_index.log_feedback("U1", "orei", "good", "楽しかった 2026-01-03 09:00:00")
+    feedback_index.log_feedback("U1", "orei", "bad", "いまいち 2026-01-03 10:00:00")
+    rows.append(("U1", "orei", "2026-01-02 09:00:00", "また来てね 2026-01-02 09:00:00"))
+
+    release.set()
+    builder.join(5)
+    monkeypatch.setattr(feedback_index, "FEEDBACK_INDEX_TTL", 600)
+    assert feedback_index.count("U1", "orei") == 3
+    assert feedback_index.recent("U1", "orei") == [
+        "楽しかった 2026-01-03 09:00:00", "また来てね 2026-01-02 09:00:00", "ありがとう",
+    ]
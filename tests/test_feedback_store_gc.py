@@ -0,0 +1,43 @@
+import glob
+import os
+
+import pytest
+
+import feedback_store
+import log_archive
+
+REMOVED = "退会したユーザーの👍日記です🌙"
+KEPT = "残るユーザーの👍日記です☀️"
+
+@pytest.fixture(params=[True, False], ids=["pack", "objects"])
+def store(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(feedback_store, "FEEDBACK_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(feedback_store, "FEEDBACK_STORE_PACK", request.param)
+    monkeypatch.setattr(feedback_store, "_index", {})
+    monkeypatch.setattr(feedback_store, "_index_pos", 0)
+    monkeypatch.setattr(feedback_store, "_index_ino", None)
+    monkeypatch.setattr(log_archive, "ARCHIVE_TABS", {})
+    return tmp_path
+
+def _stored_bytes(root):
+    return b"".join(
+        open(path, "rb").read()
+        for path in glob.glob(os.path.join(root, "**", "*"), recursive=True)
+        if os.path.isfile(path) and "manifests" not in path
+    )
+
+def test_daily_job_physically_removes_unreferenced_feedback(store):
+    removed_digest = feedback_store.save("Ugone", "good", "orei", REMOVED)
+    kept_digest = feedback_store.save("Ukeep", "good", "orei", KEPT)
+    assert REMOVED.encode("utf-8") in _stored_bytes(store)
+
+    assert feedback_store.remove_user("Ugone", "good") == 1
+    # マニフェストから外すだけでは本文は残る
+    assert REMOVED.encode("utf-8") in _stored_bytes(store)
+
+    log_archive.run_once("2026-10-18")
+
+    assert REMOVED.encode("utf-8") not in _stored_bytes(store)
+    assert feedback_store.read(removed_digest) is None
+    assert feedback_store.read(kept_digest) == KEPT
+    assert log_archive.get_metrics()["feedback_gc_removed"] >= 1
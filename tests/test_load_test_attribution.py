@@ -0,0 +1,18 @@
+import pytest
+
+import load_test
+
+# 🔧 並列で流しても、シナリオ別の呼び出し数はそのイベントの分だけになる
+# line-bot-sdk v2 の API を使っているアプリ側の非推奨警告は対象外
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+def test_per_scenario_calls_are_attributed_to_their_events():
+    report = load_test.run(
+        sessions=24, concurrency=6, mix="free=1,premium=1", line_latency=0, sheets_latency=0.005,
+        openai_latency=0.01, seed=3, verbose=True,
+    )
+    for name, calls in report["calls"].items():
+        attributed = sum(s[f"{name}_calls_per_event"] * s["events"] for s in report["scenarios"].values())
+        assert round(attributed) == calls["total"] - calls["background"]
+    # 無料ユーザーの生成コマンドは1イベントにつき OpenAI を1回だけ呼ぶ
+    assert report["scenarios"]["free"]["failed"] == 0
+    assert report["scenarios"]["free"]["openai_calls_per_event"] == 1.0
@@ -0,0 +1,47 @@
+import pytest
+
+import diary_generator
+import pregeneration
+
+USER = {"user_id": "Upregen", "name": "みく", "age_range": "20代前半", "tone": "1", "is_premium": False}
+CONTEXT = {
+    "feedback_count": 0,
+    "feedbacks": [],
+    "templates": {"opening": ["おはよう☀️"], "closing": ["またね🌙"]},
+}
+
+@pytest.fixture
+def usage_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(diary_generator, "increment_template_usage", lambda *args: calls.append(args))
+    monkeypatch.setattr(diary_generator, "increment_diary_usage_bulk", lambda *args: calls.append(args))
+    monkeypatch.setattr(diary_generator, "generate_free_diary", lambda *args: "今日もよろしくね")
+    monkeypatch.setattr(diary_generator, "gather_diary_context", lambda *args: CONTEXT)
+    monkeypatch.setattr(pregeneration, "PREGENERATION_ENABLED", True)
+    monkeypatch.setattr(pregeneration, "last_completion_tokens", lambda: 10)
+    pregeneration.discard(USER["user_id"])
+    return calls
+
+def test_generate_diary_defers_usage(usage_calls):
+    text, usage = diary_generator.generate_diary(USER, "shukkin", context=CONTEXT)
+    assert text and usage_calls == []
+    diary_generator.commit_usage(usage)
+    assert sorted(usage_calls) == [
+        ("DiaryTemplates", "ShukkinTemplates", "closing", "またね🌙"),
+        ("DiaryTemplates", "ShukkinTemplates", "opening", "おはよう☀️"),
+    ]
+
+def test_pregenerated_diary_hands_usage_to_the_sender(usage_calls):
+    pregeneration._generate(dict(USER), "shukkin")
+    assert usage_calls == []
+
+    text, usage = pregeneration.take(USER["user_id"], "shukkin")
+    assert text and usage_calls == []
+    diary_generator.commit_usage(usage)
+    assert len(usage_calls) == 2
+
+def test_expired_pregenerated_diary_never_counts_usage(usage_calls, monkeypatch):
+    pregeneration._generate(dict(USER), "shukkin")
+    monkeypatch.setattr(pregeneration, "PREGEN_TTL", -1)
+    assert pregeneration.take(USER["user_id"], "shukkin") is None
+    assert usage_calls == []
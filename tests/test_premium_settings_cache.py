@@ -0,0 +1,37 @@
+import local_store
+import premium_setting
+
+def _reset(monkeypatch, interval):
+    monkeypatch.setattr(premium_setting, "PREMIUM_SETTINGS_VERSION_CHECK_INTERVAL", interval)
+    monkeypatch.setattr(premium_setting, "_premium_version_checked_at", 0.0)
+    premium_setting.premium_settings_cache.clear()
+
+def _count_version_reads(monkeypatch):
+    calls = []
+    original = local_store.get_premium_settings_version
+    def counting():
+        calls.append(1)
+        return original()
+    monkeypatch.setattr(local_store, "get_premium_settings_version", counting)
+    return calls
+
+def test_version_check_is_throttled(monkeypatch):
+    _reset(monkeypatch, 60)
+    premium_setting.save_premium_settings("Ucache1", {"tone_tags": "清楚"})
+    calls = _count_version_reads(monkeypatch)
+    for _ in range(50):
+        assert premium_setting.load_premium_settings("Ucache1") == {"tone_tags": "清楚"}
+    assert len(calls) == 1
+
+def test_other_process_save_is_seen_after_interval(monkeypatch):
+    _reset(monkeypatch, 60)
+    premium_setting.save_premium_settings("Ucache2", {"tone_tags": "清楚"})
+    assert premium_setting.load_premium_settings("Ucache2") == {"tone_tags": "清楚"}
+
+    # 別プロセスの保存（このプロセスのキャッシュには触れない）
+    local_store.save_premium_settings("Ucache2", {"tone_tags": "甘えん坊"})
+    assert premium_setting.load_premium_settings("Ucache2") == {"tone_tags": "清楚"}
+
+    # 確認間隔が過ぎたらバージョンの変化で破棄される
+    monkeypatch.setattr(premium_setting, "_premium_version_checked_at", 0.0)
+    assert premium_setting.load_premium_settings("Ucache2") == {"tone_tags": "甘えん坊"}
@@ -0,0 +1,34 @@
+import pytest
+
+import app
+import diary_similarity
+
+FIRST = "今日もぽかぽか陽気で気持ちいいね☀️空き枠あるので会いに来てね💕"
+SECOND = "新しいネイルにしてきたよ💅最近ハマってるカフェの話を聞いてほしいな☕️"
+
+@pytest.fixture
+def committed(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "commit_usage", calls.append)
+    monkeypatch.setattr(app, "send_reply", lambda event, message: None)
+    return calls
+
+def _send(user_id, generate, regenerate):
+    app.send_generated_diary(None, user_id, "shukkin", generate, ack=False, regenerate=regenerate)
+
+def test_usage_of_rejected_diary_is_not_counted(committed):
+    diary_similarity.remember("Usend1", diary_similarity.signature(FIRST))
+    _send("Usend1", lambda: (FIRST, "first"), lambda: (SECOND, "second"))
+    assert committed == ["second"]
+    assert app.latest_diaries["Usend1"]["text"] == SECOND
+
+def test_usage_is_counted_once_without_regeneration(committed):
+    _send("Usend2", lambda: (FIRST, "first"), lambda: (SECOND, "second"))
+    assert committed == ["first"]
+
+def test_failed_regeneration_keeps_first_usage(committed):
+    diary_similarity.remember("Usend3", diary_similarity.signature(FIRST))
+    def fail():
+        raise RuntimeError("429")
+    _send("Usend3", lambda: (FIRST, "first"), fail)
+    assert committed == ["first"]
@@ -0,0 +1,37 @@
+import load_test
+import google_sheets
+
+BOOKS = {
+    "DiaryUserData": {
+        "UserInfoLog": [["user_id", "源氏名"]],
+        "FeedbackLog": [["user_id", "diary_type", "result", "timestamp", "diary_text"]],
+    },
+    "DiaryTemplates": {"ShukkinTemplates": [["section", "text", "used_count"]]},
+}
+
+def _connect_many():
+    for _ in range(10):
+        google_sheets.connect_sheet("DiaryUserData", "UserInfoLog").get_all_values()
+        google_sheets.connect_sheet("DiaryUserData", "FeedbackLog").get_all_values()
+        google_sheets.connect_sheet("DiaryTemplates", "ShukkinTemplates").get_all_values()
+
+def test_shared_client_authorizes_and_opens_once(fake_sheets):
+    backend, _ = fake_sheets(BOOKS)
+    _connect_many()
+    calls, _ = backend.snapshot()
+    assert calls["client.authorize"] == 1
+    assert calls["DiaryUserData.open"] == 1
+    assert calls["DiaryTemplates.open"] == 1
+    assert calls["DiaryUserData.worksheet"] == 2
+
+def test_per_call_client_round_trips_for_comparison(fake_sheets, monkeypatch):
+    backend, _ = fake_sheets(BOOKS)
+    # 変更前の connect_sheet と同じ往復回数になることを確かめる（比較の基準）
+    monkeypatch.setattr(google_sheets, "get_client", google_sheets.get_client)
+    monkeypatch.setattr(google_sheets, "_spreadsheets", google_sheets._spreadsheets)
+    monkeypatch.setattr(google_sheets, "_worksheets", google_sheets._worksheets)
+    load_test.use_per_call_sheets_client()
+    _connect_many()
+    calls, _ = backend.snapshot()
+    assert calls["client.authorize"] == 30
+    assert calls["DiaryUserData.open"] + calls["DiaryTemplates.open"] == 30
@@ -0,0 +1,45 @@
+import google_sheets
+
+def _books():
+    return {"DiaryTemplates": {"ShukkinTemplates": [
+        ["section", "text", "used_count"],
+        ["opening", "おはよう☀️", "0"],
+        ["closing", "またね🌙", "0"],
+    ]}}
+
+def _calls(backend, op):
+    return backend.snapshot()[0].get(op, 0)
+
+def test_unchanged_sheet_is_not_downloaded_again(fake_sheets, monkeypatch):
+    backend, _ = fake_sheets(_books())
+    monkeypatch.setattr(google_sheets, "TEMPLATE_CACHE_TTL", 0)
+    monkeypatch.setattr(google_sheets, "TEMPLATE_VERSION_CHECK_INTERVAL", 0)
+    for _ in range(3):
+        assert google_sheets.get_cached_templates("DiaryTemplates", "ShukkinTemplates")["opening"] == ["おはよう☀️"]
+    assert _calls(backend, "ShukkinTemplates.get_all_values") == 1
+    assert _calls(backend, "DiaryTemplates.get_lastUpdateTime") == 3
+
+def test_template_edit_invalidates_cache(fake_sheets, monkeypatch):
+    backend, client = fake_sheets(_books())
+    monkeypatch.setattr(google_sheets, "TEMPLATE_CACHE_TTL", 0)
+    monkeypatch.setattr(google_sheets, "TEMPLATE_VERSION_CHECK_INTERVAL", 0)
+    assert google_sheets.get_cached_templates("DiaryTemplates", "ShukkinTemplates")["opening"] == ["おはよう☀️"]
+
+    # オペレーターがシートを編集
+    client.books["DiaryTemplates"].tabs["ShukkinTemplates"].update("B2", [["こんにちは♪"]])
+
+    assert google_sheets.get_cached_templates("DiaryTemplates", "ShukkinTemplates")["opening"] == ["こんにちは♪"]
+    assert _calls(backend, "ShukkinTemplates.get_all_values") == 2
+
+def test_version_check_is_throttled(fake_sheets, monkeypatch):
+    backend, client = fake_sheets(_books())
+    monkeypatch.setattr(google_sheets, "TEMPLATE_CACHE_TTL", 0)
+    monkeypatch.setattr(google_sheets, "TEMPLATE_VERSION_CHECK_INTERVAL", 60)
+    google_sheets.get_cached_templates("DiaryTemplates", "ShukkinTemplates")
+    client.books["DiaryTemplates"].tabs["ShukkinTemplates"].update("B2", [["こんにちは♪"]])
+    # 確認間隔内は前回の更新時刻を使う（次の確認で反映される）
+    assert google_sheets.get_cached_templates("DiaryTemplates", "ShukkinTemplates")["opening"] == ["おはよう☀️"]
+    assert _calls(backend, "DiaryTemplates.get_lastUpdateTime") == 1
+
+    monkeypatch.setattr(google_sheets, "TEMPLATE_VERSION_CHECK_INTERVAL", 0)
+    assert google_sheets.get_cached_templates("DiaryTemplates", "ShukkinTemplates")["opening"] == ["こんにちは♪"]
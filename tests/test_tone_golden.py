@@ -0,0 +1,23 @@
+import os
+import json
+
+import pytest
+
+from tone_utils import adjust_tone_style, TONE_RULES
+from user_register import TONE_OPTIONS
+
+# ✅ 期待値は表引きに書き換える前の adjust_tone_style（if/elif と str.replace の連鎖）の出力
+# fav_words は候補1つだけにして、ランダムな選択が入らないようにしている
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), "golden", "adjust_tone_style.json")
+
+with open(GOLDEN_FILE, "r", encoding="utf-8") as f:
+    CASES = json.load(f)
+
+def test_golden_file_covers_every_tone():
+    tones = {case["tone"] for case in CASES}
+    assert set(TONE_OPTIONS.values()) <= tones
+    assert set(TONE_RULES) == set(TONE_OPTIONS.values())
+
+@pytest.mark.parametrize("case", CASES, ids=lambda case: case["tone"])
+def test_adjust_tone_style_matches_golden(case):
+    assert adjust_tone_style(case["text"], case["tone"], case["name"], case["fav_words"], case["other_requests"]) == case["expected"]
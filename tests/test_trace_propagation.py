@@ -0,0 +1,30 @@
+import logging
+
+import instrumentation
+import diary_generator
+
+def test_prefetch_workers_see_caller_trace():
+    instrumentation.start_trace("trace-a")
+    result = diary_generator.prefetch(first=instrumentation.current_trace, second=instrumentation.current_trace)
+    assert result == {"first": "trace-a", "second": "trace-a"}
+
+    # 同じワーカーが次のイベントでは次のトレースIDを見る
+    instrumentation.start_trace("trace-b")
+    assert diary_generator.prefetch(first=instrumentation.current_trace) == {"first": "trace-b"}
+
+def test_prefetch_worker_logs_carry_trace_id():
+    records = []
+    class Collect(logging.Handler):
+        def emit(self, record):
+            records.append(record.trace_id)
+    handler = Collect()
+    handler.addFilter(instrumentation.TraceIdFilter())
+    logger = logging.getLogger("test_trace_propagation")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        instrumentation.start_trace("trace-log")
+        diary_generator.prefetch(templates=lambda: logger.info("テンプレート取得"))
+    finally:
+        logger.removeHandler(handler)
+    assert records == ["trace-log"]
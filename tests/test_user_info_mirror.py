@@ -0,0 +1,45 @@
+import threading
+
+import google_sheets
+
+HEADER = ["user_id", "源氏名", "年代", "口調", "登録日時", "is_test_user", "ステータス", "申請日時", "店舗名", "通知済み"]
+
+def _books():
+    return {"DiaryUserData": {"UserInfoLog": [HEADER, ["U1", "あい", "20代", "ギャル系", "", "", "承認済", "", "", ""]]}}
+
+def _reads(backend):
+    return backend.snapshot()[0].get("UserInfoLog.get_all_values", 0)
+
+def test_lookup_of_known_user_reads_once(fake_sheets):
+    backend, _ = fake_sheets(_books())
+    for _ in range(5):
+        assert google_sheets.get_user_record("U1")["源氏名"] == "あい"
+        assert google_sheets.is_approved_user("U1")
+    assert _reads(backend) == 1
+
+def test_miss_refreshes_to_find_user_registered_elsewhere(fake_sheets, monkeypatch):
+    backend, client = fake_sheets(_books())
+    monkeypatch.setattr(google_sheets, "USER_INFO_MISS_REFRESH_INTERVAL", 0)
+    assert google_sheets.get_user_record("U1")
+    # 他のワーカーが登録した行
+    client.books["DiaryUserData"].tabs["UserInfoLog"].rows.append(["U2", "みき", "20代", "清楚系"])
+    assert google_sheets.get_user_record("U2")["源氏名"] == "みき"
+    assert google_sheets.find_user_row("U2") == 3
+    assert _reads(backend) == 2
+
+def test_misses_within_interval_do_not_refresh(fake_sheets, monkeypatch):
+    backend, _ = fake_sheets(_books())
+    monkeypatch.setattr(google_sheets, "USER_INFO_MISS_REFRESH_INTERVAL", 60)
+    for _ in range(5):
+        assert google_sheets.get_user_record("U-unknown") is None
+    assert _reads(backend) == 1
+
+def test_concurrent_cold_lookups_read_once(fake_sheets, monkeypatch):
+    backend, _ = fake_sheets(_books(), latency=0.05)
+    monkeypatch.setattr(google_sheets, "USER_INFO_MISS_REFRESH_INTERVAL", 60)
+    threads = [threading.Thread(target=google_sheets.get_user_record, args=(user_id,)) for user_id in ["U1", "U9"] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert _reads(backend) == 1
@@ -259,56 +259,60 @@ TONE_TOPICS = {
     ]
 }
 
+# ---------------------------
+# 文体変換ルール（上から順に適用。結果は従来の str.replace の連鎖と同じ）
+# ---------------------------
+TONE_RULES = {
+    "甘えんぼ系": [("です。", "だよぉ〜💗"), ("ます。", "ましゅ〜🐰")],
+    "ロリ系・妹系": [("です。", "なのっ！"), ("ます。", "ましゅ〜！"), ("だよ。", "だよぉ〜！")],
+    "ギャル系": [("です。", "だよ〜！"), ("ます。", "まーすっ✨"), ("ありがとう", "あざまるっ！")],
+    "ふんわり癒し系": [("です。", "ですよ〜☺️"), ("ます。", "ますね🌸")],
+    "大人っぽ系": [("ですわ。", "です。"), ("ますわね。", "ます。"), ("わね。", "ね。"), ("わ。", "。")],
+    "しっかり真面目系": [("だよ", "です"), ("ね〜", "ですね")],
+    "学園系・初心者風": [("です。", "ですっ！"), ("ます。", "まーすっ！")],
+    "サバサバ系": [("です。", "だね〜。"), ("ます。", "するよー。")],
+    "かっこいい系": [("です。", "だぜ。"), ("ます。", "するぜ！")],
+    "お姉さん系": [("です。", "よ〜ん。"), ("ます。", "しちゃうわね〜💋")],
+    "エステ・スパ風": [("です。", "でございます🌿"), ("ます。", "いたしますね🕊")],
+    "丁寧系": [("だよ", "でございます"), ("ます。", "いたします。")],
+    "ドM系": [("です。", "ごめんなさい…💦"), ("ます。", "されちゃいます…？")],
+    "清楚系": [("です。", "です"), ("ます。", "ます")],
+    "方言系（関西）": [("だよ", "やで"), ("です。", "やん♪"), ("ます。", "しまっせ〜")],
+}
+
+# 自己紹介が2重になるのを避ける
+GREETING_PATTERN = re.compile(r"(こんにちは|おはようございます|こんばんは)[^。！？」]*?(です|だよ)[♪！。]?")
+# お兄ちゃんの呼び方（fav_words で差し替え）
+BROTHER_PATTERN = re.compile(r"おにいちゃん|お兄ちゃん|お兄さま|お兄様")
+# 妹感・ロリの語尾
+SISTER_ENDING_PATTERN = re.compile(r"([だよのね])。")
+
+# 🔧 口調のルールを上から順に str.replace で適用
+# 1つの正規表現にまとめた1回走査も試したが、1口調2〜4ルールでは連鎖の方が数倍速い（python benchmarks.py tone で計測）
+def apply_tone_rules(text, tone):
+    for old, new in TONE_RULES.get(tone, ()):
+        text = text.replace(old, new)
+    return text
+
 def adjust_tone_style(text, tone, name, fav_words=None, other_requests=None):
     # 自己紹介が2重になるのを避ける
-    text = re.sub(r"(こんにちは|おはようございます|こんばんは)[^。！？」]*?(です|だよ)[♪！。]?", "", text, 1)
+    text = GREETING_PATTERN.sub("", text, 1)
 
     # ✅ fav_wordsがあれば、お兄ちゃんの呼び方をランダムに差し替え
     if fav_words:
         candidates = [w.strip() for w in fav_words.split("、") if w.strip()]
         if candidates:
             chosen_word = random.choice(candidates)
-            text = re.sub(r"おにいちゃん|お兄ちゃん|お兄さま|お兄様", chosen_word, text)
+            text = BROTHER_PATTERN.sub(chosen_word, text)
 
     # ✅ toneによる基本文体変換
-    if tone == "甘えんぼ系":
-        text = text.replace("です。", "だよぉ〜💗").replace("ます。", "ましゅ〜🐰")
-    elif tone == "ロリ系・妹系":
-        text = text.replace("です。", "なのっ！").replace("ます。", "ましゅ〜！")
-        text = text.replace("だよ。", "だよぉ〜！")
-    elif tone == "ギャル系":
-        text = text.replace("です。", "だよ〜！").replace("ます。", "まーすっ✨").replace("ありがとう", "あざまるっ！")
-    elif tone == "ふんわり癒し系":
-        text = text.replace("です。", "ですよ〜☺️").replace("ます。", "ますね🌸")
-    elif tone == "大人っぽ系":
-        text = text.replace("ですわ。", "です。").replace("ますわね。", "ます。")\
-                   .replace("わね。", "ね。").replace("わ。", "。")
-    elif tone == "しっかり真面目系":
-        text = text.replace("だよ", "です").replace("ね〜", "ですね")
-    elif tone == "学園系・初心者風":
-        text = text.replace("です。", "ですっ！").replace("ます。", "まーすっ！")
-    elif tone == "サバサバ系":
-        text = text.replace("です。", "だね〜。").replace("ます。", "するよー。")
-    elif tone == "かっこいい系":
-        text = text.replace("です。", "だぜ。").replace("ます。", "するぜ！")
-    elif tone == "お姉さん系":
-        text = text.replace("です。", "よ〜ん。").replace("ます。", "しちゃうわね〜💋")
-    elif tone == "エステ・スパ風":
-        text = text.replace("です。", "でございます🌿").replace("ます。", "いたしますね🕊")
-    elif tone == "丁寧系":
-        text = text.replace("だよ", "でございます").replace("ます。", "いたします。")
-    elif tone == "ドM系":
-        text = text.replace("です。", "ごめんなさい…💦").replace("ます。", "されちゃいます…？")
-    elif tone == "清楚系":
-        text = text.replace("です。", "です").replace("ます。", "ます")
-    elif tone == "方言系（関西）":
-        text = text.replace("だよ", "やで").replace("です。", "やん♪").replace("ます。", "しまっせ〜")
+    text = apply_tone_rules(text, tone)
 
     # ✅ other_requests に応じて文体補強（例：妹感・ロリ・えっち・M）
     if other_requests:
         req = other_requests.lower()
         if "妹" in req or "ロリ" in req:
-            text = re.sub(r"([だよのね])。", r"\1なの〜💕", text)
+            text = SISTER_ENDING_PATTERN.sub(r"\1なの〜💕", text)
             text += "\nぉ兄様のこと、今日もたくさん甘えさせてねっ🥺💗"
         if "m" in req.lower() or "えっち" in req:
             text += "\n…かな、ちょっとムラムラしてきちゃったかも…💦💓"
@@ -0,0 +1,66 @@
+import os
+import threading
+from datetime import datetime
+
+import local_store
+from google_sheets import (
+    use_local_store, init_local_store, sync_usage_to_sheet, get_usage_counts_from_sheet
+)
+
+# ✅ 1日あたりの使用回数の上限判定
+# 回数はローカルDB（SQLite）の (user_id, 日付) カウンタで数え、判定と加算を1回の UPDATE で行う
+# UsageLog へは書き込みバッファ経由で非同期に反映する（古い日付の行は log_archive が月別アーカイブへ移す）
+
+# ✅ 無料ユーザーの1日の生成回数
+FREE_DAILY_LIMIT = int(os.getenv("FREE_DAILY_LIMIT", "3"))
+
+_lock = threading.Lock()
+_prepared_date = None
+
+metrics = {
+    "consumed": 0,
+    "rejected": 0,
+    "seeded_users": 0,
+}
+
+def today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+# 🔧 日付が変わって最初の呼び出しで、カウンタの初期値を取り込む
+# primary では UsageLog が正なので、その日の回数をシートから1回だけ取り込む（ローカルの方が多ければそのまま）
+def _prepare(date):
+    global _prepared_date
+    if _prepared_date == date:
+        return
+    with _lock:
+        if _prepared_date == date:
+            return
+        if use_local_store():
+            init_local_store()
+        elif local_store.get_meta("usage_seeded_date") != date:
+            counts = get_usage_counts_from_sheet(date)
+            local_store.merge_usage(date, counts)
+            local_store.set_meta("usage_seeded_date", date)
+            metrics["seeded_users"] += len(counts)
+        _prepared_date = date
+
+# ✅ 1回分を使う。上限に達していれば加算しない → (使えたか, 今日の回数)
+# limit=None は上限なし（プレミアム・テストユーザー）
+def try_consume(user_id, date=None, limit=FREE_DAILY_LIMIT):
+    date = date or today()
+    _prepare(date)
+    allowed, count = local_store.try_increment_usage(user_id, date, limit)
+    if allowed:
+        sync_usage_to_sheet(user_id, date)
+    with _lock:
+        metrics["consumed" if allowed else "rejected"] += 1
+    return allowed, count
+
+def get_count(user_id, date=None):
+    date = date or today()
+    _prepare(date)
+    return local_store.get_usage_count(user_id, date)
+
+def get_metrics():
+    with _lock:
+        return dict(metrics, limit=FREE_DAILY_LIMIT, date=_prepared_date)
@@ -1,7 +1,6 @@
 import os 
-import gspread
-from google.oauth2.service_account import Credentials
-from google_sheets import save_user_info_to_sheet
+import session_store
+from google_sheets import save_user_info_to_sheet, get_user_record
 
 # ✅ 口調（tone）番号と名称対応
 TONE_OPTIONS = {
@@ -34,19 +33,11 @@ REGISTER_QUESTIONS = {
 }
 
 # ✅ 登録中のユーザー管理用
-registering_users = {}
+registering_users = session_store.namespace("registering_users")
 
 # ✅ ユーザー情報キャッシュ
 user_info_cache = {}
 
-# ✅ Google Sheets 認証情報
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
-creds = Credentials.from_service_account_file('/etc/secrets/credentials.json', scopes=SCOPES)
-client = gspread.authorize(creds)
-
 SHEET_NAME = "DiaryUserData"
 TAB_NAME = "UserInfoLog"
 
@@ -60,23 +51,25 @@ def handle_registration_step(user_id, message_text):
         registering_users[user_id] = {"step": 0, "data": {}}
         return REGISTER_QUESTIONS[REGISTER_STEPS[0]]
 
-    step = registering_users[user_id]["step"]
+    state = registering_users[user_id]
+    step = state["step"]
     current_key = REGISTER_STEPS[step]
 
     if current_key == "tone":
         if message_text not in TONE_OPTIONS:
             return "番号を1〜15の中から一つ選んでね♪"
-        registering_users[user_id]["data"][current_key] = TONE_OPTIONS[message_text]
+        state["data"][current_key] = TONE_OPTIONS[message_text]
     else:
-        registering_users[user_id]["data"][current_key] = message_text
+        state["data"][current_key] = message_text
 
     step += 1
     if step < len(REGISTER_STEPS):
         next_key = REGISTER_STEPS[step]
-        registering_users[user_id]["step"] = step
+        state["step"] = step
+        registering_users[user_id] = state
         return REGISTER_QUESTIONS[next_key]
     else:
-        user_data = registering_users[user_id]["data"]
+        user_data = state["data"]
 
         save_user_info_to_sheet(user_id, user_data)
         refresh_user_info_cache(user_id)
@@ -97,20 +90,17 @@ def get_user_info(user_id):
     if user_id in user_info_cache:
         return user_info_cache[user_id]
 
-    sheet = client.open(SHEET_NAME).worksheet(TAB_NAME)
-    data = sheet.get_all_records()
-
-    for row in data:
-        if str(row.get("user_id", "")).strip() == str(user_id).strip():
-            user_info = {
-                "user_id": row.get("user_id"),
-                "name": row.get("源氏名"),
-                "age_range": row.get("年代"),
-                "tone": row.get("口調"),
-                "is_premium": row.get("is_premium", False)
-            }
-            user_info_cache[user_id] = user_info
-            return user_info
+    row = get_user_record(user_id)
+    if row:
+        user_info = {
+            "user_id": row.get("user_id"),
+            "name": row.get("源氏名"),
+            "age_range": row.get("年代"),
+            "tone": row.get("口調"),
+            "is_premium": row.get("is_premium", False)
+        }
+        user_info_cache[user_id] = user_info
+        return user_info
     return None
 
 # ✅ キャッシュを更新
@@ -0,0 +1,90 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+
+# ✅ Webhookイベントをバックグラウンドで処理するワーカープール
+# /callback は署名検証後にキューへ積むだけで即 200 を返す
+# 同じユーザーのイベントは同じワーカーに振り分け、登録フローなどの順序を保つ
+
+_queues = []
+_workers = []
+_lock = threading.Lock()
+
+# ✅ キュー深さ・待ち時間・処理時間のメトリクス
+metrics = {
+    "enqueued": 0,
+    "processed": 0,
+    "failed": 0,
+    "rejected": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+    "process_seconds_total": 0.0,
+    "process_seconds_max": 0.0,
+}
+
+def start_workers(process_fn, concurrency=4, max_queue_size=100):
+    with _lock:
+        if _queues:
+            return
+        for i in range(concurrency):
+            worker_queue = queue.Queue(maxsize=max(1, max_queue_size // concurrency))
+            _queues.append(worker_queue)
+            worker = threading.Thread(target=_worker_loop, args=(worker_queue, process_fn), name=f"webhook-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+        atexit.register(drain, 10)
+        logging.info(f"[Webhook] ワーカー起動 concurrency={concurrency}, max_queue_size={max_queue_size}")
+
+# ✅ キューへ積む。満杯なら False（呼び出し側で同期処理にフォールバック）
+def enqueue(key, *args):
+    worker_queue = _queues[hash(key) % len(_queues)]
+    try:
+        worker_queue.put_nowait((time.monotonic(), args))
+    except queue.Full:
+        with _lock:
+            metrics["rejected"] += 1
+        return False
+    with _lock:
+        metrics["enqueued"] += 1
+    return True
+
+def _worker_loop(worker_queue, process_fn):
+    while True:
+        enqueued_at, args = worker_queue.get()
+        started_at = time.monotonic()
+        failed = False
+        try:
+            process_fn(*args)
+        except Exception:
+            failed = True
+            logging.exception("[Webhook] イベント処理中にエラー")
+        finally:
+            finished_at = time.monotonic()
+            _record(started_at - enqueued_at, finished_at - started_at, failed)
+            worker_queue.task_done()
+
+def _record(wait, elapsed, failed):
+    with _lock:
+        metrics["failed" if failed else "processed"] += 1
+        metrics["wait_seconds_total"] += wait
+        metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], wait)
+        metrics["process_seconds_total"] += elapsed
+        metrics["process_seconds_max"] = max(metrics["process_seconds_max"], elapsed)
+
+def get_metrics():
+    with _lock:
+        snapshot = dict(metrics)
+    snapshot["queue_depth"] = sum(q.qsize() for q in _queues)
+    snapshot["workers"] = len(_workers)
+    return snapshot
+
+# ✅ 終了時などに残りのイベントを処理し切るまで待つ
+def drain(timeout=None):
+    deadline = time.monotonic() + timeout if timeout else None
+    while any(q.unfinished_tasks for q in _queues):
+        if deadline and time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True